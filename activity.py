@@ -0,0 +1,189 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+from pagination import keyset_filter, encode_cursor
+from follows import follower_usernames, follows_any
+import globals
+
+users = globals.db.users
+activities = globals.db.activities
+timelines = globals.db.timelines
+
+FANOUT_FOLLOWER_LIMIT = 1000 # Above this many followers an account's activity is merged into feeds on read instead
+FOLLOW_BACKFILL = 50 # Recent activities copied into a timeline when someone new is followed
+FEED_PAGE_SIZE = 20
+
+# ACTIVITY EVENTS
+#------------------------------------------------------------------------------------------------------------------
+# Every review, review reply, thought, thought reply and reading update is written once to the activities
+# collection and copied ("fanned out") into the timeline of its author and of each of their followers.
+# A feed page is then a single indexed read of the reader's timeline, paged by (timestamp, activity id) so activities
+# sharing a timestamp are never skipped. Accounts with more than FANOUT_FOLLOWER_LIMIT followers are marked
+# skip_fanout and their activities are merged in when the feed is read.
+def _timeline_entry(owner, activity):
+    return {
+        "owner": owner,
+        "activity_id": activity["_id"],
+        "actor": activity["username"],
+        "timestamp": activity["timestamp"],
+        "activity": activity
+    }
+
+
+def record_activity(username, activity_type, timestamp=None, **details):
+    """ Store one activity and fan it out to the timelines of the user and their followers """
+    activity = {
+        "_id": ObjectId(),
+        "username": username,
+        "activity_type": activity_type,
+        "timestamp": timestamp or datetime.utcnow(),
+        **details
+    }
+    activities.insert_one(activity)
+
+    user = users.find_one({"username": username}, {"followers_count": 1, "skip_fanout": 1})
+    skip_fanout = user.get("followers_count", 0) > FANOUT_FOLLOWER_LIMIT if user else False
+
+    if user and skip_fanout != user.get("skip_fanout", False):
+        users.update_one({"_id": user["_id"]}, {"$set": {"skip_fanout": skip_fanout}})
+
+    owners = [username]
+    if not skip_fanout:
+        owners.extend(follower_usernames(username))
+    timelines.insert_many([_timeline_entry(owner, activity) for owner in owners], ordered=False)
+    return activity
+
+
+def remove_activities(**match):
+    """ Remove the activities for a deleted review/reply/thought, e.g. remove_activities(review_id="...") """
+    activity_ids = [activity["_id"] for activity in activities.find(match, {"_id": 1})]
+    if activity_ids:
+        activities.delete_many({"_id": {"$in": activity_ids}})
+        timelines.delete_many({"activity_id": {"$in": activity_ids}})
+
+
+def rename_activities(old_username, new_username):
+    """ Rewrite a renamed user's name in the activities and fanned-out timeline entries that carry it """
+    for field in ("username", "review_user", "thought_user"):
+        activities.update_many({field: old_username}, {"$set": {field: new_username}})
+    timelines.update_many({"owner": old_username}, {"$set": {"owner": new_username}})
+    timelines.update_many({"actor": old_username}, {"$set": {"actor": new_username, "activity.username": new_username}})
+    for field in ("review_user", "thought_user"):
+        timelines.update_many({f"activity.{field}": old_username}, {"$set": {f"activity.{field}": new_username}})
+
+
+def follow_timeline(owner, followed_username):
+    """ Copy the recent activities of a newly followed user into the follower's timeline """
+    recent = activities.find({"username": followed_username}).sort("timestamp", DESCENDING).limit(FOLLOW_BACKFILL)
+    entries = [_timeline_entry(owner, activity) for activity in recent]
+    if entries:
+        timelines.insert_many(entries, ordered=False)
+
+
+def unfollow_timeline(owner, followed_username):
+    timelines.delete_many({"owner": owner, "actor": followed_username})
+
+
+def unfollow_timelines(owners, followed_usernames):
+    """ Bulk unfollow_timeline, for removing all followers / all following at once """
+    if owners and followed_usernames:
+        timelines.delete_many({"owner": {"$in": owners}, "actor": {"$in": followed_usernames}})
+
+
+TIMELINE_SORT = [("timestamp", DESCENDING), ("activity_id", DESCENDING)]
+ACTIVITY_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+
+def _after(query, sort, after):
+    if after is not None:
+        query = {"$and": [query, keyset_filter(sort, after)]}
+    return query
+
+
+def read_feed(username, after=None, limit=FEED_PAGE_SIZE):
+    """ Newest-first page of a user's feed. `after` is the (timestamp, activity id) of the last activity already seen """
+    page = [
+        entry["activity"]
+        for entry in timelines.find(_after({"owner": username}, TIMELINE_SORT, after)).sort(TIMELINE_SORT).limit(limit)
+    ]
+
+    # Accounts that are too big to fan out are merged in on read
+    skip_fanout = [user["username"] for user in users.find({"skip_fanout": True}, {"username": 1})]
+    skipped = follows_any(username, skip_fanout)
+    if skipped:
+        merged = {activity["_id"]: activity for activity in page}
+        query = _after({"username": {"$in": skipped}}, ACTIVITY_SORT, after)
+        for activity in activities.find(query).sort(ACTIVITY_SORT).limit(limit):
+            merged[activity["_id"]] = activity
+        page = sorted(merged.values(), key=lambda activity: (activity["timestamp"], activity["_id"]), reverse=True)[:limit]
+
+    next_cursor = encode_cursor([page[-1]["timestamp"], page[-1]["_id"]]) if len(page) == limit else None
+    return page, next_cursor
+
+
+# BACKFILL
+#------------------------------------------------------------------------------------------------------------------
+def _parse_timestamp(ts):
+    if isinstance(ts, str):
+        try:
+            return datetime.fromisoformat(ts)
+        except ValueError:
+            return datetime.min
+    return ts if isinstance(ts, datetime) else datetime.min
+
+
+def backfill():
+    """ One-off: build activities and timelines from the reviews, replies, thoughts and shelves already stored """
+    books = globals.db.books
+    reviews = globals.db.reviews
+    review_replies = globals.db.review_replies
+    thoughts = globals.db.thoughts
+    shelves = globals.db.shelves
+
+    activities.delete_many({})
+    timelines.delete_many({})
+
+    titles = {book["_id"]: book["title"] for book in books.find({}, {"title": 1})}
+    review_authors = {}
+
+    for review in reviews.find():
+        review_authors[review["_id"]] = review["username"]
+        record_activity(review["username"], "reviewed", review.get("created_at"),
+                        book_id=str(review["book_id"]), book_title=titles.get(review["book_id"]),
+                        review_id=str(review["_id"]), review_content=review["comment"])
+
+    for reply in review_replies.find():
+        record_activity(reply["username"], "replied to a review by", reply.get("created_at"),
+                        review_user=review_authors.get(reply["review_id"]), book_id=str(reply["book_id"]),
+                        review_id=str(reply["review_id"]), reply_id=str(reply["_id"]),
+                        review_reply_content=reply["content"])
+
+    for thought in thoughts.find():
+        record_activity(thought["username"], "posted a thought", thought.get("created_at"),
+                        thought_id=str(thought["_id"]), thought_content=thought["comment"])
+        for reply in thought.get("replies", []):
+            record_activity(reply["username"], "replied to a thought by", reply.get("created_at"),
+                            thought_id=str(thought["_id"]), thought_user=thought["username"],
+                            reply_id=str(reply["_id"]), reply_content=reply["content"])
+
+    usernames = {user["_id"]: user["username"] for user in users.find({}, {"username": 1})}
+    for entry in shelves.find({"shelf": {"$in": ["currently_reading", "have_read"]}}):
+        username = usernames.get(entry["user_id"])
+        if username is None:
+            continue
+        title = titles.get(entry["book_id"], "Unknown Title")
+        if entry["shelf"] == "currently_reading":
+            progress = entry.get("progress", 0)
+            record_activity(username, "Started Reading" if progress == 0 else "Reading Progress",
+                            _parse_timestamp(entry.get("reading_time")), book_id=str(entry["book_id"]),
+                            book_title=title, progress=f"{progress}%",
+                            current_page=f"{entry.get('current_page', 0)} / {entry.get('total_pages', 0)}")
+        else:
+            record_activity(username, "Finished Reading", _parse_timestamp(entry.get("date_read")),
+                            book_id=str(entry["book_id"]), book_title=title, rating=f"{entry.get('stars')}")
+
+    print(f"Backfilled {activities.count_documents({})} activities")
+
+
+if __name__ == "__main__":
+    backfill()
@@ -3,64 +3,80 @@ import globals
 
 books = globals.db.books
 users = globals.db.users
+reviews = globals.db.reviews
+shelves = globals.db.shelves
 
-def user_score_aggregation(book_id): 
+POSITIVE_REVIEW_STARS = 3 # Reviews with at least this many stars count towards the user score
+
+# user_score is the share of positive reviews, out of 5 and rounded to one decimal place
+USER_SCORE_EXPRESSION = {
+    "$cond": {
+        "if": {"$eq": ["$total_reviews", 0]},  # If there are no reviews
+        "then": 0,  # Set user score to 0
+        "else": {
+            "$round": [
+                { 
+                    "$multiply": [
+                        {"$divide": ["$positive_reviews", "$total_reviews"]},
+                        5  # Score out of 5
+                    ]
+                },
+                1
+            ]
+        }
+    }
+}
+
+def review_counter_update(stars, change):
+    """ Update pipeline that adds (change=1) or removes (change=-1) one review from a book's running counters
+        and derives user_score from them in the same write """
+    positive_change = change if stars >= POSITIVE_REVIEW_STARS else 0
+    return [
+        {
+            "$set": {
+                "total_reviews": {"$add": [{"$ifNull": ["$total_reviews", 0]}, change]},
+                "positive_reviews": {"$add": [{"$ifNull": ["$positive_reviews", 0]}, positive_change]}
+            }
+        },
+        {
+            "$set": {"user_score": USER_SCORE_EXPRESSION}
+        }
+    ]
+
+def review_counter_aggregation(book_id=None): 
+    """ Recount total_reviews/positive_reviews/user_score from the reviews collection, for one book or all of them """
     pipeline = [ 
-        { 
-            "$match": {"_id": ObjectId(book_id)} 
-        }, 
-        { 
-            "$unwind": "$user_reviews" 
-        }, 
         { 
             "$group": { 
-                "_id": "$_id", 
+                "_id": "$book_id", 
                 "total_reviews": {"$sum": 1}, 
                 "positive_reviews": { 
                     "$sum": { 
-                        "$cond": [{"$gte": ["$user_reviews.stars", 3]}, 1, 0] 
+                        "$cond": [{"$gte": ["$stars", POSITIVE_REVIEW_STARS]}, 1, 0] 
                     } 
                 } 
             } 
         },
         { 
-            "$project": { 
-                "user_score": {
-                    "$cond": {
-                        "if": {"$eq": ["$total_reviews", 0]},  # If there are no reviews
-                        "then": 0,  # Set user score to 0
-                        "else": {
-                            "$round": [
-                                { 
-                                    "$multiply": [
-                                        {"$divide": ["$positive_reviews", "$total_reviews"]},
-                                        5  # Score out of 5
-                                    ]
-                                },
-                                1
-                            ]
-                        }
-                    }
-                } 
+            "$set": { 
+                "user_score": USER_SCORE_EXPRESSION
             } 
         }
     ] 
-    result = list(books.aggregate(pipeline)) 
-    return result[0]['user_score'] if result else 0  # Ensure user score is 0 if no reviews exist
+    if book_id is not None:
+        pipeline.insert(0, {"$match": {"book_id": ObjectId(book_id)}})
+    return list(reviews.aggregate(pipeline))
 
 def user_progress_aggregation(user_id):
     pipeline = [
         {
-            "$match": {"_id": ObjectId(user_id)}
-        },
-        {
-            "$unwind": "$currently_reading"
+            "$match": {"user_id": ObjectId(user_id), "shelf": "currently_reading"}
         },
         {
             "$group": {
-                "_id": "$_id",
-                "total_pages": {"$sum": "$currently_reading.total_pages"},
-                "read_pages": {"$sum": "$currently_reading.current_page"}
+                "_id": "$user_id",
+                "total_pages": {"$sum": "$total_pages"},
+                "read_pages": {"$sum": "$current_page"}
             }
         },
         {
@@ -83,5 +99,5 @@ def user_progress_aggregation(user_id):
             }
         }
     ]
-    result = list(users.aggregate(pipeline))
+    result = list(shelves.aggregate(pipeline))
     return result[0]['progress_percentage'] if result else 0
@@ -12,24 +12,31 @@ from blueprints.thoughts.thoughts import thoughts_bp
 from blueprints.reports.reports import reports_bp
 from blueprints.deleted_accounts.deleted_accounts import deleted_accounts_bp
 from flask_cors import CORS
+from indexes import ensure_indexes
+from search import backfill_search_keys
+from facets import seed_facets
 
-app = Flask(__name__)
-CORS(app, origins="http://localhost:4200")
+BLUEPRINTS = [
+    books_bp, request_books_bp, genres_bp, authors_bp, triggers_bp, reviews_bp, auth_bp, messages_bp,
+    imgur_upload_bp, thoughts_bp, reports_bp, deleted_accounts_bp
+]
 
-app.register_blueprint(books_bp)
-app.register_blueprint(request_books_bp)
-app.register_blueprint(genres_bp)
-app.register_blueprint(authors_bp)
-app.register_blueprint(triggers_bp)
-app.register_blueprint(reviews_bp)
-app.register_blueprint(auth_bp)
-app.register_blueprint(messages_bp)
-app.register_blueprint(imgur_upload_bp)
-app.register_blueprint(thoughts_bp)
-app.register_blueprint(reports_bp)
-app.register_blueprint(deleted_accounts_bp)
 
+def create_app():
+    """ The WSGI application: python app.py runs it on the development server, wsgi.py serves it with gunicorn """
+    app = Flask(__name__)
+    CORS(app, origins="http://localhost:4200", expose_headers=["X-Next-Cursor", "ETag", "X-Cache"])
+
+    for blueprint in BLUEPRINTS:
+        app.register_blueprint(blueprint)
+
+    # Make sure every collection has the indexes the blueprints rely on
+    ensure_indexes()
+    # Fill in the derived data for books stored before it existed
+    backfill_search_keys()
+    seed_facets()
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import subprocess
+import signal
+import socket
+import time
+import sys
+import os
+
+HOST = "127.0.0.1"
+PORT = 5000
+DURATION = 20 # Seconds of load per server
+CONCURRENCY = 32 # Client connections kept busy at once
+PATHS = ["/api/v1.0/books?limit=20", "/api/v1.0/top-books", "/api/v1.0/new-releases", "/api/v1.0/genres"]
+SERVERS = {
+    "dev": [sys.executable, "app.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+    "gthread": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+}
+SERVER_ENV = {"gthread": {"WEB_WORKER_CLASS": "gthread"}} # gunicorn otherwise runs its default worker class
+
+# SERVING THROUGHPUT BENCHMARK
+#------------------------------------------------------------------------------------------------------------------
+# Starts each server in turn on the same machine and database, keeps CONCURRENCY keep-alive connections busy with
+# the public read endpoints for DURATION seconds, and prints requests per second and latency percentiles:
+#   python bench_serving.py [dev] [gunicorn] [gthread] [seconds] [connections]
+# Run it against a seeded database with mongod on localhost, with gunicorn.conf.py's defaults (WEB_CONCURRENCY,
+# WEB_THREADS...) set as they will be in production. Nothing else should be listening on PORT.
+def wait_for_port(timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, PORT), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def client(deadline, offset):
+    connection = http.client.HTTPConnection(HOST, PORT, timeout=30)
+    latencies, errors, i = [], 0, offset
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request("GET", PATHS[i % len(PATHS)])
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+        i += 1
+    connection.close()
+    return latencies, errors
+
+
+def run_load(seconds, connections):
+    deadline = time.time() + seconds
+    with ThreadPoolExecutor(connections) as pool:
+        results = list(pool.map(lambda offset: client(deadline, offset), range(connections)))
+    latencies = sorted(latency for found, _ in results for latency in found)
+    errors = sum(errors for _, errors in results)
+    return latencies, errors
+
+
+def percentile(latencies, share):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * share))] * 1000 if latencies else 0.0
+
+
+def benchmark(name, seconds, connections):
+    server = subprocess.Popen(SERVERS[name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              env={**os.environ, **SERVER_ENV.get(name, {}), "BIND": f"{HOST}:{PORT}"}, start_new_session=True)
+    try:
+        if not wait_for_port():
+            print(f"{name:>9} | did not start")
+            return
+        run_load(2, connections) # Warm up: connections, caches, lazy imports
+        latencies, errors = run_load(seconds, connections)
+        print(
+            f"{name:>9} | {len(latencies) / seconds:>9.1f} req/s | p50 {percentile(latencies, 0.5):>7.1f} ms"
+            f" | p99 {percentile(latencies, 0.99):>7.1f} ms | {errors} errors"
+        )
+    finally:
+        # The dev server's reloader runs the app in a child process, stop the whole group
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+if __name__ == "__main__":
+    names = [arg for arg in sys.argv[1:] if arg in SERVERS] or list(SERVERS)
+    numbers = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+    seconds = numbers[0] if numbers else DURATION
+    connections = numbers[1] if len(numbers) > 1 else CONCURRENCY
+    print(f"{seconds}s of load, {connections} connections, {', '.join(PATHS)}")
+    for name in names:
+        benchmark(name, seconds, connections)
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+import timeit
+import uuid
+import sys
+import jwt
+
+SECRET = "benchmark-secret-of-at-least-32-bytes"
+DECODES = 1000
+
+# TOKEN SIZE / DECODE BENCHMARK
+#------------------------------------------------------------------------------------------------------------------
+# Compares the old login claims (profile plus the whole followers/following lists) with the slim claim set, for
+# accounts of different sizes:  python bench_tokens.py [follow counts...]
+def old_claims(follows):
+    return {
+        'name': "Benchmark Reader",
+        'username': "benchmark_reader",
+        'admin': False,
+        'followers': [{"_id": "%024x" % i, "username": f"follower_{i}"} for i in range(follows)],
+        'following': [{"_id": "%024x" % i, "username": f"followed_{i}"} for i in range(follows)],
+        'user_type': "reader",
+        'exp': datetime.now(timezone.utc) + timedelta(hours=1)
+    }
+
+
+def slim_claims(follows):
+    return {
+        'uid': "%024x" % 0,
+        'username': "benchmark_reader",
+        'admin': False,
+        'user_type': "reader",
+        'sid': uuid.uuid4().hex,
+        'exp': datetime.now(timezone.utc) + timedelta(hours=1)
+    }
+
+
+def measure(claims):
+    token = jwt.encode(claims, SECRET, algorithm="HS256")
+    seconds = timeit.timeit(lambda: jwt.decode(token, SECRET, algorithms=["HS256"]), number=DECODES)
+    return len(token), seconds / DECODES * 1e6
+
+
+if __name__ == "__main__":
+    follow_counts = [int(count) for count in sys.argv[1:]] or [0, 10, 100, 500]
+    print(f"{'follows':>8} | {'old header':>11} {'old decode':>11} | {'slim header':>11} {'slim decode':>11}")
+    for follows in follow_counts:
+        old_size, old_us = measure(old_claims(follows))
+        slim_size, slim_us = measure(slim_claims(follows))
+        print(f"{follows:>8} | {old_size:>9} B {old_us:>8.1f} us | {slim_size:>9} B {slim_us:>8.1f} us")
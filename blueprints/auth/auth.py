@@ -3,9 +3,16 @@ import jwt
 from datetime import datetime, timedelta, timezone
 import bcrypt
 import globals
-from decorators import jwt_required, admin_required
+from decorators import jwt_required, admin_required, blacklist_token
 from bson import ObjectId
 from blueprints.messages.messages import send_message
+from recommendations import STALE
+from activity import (read_feed, follow_timeline, unfollow_timeline, unfollow_timelines, rename_activities,
+                      FEED_PAGE_SIZE, TIMELINE_SORT)
+from sessions import new_session_id, end_session
+from follows import follow, unfollow, remove_followers, remove_following, remove_user, rename_user
+from shelves import shelf_counts, remove_user_shelves
+from pagination import paginate, page_response, page_args
 
 auth_bp = Blueprint("auth_bp", __name__)
 
@@ -13,8 +20,11 @@ blacklist = globals.db.blacklist
 users = globals.db.users
 books = globals.db.books
 thoughts = globals.db.thoughts
+reviews = globals.db.reviews
 banned_emails = globals.db.banned_emails
 deleted_accounts = globals.db.deleted_accounts
+recommendations = globals.db.recommendations
+follows = globals.db.follows
 
 # AUTH APIS
 #------------------------------------------------------------------------------------------------------------------
@@ -53,13 +63,10 @@ def signup():
         'user_type': user_type,
         'favourite_genres': favourite_genres.split(",") if favourite_genres else [],
         'favourite_authors': favourite_authors.split(",") if favourite_authors else [],
-        'favourite_books': [],
         'profile_pic': '',
-        'followers': [],
-        'following': [],
-        'have_read': [],
-        'want_to_read': [],
-        'currently_reading': [],
+        'followers_count': 0,
+        'following_count': 0,
+        'have_read_count': 0,
         'awards': [],
         'admin': admin,
         'created_at': current_time,
@@ -98,13 +105,13 @@ def login():
                     return make_response(jsonify({'message': f'Account is suspended. Come back in {remaining_minutes} minutes'}), 403)
 
             if bcrypt.checkpw(bytes(auth.password, 'UTF-8'), user["password"]):
+                # Fixed, small claim set. Profile data is looked up per session (sessions.session_profile)
                 token = jwt.encode( {
-                    'name': user['name'],
+                    'uid': str(user['_id']),
                     'username': auth.username,
                     'admin': user['admin'],
-                    'followers': user['followers'],
-                    'following': user['following'],
                     'user_type': user['user_type'],
+                    'sid': new_session_id(),
                     'exp': datetime.now(timezone.utc) + timedelta(hours=1) }, globals.secret_key, algorithm="HS256")
                 return make_response(jsonify({'token': token}), 200)
             else:
@@ -125,7 +132,8 @@ def login():
 @jwt_required
 def logout():
     token = request.headers['x-access-token']
-    blacklist.insert_one({"token": token})
+    blacklist_token(token)
+    end_session(request.token_data)
     return make_response(jsonify({'message' : 'Logout Successful'}), 200)
 
 def serialize_user(user):
@@ -133,25 +141,36 @@ def serialize_user(user):
     user['_id'] = str(user['_id'])
     return user
 
+def remove_account_data(user):
+    """ Everything kept about a user outside their own document, once that is deleted or banned """
+    remove_user(user)
+    remove_user_shelves(user["_id"])
+    recommendations.delete_many({"user_id": user["_id"]})
+
+
+def book_titles_for(items):
+    """ Look up the titles of the books a list of reviews/replies belong to in one query """
+    book_ids = list({item["book_id"] for item in items})
+    return {book["_id"]: book["title"] for book in books.find({"_id": {"$in": book_ids}}, {"title": 1})}
+
 
 #------------------------------------------------------------------------------------------------------------------
 # 2. USER CRUD FEATURES
 @auth_bp.route('/api/v1.0/users', methods=["GET"])
 @jwt_required
 def show_all_users():
-    page_num, page_size = 1, 10
     search_username = request.args.get('username')
 
     query = {}
     if search_username:
         query["username"] = {"$regex": search_username, "$options": "i"}
 
-    users_list = list(users.find(query, {'password': 0}))
+    users_list, next_cursor = paginate(users, query, projection={'password': 0}, default_page_size=None)
 
     for user in users_list:
         user['_id'] = str(user['_id'])
 
-    return make_response(jsonify(users_list), 200)
+    return page_response(users_list, next_cursor)
 
 
 
@@ -163,23 +182,24 @@ def show_one_user(id):
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
     
+    user["shelves"] = shelf_counts(user["_id"])
     user["_id"] = str(user["_id"])
     
     reviews_by_user = []
     books_by_author = []
     
     if user.get("user_type") == "author":
-        for book in books.find({"author": user["name"]}):
+        for book in books.find({"author": user["name"]}, {"search_keys": 0}):
             book["_id"] = str(book["_id"])
             books_by_author.append(book)
 
-    for book in books.find({"user_reviews.username": user["username"]}):
-        for review in book.get("user_reviews", []):
-            if review.get("username") == user["username"]:
-                review["_id"] = str(review["_id"])
-                review["book_id"] = str(book["_id"])
-                review["book_title"] = book["title"]
-                reviews_by_user.append(review)
+    user_reviews = list(reviews.find({"username": user["username"]}).sort("created_at", -1))
+    book_titles = book_titles_for(user_reviews)
+    for review in user_reviews:
+        review["book_title"] = book_titles.get(review["book_id"])
+        review["_id"] = str(review["_id"])
+        review["book_id"] = str(review["book_id"])
+        reviews_by_user.append(review)
     
     response_data = {
         "user": user,
@@ -193,8 +213,10 @@ def show_one_user(id):
 @jwt_required
 @admin_required
 def delete_user(id):
+    user = users.find_one({"_id": ObjectId(id)}, {"username": 1})
     result = users.delete_one({"_id":ObjectId(id)})
     if result.deleted_count == 1:
+        remove_account_data(user)
         return make_response(jsonify({}), 204)
     else:
         return make_response(jsonify({"error": "Invalid user ID"}), 404)
@@ -220,20 +242,10 @@ def follow_user(id):
     if id == str(user["_id"]):
         return make_response(jsonify({"error": "You cannot follow yourself"}), 400)
 
-    following_data = {
-        "_id": id,
-        "username": user_to_follow["username"]
-    }
-    
-    follower_data = {
-        "_id": str(user["_id"]),
-        "username": username
-    }
-
+    if not follow(user, user_to_follow):
+        return make_response(jsonify({"message": f"You already follow {user_to_follow['username']}"}), 200)
 
-    users.update_one({"_id": user["_id"]}, {"$push": {"following": following_data}})
-
-    users.update_one({"_id": user_to_follow["_id"]}, {"$push": {"followers": follower_data}})
+    follow_timeline(username, user_to_follow["username"])
 
     return make_response(jsonify({"message": f"Successfully followed {user_to_follow['username']}"}), 200)
 
@@ -255,13 +267,33 @@ def unfollow_user(id):
     if id == str(user["_id"]):
         return make_response(jsonify({"error": "You cannot unfollow yourself"}), 400)
 
-    
+    if not unfollow(user, user_to_unfollow):
+        return make_response(jsonify({"message": f"You do not follow {user_to_unfollow['username']}"}), 200)
 
-    users.update_one({"_id": user["_id"]}, {"$pull": {"following": id}})
-    users.update_one({"_id": user_to_unfollow["_id"]}, {"$pull": {"followers": user["_id"]}})
+    unfollow_timeline(username, user_to_unfollow["username"])
 
     return make_response(jsonify({"message": f"Successfully unfollowed {user_to_unfollow['username']}"}), 200)
 
+@auth_bp.route('/api/v1.0/users/<string:id>/followers', methods=["GET"])
+def show_followers(id):
+    user = users.find_one({"_id": ObjectId(id)}, {"username": 1})
+    if not user:
+        return make_response(jsonify({"error": "User not found"}), 404)
+
+    page, next_cursor = paginate(follows, {"followee": user["username"]}, sort=[("created_at", -1)], default_page_size=20)
+    followers = [{"_id": str(edge["follower_id"]), "username": edge["follower"]} for edge in page]
+    return page_response(followers, next_cursor)
+
+@auth_bp.route('/api/v1.0/users/<string:id>/following', methods=["GET"])
+def show_following(id):
+    user = users.find_one({"_id": ObjectId(id)}, {"username": 1})
+    if not user:
+        return make_response(jsonify({"error": "User not found"}), 404)
+
+    page, next_cursor = paginate(follows, {"follower": user["username"]}, sort=[("created_at", -1)], default_page_size=20)
+    following = [{"_id": str(edge["followee_id"]), "username": edge["followee"]} for edge in page]
+    return page_response(following, next_cursor)
+
 #------------------------------------------------------------------------------------------------------------------
 # 3.5. DELETE FOLLOW FEATURES FOR TESTING
 @auth_bp.route('/api/v1.0/remove-all-followers', methods=["POST"])
@@ -274,10 +306,8 @@ def remove_all_followers():
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$set": {"followers": []}})
-
-    for follower in user['followers']:
-        users.update_one({"_id": ObjectId(follower['id'])}, {"$pull": {"following": user["_id"]}})
+    followers = remove_followers(user)
+    unfollow_timelines(followers, [username])
 
     return make_response(jsonify({"message": "All followers removed successfully"}), 200)
 
@@ -291,10 +321,8 @@ def remove_all_following():
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$set": {"following": []}})
-
-    for follower in user['followers']:
-        users.update_one({"_id": ObjectId(follower['id'])}, {"$pull": {"following": user["_id"]}})
+    following = remove_following(user)
+    unfollow_timelines([username], following)
 
     return make_response(jsonify({"message": "All followers removed successfully"}), 200)
 
@@ -307,196 +335,22 @@ def user_feed():
     token_data = request.token_data
     username = token_data['username']
     
-    user = users.find_one({"username": username})
+    user = users.find_one({"username": username}, {"following_count": 1})
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    following_list = user.get("following", [])
-    if not following_list:
+    if not user.get("following_count", 0):
         return make_response(jsonify({"message": "You are not following anyone."}), 200)
 
-    following_ids = [ObjectId(f["_id"]) for f in following_list]
-    feed_activities = []
-
-    def parse_timestamp(ts):
-        if isinstance(ts, str):
-            try:
-                return datetime.fromisoformat(ts)
-            except ValueError:
-                return datetime.min  
-        return ts if isinstance(ts, datetime) else datetime.min
-
+    after, limit, _ = page_args(FEED_PAGE_SIZE, keys=len(TIMELINE_SORT))
+    feed_activities, next_cursor = read_feed(username, after, limit)
 
-    reviews_by_user = []
-    for book in books.find({"user_reviews.username": username}):
-        for review in book.get("user_reviews", []):
-            if review.get("username") == username:
-                reviews_by_user.append({
-                    "activity_type": "reviewed",
-                    "username": "You",
-                    "book_id": str(book["_id"]),
-                    "book_title": book["title"],
-                    "review_id": str(review["_id"]),
-                    "review_content": review["comment"],
-                    "timestamp": review.get("created_at", datetime.now().isoformat())
-                })
-
-    feed_activities.extend(reviews_by_user)
-
-    review_replies_by_user = []
-    for book in books.find({"user_reviews.username": username}):
-        for review in book.get("user_reviews", []):
-            for review_reply in review.get("replies", []):
-                if review_reply.get("username") == username:
-                    review_replies_by_user.append({
-                        "activity_type": "replied to a review by",
-                        "username": "You",
-                        "review_user": review["username"],
-                        "book_id": str(book["_id"]),
-                        "review_id": str(review["_id"]),
-                        "reply_id": str(review_reply["_id"]),
-                        "review_reply_content": review_reply["content"],
-                        "timestamp": review_reply.get("created_at", datetime.now().isoformat())
-                    })
-    feed_activities.extend(review_replies_by_user)
-
-    thoughts_by_user = []
-    for thought in thoughts.find({"username": username}):
-        if thought.get("username") == username:
-            thoughts_by_user.append({
-                "activity_type": "posted a thought",
-                "username": "You",
-                "thought_id": str(thought["_id"]),
-                "thought_content": thought["comment"],
-                "timestamp": thought.get("created_at", datetime.now().isoformat())
-            })
-
-    feed_activities.extend(thoughts_by_user)
-
-    replies_by_user = []
-    for thought in thoughts.find({"replies.username": username}):
-        for reply in thought.get("replies", []):
-            if reply.get("username") == username:
-                replies_by_user.append({
-                    "activity_type": "replied to a thought by",
-                    "username": "You",
-                    "thought_id": str(thought["_id"]),
-                    "thought_user": thought["username"],
-                    "reply_content": reply["content"],
-                    "timestamp": reply.get("created_at", datetime.now().isoformat())
-                })
+    for activity in feed_activities:
+        activity["_id"] = str(activity["_id"])
+        if activity["username"] == username:
+            activity["username"] = "You"
 
-    feed_activities.extend(replies_by_user)
-
-    for book in user.get("currently_reading", []):
-        progress = book.get('progress', 0)
-        activity = {
-            "activity_type": "Started Reading" if progress == 0 else "Reading Progress",
-            "username": "You",
-            "book_title": book.get("title", "Unknown Title"),
-            "progress": f"{progress}%",
-            "current_page": f"{book.get('current_page', 0)} / {book.get('total_pages', 0)}",
-            "timestamp": book.get("reading_time", datetime.now().isoformat())
-        }
-        feed_activities.append(activity)
-
-    for book in user.get("have_read", []):
-        rating = book.get('stars')
-        activity = {
-            "activity_type": "Finished Reading",
-            "username": "You",
-            "book_id": str(thought["_id"]),
-            "book_title": book.get("title", "Unknown Title"),
-            "rating": f"{rating}",
-            "timestamp": book.get("date_read", datetime.now().isoformat())
-        }
-        feed_activities.append(activity)
-
-    for followed_user in users.find({"_id": {"$in": following_ids}}):
-        followed_username = followed_user["username"]
-
-        for book in books.find({"user_reviews.username": followed_username}):
-            for review in book.get("user_reviews", []):
-                if review.get("username") == followed_username:
-                    feed_activities.append({
-                        "activity_type": "reviewed",
-                        "username": followed_username,
-                        "book_id": str(book["_id"]),
-                        "book_title": book["title"],
-                        "review_id": str(review["_id"]),
-                        "review_content": review["comment"],
-                        "timestamp": review.get("created_at", datetime.now())
-                    })
-
-        for book in books.find({"user_reviews.username": followed_username}):
-            for review in book.get("user_reviews", []):
-                for review_reply in review.get("replies", []):
-                    if review_reply.get("username") == followed_username:
-                        feed_activities.append({
-                            "activity_type": "replied to a review by",
-                            "username": followed_username,
-                            "review_user": review["username"],
-                            "book_id": str(book["_id"]),
-                            "review_id": str(review["_id"]),
-                            "review_reply_id": str(review_reply["_id"]),
-                            "review_reply_content": review_reply["content"],
-                            "timestamp": review_reply.get("created_at", datetime.now().isoformat())
-                        })
-
-
-        
-        for thought in thoughts.find({"username": followed_username}):
-            if thought.get("username") == username:
-                thoughts_by_user.append({
-                    "activity_type": "posted a thought",
-                    "username": followed_username,
-                    "thought_content": thought["comment"],
-                    "timestamp": thought.get("created_at", datetime.now().isoformat())
-                })
-
-        for thought in thoughts.find({"replies.username": followed_username}):
-            for reply in thought.get("replies", []):
-                if reply.get("username") == followed_username:
-                    feed_activities.append({
-                        "activity_type": "replied to a thought by",
-                        "username": followed_username,
-                        "thought_id": str(thought["_id"]),
-                        "thought_user": thought["username"],
-                        "reply_content": reply["content"],
-                        "timestamp": reply.get("created_at", datetime.now())
-                    })
-
-
-        # Add reading progress for followed user
-        for book in followed_user.get("currently_reading", []):
-            progress = book.get('progress', 0)
-            activity = {
-                "activity_type": "Started Reading" if progress == 0 else "Reading Progress",
-                "username": followed_username,
-                "book_title": book.get("title", "Unknown Title"),
-                "progress": f"{progress}%",
-                "current_page": f"{book.get('current_page', 0)} / {book.get('total_pages', 0)}",
-                "timestamp": book.get("reading_time", datetime.now().isoformat())
-            }
-            feed_activities.append(activity)
-
-        for book in followed_user.get("have_read", []):
-            rating = book.get('stars')
-            activity = {
-                "activity_type": "Finished Reading",
-                "username": followed_username,
-                "book_id": str(book["_id"]),
-                "book_title": book.get("title", "Unknown Title"),
-                "rating": f"{rating}",
-                "timestamp": book.get("date_read", datetime.now().isoformat())
-            }
-            feed_activities.append(activity)
-
-    # Sort all activities by timestamp in reverse order (most recent first)
-    feed_activities.sort(key=lambda x: parse_timestamp(x["timestamp"]), reverse=True)
-
-    # Return the combined feed activities
-    return make_response(jsonify({"feed": feed_activities}), 200)
+    return make_response(jsonify({"feed": feed_activities, "next_cursor": next_cursor}), 200)
 
 #------------------------------------------------------------------------------------------------------------------
 # 5. USER PROFILE FEATURES
@@ -509,6 +363,7 @@ def show_profile():
 
     
     if user:
+        user["shelves"] = shelf_counts(user["_id"])
         user["_id"] = str(user["_id"])
         return make_response(jsonify(user), 200)
     else:
@@ -544,6 +399,8 @@ def edit_profile():
         updates["favourite_genres"] = data["favourite_genres"]
     if "favourite_authors" in data:
         updates["favourite_authors"] = data["favourite_authors"]
+    if "favourite_genres" in updates or "favourite_authors" in updates:
+        updates.update(STALE)
     if "profile_pic" in data:
         profile_pic_url = data["profile_pic"]
 
@@ -557,6 +414,10 @@ def edit_profile():
 
 
     users.update_one({"username": username}, {"$set": updates})
+    if "username" in updates:
+        rename_user(username, updates["username"])
+        rename_activities(username, updates["username"])
+    end_session(token_data)
 
     return make_response(jsonify({"message": "Profile updated successfully"}), 200)
 
@@ -584,9 +445,11 @@ def delete_own_account():
     result = users.delete_one({"_id": user["_id"]})
     
     if result.deleted_count == 1:
+        remove_account_data(user)
+
         # Add the token to the blacklist to log the user out
         token = request.headers.get('x-access-token')
-        blacklist.insert_one({"token": token})
+        blacklist_token(token)
         
         return make_response(jsonify({"message": "Your account has been deleted and you have been logged out.", "reason": reason}), 200)
     else:
@@ -604,7 +467,7 @@ def remove_all_favourite_authors():
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$set": {"favourite_authors": []}})
+    users.update_one({"_id": user["_id"]}, {"$set": {"favourite_authors": [], **STALE}})
 
     return make_response(jsonify({"message": "All authors removed successfully"}), 200)
 
@@ -649,9 +512,13 @@ def suspend_user(user_id):
 @jwt_required
 @admin_required
 def ban_user(user_id):
-    result = users.find_one( { "_id" : ObjectId(user_id) } )
+    result = users.find_one( { "_id" : ObjectId(user_id) }, {"username": 1, "email": 1} )
+    if not result:
+        return make_response(jsonify({"error": "Invalid User ID"}), 404)
+
     banned_user = users.delete_one( { "_id" : ObjectId(user_id) } )
     if banned_user.deleted_count == 1:
+        remove_account_data(result)
         email = result.get('email')
         banned_emails.insert_one({"emails": email}) # THEIR EMAIL IS ADDED TO THE BANNED EMAILS COLLECTION
         return make_response(jsonify({"message": "User has been banned"}), 201)
@@ -3,6 +3,7 @@ from bson import ObjectId
 from bson.regex import Regex
 from datetime import datetime
 from decorators import jwt_required, admin_required, author_required
+from facets import facet_response
 import globals
 
 # Initialize Blueprint
@@ -14,8 +15,7 @@ books = globals.db.books
 @authors_bp.route("/api/v1.0/authors", methods=["GET"])
 def get_all_authors():
     try:
-        authors = books.distinct("author")
-        return make_response(jsonify(authors), 200)
+        return facet_response("author")
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
     
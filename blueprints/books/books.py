@@ -1,80 +1,95 @@
 from flask import Blueprint, request, make_response, jsonify, redirect, url_for
 from bson import ObjectId
-from bson.regex import Regex
+from pymongo import ReturnDocument
 from datetime import datetime
 from blueprints.messages.messages import send_message
 from decorators import jwt_required, admin_required, author_required
+from blueprints.reviews.reviews import attach_replies
 from aggregation import user_progress_aggregation
+from activity import record_activity, remove_activities
+from follows import follower_usernames
+from sessions import session_profile
+from pagination import paginate, page_response, MAX_PAGE_SIZE
+from search import apply_filters, search_books, search_keys, FILTER_FIELDS
+from facets import update_facets
+from cache import cached_response, invalidate, invalidate_book, CATALOGUE, NEIGHBOURS
+from leaderboard import top_books, update_leaderboard, genre_board, OVERALL
+from trending import record_event, trending_books, WINDOWS, TRENDING_SIZE, MAX_TRENDING_SIZE
+from releases import (parse_date, release_dates, published_at, refresh_release, recent_releases,
+                      DATE_FIELDS, NEW_RELEASE_DAYS, MAX_RELEASE_DAYS)
+from recommendations import ensure_recommendations, STALE
+from shelves import (add_to_shelf, remove_from_shelf, move_to_shelf, update_shelf_entry, has_entry, clear_shelf,
+                     shelf_entry, shelf_page, recent_entries, remove_book_from_shelves)
 import globals
 
 books_bp = Blueprint("books_bp", __name__)
 users = globals.db.users
 books = globals.db.books
+reviews = globals.db.reviews
+review_replies = globals.db.review_replies
+recommendations = globals.db.recommendations
+book_neighbours = globals.db.book_neighbours
+BOOK_PAGE_REVIEWS = 10 # Number of reviews sent with a single book
+
+# List views send a slim "card" per book. Clients can ask for more with ?fields=description,pages,...
+BOOK_CARD_FIELDS = ["title", "author", "coverImg", "user_score", "total_reviews", "genres"]
+BOOK_LIST_FIELDS = BOOK_CARD_FIELDS + [
+    "series", "description", "language", "isbn", "characters", "triggers", "bookFormat", "edition",
+    "pages", "publisher", "publishDate", "firstPublishDate", "awards", "price", "positive_reviews"
+]
+
+
+def book_projection():
+    """ Projection for a list view: the card fields plus any whitelisted extras named in ?fields= """
+    requested = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    fields = BOOK_CARD_FIELDS + [field for field in requested if field in BOOK_LIST_FIELDS and field not in BOOK_CARD_FIELDS]
+    return {field: 1 for field in fields}
+
+
+def book_card(book, projection):
+    card = {field: book.get(field) for field in projection}
+    card["_id"] = str(book['_id'])
+    return card
+
+
+def book_listing(query, sort=(("_id", 1),)):
+    projection = book_projection()
+    page, next_cursor = paginate(books, query, sort=sort, projection=projection)
+    return page_response([book_card(book, projection) for book in page], next_cursor)
 
 # BOOK APIS
 #------------------------------------------------------------------------------------------------------------------
 # 1. BASIC CRUD FEATURES
 @books_bp.route("/api/v1.0/books", methods=['GET'])
 def show_all_books():
-    page_num, page_size = 1, 10
-    title_filter = request.args.get('title')
-    author_filter = request.args.get('author')
-    genre_filter = request.args.get('genres')
-    character_filter = request.args.get('characters')
-
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = (page_size * (page_num - 1))
-
     query = {}
-    if title_filter:
-        query["title"] = {"$regex": Regex(title_filter, 'i')}
-    if author_filter:
-        query["author"] = {"$regex": Regex(author_filter, 'i')}
-    if genre_filter:
-        query["genres"] = {"$regex": Regex(genre_filter, 'i')}
-    if character_filter:
-        query["characters"] = {"$regex": Regex(character_filter, 'i')}
-
-    all_book_data = []
-    for book in books.find(query).skip(page_start).limit(page_size):
-        book['_id'] = str(book['_id'])
-        book_info = {
-            "_id": book['_id'],
-            "title": book['title'],
-            "series": book['series'],
-            "author": book['author'],
-            "user_score": book['user_score'],
-            "description": book['description'],
-            "user_reviews": book['user_reviews'],
-            "language": book['language'],
-            "isbn": book['isbn'],
-            "genres": book['genres'],
-            "characters": book['characters'],
-            "triggers": book['triggers'],
-            "bookFormat": book['bookFormat'],
-            "edition": book['edition'],
-            "pages": book['pages'],
-            "publisher": book['publisher'],
-            "publishDate": book['publishDate'],
-            "firstPublishDate": book['firstPublishDate'],
-            "awards": book['awards'],
-            "coverImg": book['coverImg'],
-            "price": book['price']
-        }
-        for review in book['user_reviews']:
-            review['_id'] = str(review['_id'])
-            for reply in review['replies']:
-                reply['_id'] = str(reply['_id'])
-
-        all_book_data.append(book_info)
-    return make_response(jsonify(all_book_data), 200)
+    apply_filters(query, request.args)
+
+    return book_listing(query)
+
+@books_bp.route("/api/v1.0/search", methods=['GET'])
+def search():
+    text = request.args.get('q', '')
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return make_response(jsonify({"error": "limit must be a whole number"}), 400)
+    if limit <= 0:
+        return make_response(jsonify({"error": "limit must be positive"}), 400)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    projection = book_projection()
+    results, total, took_ms = search_books(text, request.args, projection, limit)
+    return make_response(jsonify({
+        "results": [{**book_card(book, projection), "score": book["score"]} for book in results],
+        "total": total,
+        "took_ms": took_ms
+    }), 200)
 
 @books_bp.route("/api/v1.0/books/<string:id>", methods=["GET"])
+@cached_response("book:{id}", NEIGHBOURS)
 def show_one_book(id):
-    book = books.find_one({'_id': ObjectId(id)})
+    book = books.find_one({'_id': ObjectId(id)}, {"search_keys": 0})
     if book is None:
         return make_response(jsonify({"error": "Invalid Book ID"}), 404)
 
@@ -85,7 +100,7 @@ def show_one_book(id):
         query["author"] = {"$in": author}
 
     same_author_books = []
-    for same_author_book in books.find(query).limit(3):
+    for same_author_book in books.find(query, {"title": 1, "author": 1, "coverImg": 1}).limit(3):
         same_author_book['_id'] = str(same_author_book['_id'])
         same_author_books.append({
             "_id": same_author_book['_id'],
@@ -94,14 +109,21 @@ def show_one_book(id):
             "coverImg": same_author_book['coverImg'],
         })
 
+    # Only the newest reviews come with the book, the full list is paged from the reviews endpoint
+    latest_reviews = list(reviews.find({"book_id": book['_id']}).sort("created_at", -1).limit(BOOK_PAGE_REVIEWS))
+    book['user_reviews'] = attach_replies(latest_reviews)
+
+    # Precomputed by similarity.py, already in card form
+    neighbours = book_neighbours.find_one({"_id": book['_id']}, {"neighbours": 1}) or {}
+    readers_also_read = neighbours.get("neighbours", [])
+    for neighbour in readers_also_read:
+        neighbour['_id'] = str(neighbour['_id'])
+
     book['_id'] = str(book['_id'])
-    for review in book['user_reviews']:
-        review['_id'] = str(review['_id'])
-        for reply in review['replies']:
-                reply['_id'] = str(reply['_id'])
     response_data = {
         "book": book,
-        "same_author_books": same_author_books
+        "same_author_books": same_author_books,
+        "readers_also_read": readers_also_read
     }
 
     return make_response(jsonify(response_data), 200)
@@ -112,8 +134,7 @@ def show_one_book(id):
 @admin_required
 def add_book():
     token_data = request.token_data
-    name = token_data['name']
-    followers = token_data['followers']
+    name = session_profile(token_data).get('name')
     def parse_comma_separated(value):
         if isinstance(value, str):
             return [item.strip() for item in value.split(",") if item.strip()]
@@ -163,7 +184,8 @@ def add_book():
         "series": series,
         "author": author_list,
         "user_score": 0,
-        "user_reviews": [],
+        "total_reviews": 0,
+        "positive_reviews": 0,
         "description": description,
         "language": language,
         "isbn": isbn,
@@ -176,18 +198,24 @@ def add_book():
         "publisher": publisher,
         "publishDate": int(publish_year),
         "firstPublishDate": int(first_publish_year),
+        "releaseDates": release_dates({"publishDate": publish_date, "firstPublishDate": first_publish_date}),
         "awards": award_list,
         "coverImg": cover_img,
         "price": price
     }
+    book_data["publishedAt"] = published_at(book_data)
+    book_data["search_keys"] = search_keys(book_data)
 
     inserted_book = books.insert_one(book_data)
+    update_facets(None, book_data)
+    refresh_release(inserted_book.inserted_id)
+    invalidate(CATALOGUE)
 
     for author_name in author_list:
         if name == author_name:
-            for follower in followers:
+            for follower in follower_usernames(token_data['username']):
                 send_message(
-                    recipient_name=follower['username'],
+                    recipient_name=follower,
                     content=f"{name}, published a new book called {title}"
                 )
     
@@ -202,7 +230,7 @@ def add_book():
 @admin_required
 def edit_book(id):
     token_data = request.token_data
-    name = token_data['name']
+    name = session_profile(token_data).get('name')
     admin = token_data.get('admin', False)
     
     book = books.find_one({'_id': ObjectId(id)})
@@ -241,18 +269,31 @@ def edit_book(id):
         updates["pages"] = int(data["pages"])
     if "publisher" in data:
         updates["publisher"] = data["publisher"]
-    if "publishDate" in data:
-        updates["publishDate"] = int(data["publishDate"])
-    if "firstPublishDate" in data:
-        updates["firstPublishDate"] = int(data["firstPublishDate"])
+    # Dates are a year or "YYYY-MM-DD", the full date is kept for the new releases listing
+    dates = {field: data[field] for field in DATE_FIELDS if field in data}
+    if dates or data.get("publishedAt"):
+        parsed = release_dates(dates)
+        explicit = parse_date(data["publishedAt"]) if data.get("publishedAt") else None
+        if len(parsed) != len(dates) or (data.get("publishedAt") and not explicit):
+            return make_response(jsonify({"error": "Dates must be a year or a YYYY-MM-DD date"}), 400)
+        for field, date in parsed.items():
+            updates[field] = date.year
+        updates["releaseDates"] = {**(book.get("releaseDates") or release_dates(book)), **parsed}
+        updates["publishedAt"] = explicit or published_at(updates)
     if "awards" in data:
         updates["awards"] = data["awards"]
     if "coverImg" in data:
         updates["coverImg"] = data["coverImg"]
     if "price" in data:
         updates["price"] = float(data["price"])
+    updates["search_keys"] = search_keys({**book, **updates})
     
     books.update_one({"_id": ObjectId(id)}, {"$set": updates})
+    update_facets(book, {**book, **updates})
+    update_leaderboard(id)
+    if "publishedAt" in updates:
+        refresh_release(id)
+    invalidate_book(id)
     
     return make_response(jsonify({"message": "Book updated successfully"}), 200)
 
@@ -263,7 +304,7 @@ def edit_book(id):
 def delete_books(id):
     token_data = request.token_data
     admin = token_data.get('admin', False)
-    name = token_data.get('name')
+    name = session_profile(token_data).get('name')
 
     book = books.find_one(
         {"_id": ObjectId(id)}
@@ -280,6 +321,16 @@ def delete_books(id):
     result = books.delete_one({"_id":ObjectId(id)})
 
     if result.deleted_count == 1:
+        update_facets(book, None)
+        book_neighbours.delete_one({"_id": ObjectId(id)})
+        remove_book_from_shelves(id)
+        update_leaderboard(id)
+        refresh_release(id)
+        invalidate_book(id)
+        reviews.delete_many({"book_id": ObjectId(id)})
+        review_replies.delete_many({"book_id": ObjectId(id)})
+        # Reviews, replies and reading updates of the book, so no feed entry points at it any more
+        remove_activities(book_id=id)
         return make_response(jsonify({}), 204)
     else:
         return make_response(jsonify({"error": "Invalid request ID"}), 404)
@@ -297,222 +348,147 @@ def get_recommendations():
     if not user:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    fav_genres = user.get("favourite_genres", [])
-    fav_authors = user.get("favourite_authors", [])
+    refreshing = ensure_recommendations(user)
 
-    page = int(request.args.get('page', 1))
-    page_size = int(request.args.get('page_size', 10))
-    skip = (page - 1) * page_size
+    page, next_cursor = paginate(recommendations, {"user_id": user["_id"]}, sort=[("score", -1)])
+    projection = book_projection()
+    cards = {book["_id"]: book for book in books.find({"_id": {"$in": [r["book_id"] for r in page]}}, projection)}
 
     recommended_books = []
-
-    genre_query = {}
-    if fav_genres:
-        genre_query["genres"] = {"$in": fav_genres}
-
-    author_query = {}
-    if fav_authors:
-        author_query["author"] = {"$in": fav_authors}
-
-    if fav_genres:
-        genre_books = list(books.find(genre_query, {"_id": 1, "title": 1, "author": 1, "coverImg": 1, "genres": 1}).limit(100))
-        recommended_books.extend(genre_books)
-
-    if fav_authors:
-        author_books = list(books.find(author_query, {"_id": 1, "title": 1, "author": 1, "coverImg": 1, "genres": 1}).limit(50))
-        recommended_books.extend(author_books)
-
-    rated_books = user.get("have_read", [])
-    for rated_book in rated_books:
-        if rated_book["stars"] > 3.5: 
-            same_author_books = list(books.find({
-                "author": {"$in": [rated_book["author"]]},
-                "_id": {"$ne": ObjectId(rated_book["_id"])}
-            }))
-
-            for book in same_author_books:
-                recommended_books.append({
-                    "_id": str(book["_id"]),
-                    "title": book["title"],
-                    "author": book["author"],
-                    "coverImg": book["coverImg"],
-                    "genres": book["genres"]
-                })
-
-
-    recommended_books = list({str(book["_id"]): book for book in recommended_books}.values())
-
-    for book in recommended_books:
-        book["_id"] = str(book["_id"])
+    for recommendation in page:
+        book = cards.get(recommendation["book_id"])
+        if book:
+            recommended_books.append({**book_card(book, projection), "score": recommendation["score"]})
 
     return make_response(jsonify({
         "recommended_books": recommended_books,
-        "favorite_genres": fav_genres,
-        "favorite_authors": fav_authors,
-        "have_read": rated_books
+        "next_cursor": next_cursor,
+        "refreshing": refreshing,
+        "favorite_genres": user.get("favourite_genres", []),
+        "favorite_authors": user.get("favourite_authors", []),
+        "have_read": recent_entries(user["_id"], "have_read")
     }), 200)
 
 
 #------------------------------------------------------------------------------------------------------------------
 # 4. TOP RATED BOOKS
 @books_bp.route("/api/v1.0/top-books", methods=['GET'])
+@cached_response(CATALOGUE)
 def show_high_rated_books():
-    page_num, page_size = 1, 10
-    title_filter = request.args.get('title')
-    author_filter = request.args.get('author')
-    genre_filter = request.args.get('genres')
-    character_filter = request.args.get('characters')
-
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = (page_size * (page_num - 1))
-
-    query = {"user_score": {"$gt": 3.5}}  # Filter for user_score greater than 3.5
-    if title_filter:
-        query["title"] = {"$regex": Regex(title_filter, 'i')}
-    if author_filter:
-        query["author"] = {"$regex": Regex(author_filter, 'i')}
-    if genre_filter:
-        query["genres"] = {"$regex": Regex(genre_filter, 'i')}
-    if character_filter:
-        query["characters"] = {"$regex": Regex(character_filter, 'i')}
-
-    all_book_data = []
-    for book in books.find(query).skip(page_start).limit(page_size):
-        book['_id'] = str(book['_id'])
-        book_info = {
-            "_id": book['_id'],
-            "title": book['title'],
-            "series": book['series'],
-            "author": book['author'],
-            "user_score": book['user_score'],
-            "description": book['description'],
-            "user_reviews": book['user_reviews'],
-            "language": book['language'],
-            "isbn": book['isbn'],
-            "genres": book['genres'],
-            "characters": book['characters'],
-            "triggers": book['triggers'],
-            "bookFormat": book['bookFormat'],
-            "edition": book['edition'],
-            "pages": book['pages'],
-            "publisher": book['publisher'],
-            "publishDate": book['publishDate'],
-            "firstPublishDate": book['firstPublishDate'],
-            "awards": book['awards'],
-            "coverImg": book['coverImg'],
-            "price": book['price']
-        }
-        for review in book['user_reviews']:
-            review['_id'] = str(review['_id'])
-            for reply in review['replies']:
-                reply['_id'] = str(reply['_id'])
-        all_book_data.append(book_info)
-    return make_response(jsonify(all_book_data), 200)
+    # The ?title=&author=... filters can't be answered from the leaderboard, those keep filtering the catalogue
+    if any(request.args.get(field) for field in FILTER_FIELDS):
+        query = {"user_score": {"$gt": 3.5}}  # Filter for user_score greater than 3.5
+        apply_filters(query, request.args)
+        return book_listing(query, sort=[("user_score", -1)])
+
+    genre = request.args.get('genre')
+    page, next_cursor = top_books(genre_board(genre) if genre else OVERALL)
+
+    # Entries carry the card, extra ?fields= are read from the books in one query
+    extras = [field for field in book_projection() if field not in BOOK_CARD_FIELDS]
+    details = {}
+    if extras:
+        details = {book["_id"]: book for book in books.find({"_id": {"$in": [entry["book_id"] for entry in page]}}, extras)}
+
+    top = []
+    for entry in page:
+        book = details.get(entry["book_id"], {})
+        card = {**entry["card"], **{field: book.get(field) for field in extras}, "score": entry["score"]}
+        card["_id"] = str(entry["book_id"])
+        top.append(card)
+    return page_response(top, next_cursor)
+
+@books_bp.route("/api/v1.0/trending", methods=['GET'])
+def show_trending_books():
+    window = request.args.get('window', '24h')
+    if window not in WINDOWS:
+        return make_response(jsonify({"error": f"window must be one of {', '.join(WINDOWS)}"}), 400)
+
+    try:
+        limit = int(request.args.get('limit', TRENDING_SIZE))
+    except ValueError:
+        return make_response(jsonify({"error": "limit must be a whole number"}), 400)
+    if limit <= 0:
+        return make_response(jsonify({"error": "limit must be positive"}), 400)
+
+    ranked = trending_books(window, min(limit, MAX_TRENDING_SIZE))
+    projection = book_projection()
+    cards = {book["_id"]: book for book in books.find({"_id": {"$in": [book_id for book_id, _ in ranked]}}, projection)}
+
+    trending = []
+    for book_id, score in ranked:
+        book = cards.get(book_id)
+        if book:
+            trending.append({**book_card(book, projection), "trending_score": score})
+
+    return make_response(jsonify({"window": window, "books": trending}), 200)
 
 @books_bp.route("/api/v1.0/new-releases", methods=['GET'])
+@cached_response(CATALOGUE)
 def show_newly_released_books():
-    page_num, page_size = 1, 10
-    title_filter = request.args.get('title')
-    author_filter = request.args.get('author')
-    genre_filter = request.args.get('genres')
-    character_filter = request.args.get('characters')
-
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = (page_size * (page_num - 1))
-
-    current_year = datetime.now().year
-
-    query = {
-        "$or": [
-            {
-                "publishDate": current_year  # Match exact year for publishDate
-            },
-            {
-                "firstPublishDate": current_year  # Match exact year for firstPublishDate
-            }
-        ]
-    }
-    if title_filter:
-        query["title"] = {"$regex": Regex(title_filter, 'i')}
-    if author_filter:
-        query["author"] = {"$regex": Regex(author_filter, 'i')}
-    if genre_filter:
-        query["genres"] = {"$regex": Regex(genre_filter, 'i')}
-    if character_filter:
-        query["characters"] = {"$regex": Regex(character_filter, 'i')}
-
-    all_book_data = []
-    for book in books.find(query).skip(page_start).limit(page_size):
-        book['_id'] = str(book['_id'])
-        book_info = {
-            "_id": book['_id'],
-            "title": book['title'],
-            "series": book['series'],
-            "author": book['author'],
-            "user_score": book['user_score'],
-            "description": book['description'],
-            "user_reviews": book['user_reviews'],
-            "language": book['language'],
-            "isbn": book['isbn'],
-            "genres": book['genres'],
-            "characters": book['characters'],
-            "triggers": book['triggers'],
-            "bookFormat": book['bookFormat'],
-            "edition": book['edition'],
-            "pages": book['pages'],
-            "publisher": book['publisher'],
-            "publishDate": book['publishDate'],
-            "firstPublishDate": book['firstPublishDate'],
-            "awards": book['awards'],
-            "coverImg": book['coverImg'],
-            "price": book['price']
-        }
-        for review in book['user_reviews']:
-            review['_id'] = str(review['_id'])
-            for reply in review['replies']:
-                reply['_id'] = str(reply['_id'])
-        all_book_data.append(book_info)
-    return make_response(jsonify(all_book_data), 200)
+    # ?days= or ?months= back from today, a year by default
+    try:
+        days = int(request.args.get('days') or int(request.args.get('months') or 0) * 30 or NEW_RELEASE_DAYS)
+    except ValueError:
+        return make_response(jsonify({"error": "days and months must be whole numbers"}), 400)
+    if days <= 0:
+        return make_response(jsonify({"error": "days and months must be positive"}), 400)
+    days = min(days, MAX_RELEASE_DAYS)
 
+    query = {}
+    apply_filters(query, request.args)
+    page, next_cursor = recent_releases(days, query)
 
-#------------------------------------------------------------------------------------------------------------------
-# 5. BOOKSHELVES
-# Helper function to check and assign awards
-def check_and_assign_awards(user):
-    read_count = len(user.get("have_read", []))
-    current_awards = set(user.get("awards", []))  # ensure it's a set for quick lookup
-
-    new_awards = []
-
-    # Define milestones
-    milestones = {
-        1: "First Book Read",
-        5: "5 Books Read",
-        10: "10 Books Read",
-        25: "25 Books Read",
-        50: "50 Books Read",
-        100: "100 Books Read"
-    }
+    projection = book_projection()
+    cards = {book["_id"]: book for book in books.find({"_id": {"$in": [entry["_id"] for entry in page]}}, projection)}
 
-    for milestone, award in milestones.items():
-        if read_count >= milestone and award not in current_awards:
-            new_awards.append(award)
+    releases = []
+    for entry in page:
+        book = cards.get(entry["_id"])
+        if book:
+            releases.append({**book_card(book, projection), "publishedAt": entry["publishedAt"]})
+    return page_response(releases, next_cursor)
 
-    if new_awards:
-        users.update_one(
-            {"_id": user["_id"]},
-            {"$addToSet": {"awards": {"$each": new_awards}}}
-        )
 
-        return new_awards
+#------------------------------------------------------------------------------------------------------------------
+# 5. BOOKSHELVES
+AWARD_MILESTONES = {
+    1: "First Book Read",
+    5: "5 Books Read",
+    10: "10 Books Read",
+    25: "25 Books Read",
+    50: "50 Books Read",
+    100: "100 Books Read"
+}
+
+
+def count_books_read(user_id, change):
+    """ Move the user's have_read_count, mark their recommendations stale and grant any milestone award the new count
+        reaches, as one atomic update. Returns the awards this change earned """
+    current = {"$ifNull": ["$awards", []]}
+    reached = [
+        {"$cond": [{"$and": [{"$gte": ["$have_read_count", milestone]}, {"$not": {"$in": [award, current]}}]}, [award], []]}
+        for milestone, award in AWARD_MILESTONES.items()
+    ]
+    before = users.find_one_and_update(
+        {"_id": user_id},
+        [
+            {"$set": {
+                "have_read_count": {"$max": [{"$add": [{"$ifNull": ["$have_read_count", 0]}, change]}, 0]},
+                **STALE
+            }},
+            # Stages see the previous stage's output, so the milestones are checked against the new count
+            {"$set": {"awards": {"$concatArrays": [current, *reached]}}}
+        ],
+        projection={"have_read_count": 1, "awards": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        return []
 
-    return []
+    read_count = max(before.get("have_read_count", 0) + change, 0)
+    current_awards = set(before.get("awards", []))
+    return [award for milestone, award in AWARD_MILESTONES.items() if read_count >= milestone and award not in current_awards]
 
 
 @books_bp.route("/api/v1.0/books/<string:id>/have-read", methods=["POST"])
@@ -522,14 +498,10 @@ def have_read_book(id):
     username = token_data["username"]
     date_read = request.form.get('date_read')
 
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    book = books.find_one({"_id": ObjectId(id)})
-    if not book:
-        return make_response(jsonify({"error": "Invalid Book ID"}), 404)
-
     if "stars" not in request.form:
         return make_response(jsonify({"error": "Missing 'stars' field"}), 400)
 
@@ -543,26 +515,19 @@ def have_read_book(id):
     if not date_read:
         return make_response(jsonify({"error": "Missing 'date_read' field"}), 400)
 
-    book_data = {
-        "_id": id,
-        "title": book.get("title"),
-        "coverImg": book.get("coverImg"),
-        "author": book.get("author"),
-        "genres": book.get("genres"),
-        "stars": stars,
-        "date_read": date_read
-    }
+    book = books.find_one({"_id": ObjectId(id)}, {"title": 1})
+    if not book:
+        return make_response(jsonify({"error": "Invalid Book ID"}), 404)
 
-    if "have_read" in user and any(b["_id"] == id for b in user["have_read"]):
+    if not add_to_shelf(user_id, "have_read", id, stars=stars, date_read=date_read):
         return make_response(jsonify({"message": "Book already marked as read"}), 200)
 
-    users.update_one({"_id": user["_id"]}, {"$addToSet": {"have_read": book_data}})
-
-    # Re-fetch user to ensure we have latest data
-    user = users.find_one({"username": username})
-
     # Check for awards 🏆
-    new_awards = check_and_assign_awards(user)
+    new_awards = count_books_read(user_id, 1)
+    record_event(book["_id"], "have_read")
+
+    record_activity(username, "Finished Reading",
+                    book_id=id, book_title=book.get("title", "Unknown Title"), rating=f"{stars}")
 
     response = {"message": "Book added to have_read list"}
     if new_awards:
@@ -574,22 +539,19 @@ def have_read_book(id):
 @books_bp.route("/api/v1.0/have-read", methods=["GET"])
 @jwt_required
 def get_all_have_read_books():
-    token_data = request.token_data
-    username = token_data['username']
-    user = users.find_one({"username": username}, {"have_read": 1})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
-    return make_response(jsonify({"have_read": user.get("have_read", [])}), 200)
+    have_read, next_cursor = shelf_page(user_id, "have_read")
+    return make_response(jsonify({"have_read": have_read, "next_cursor": next_cursor}), 200)
 
 @books_bp.route("/api/v1.0/have-read/<string:book_id>", methods=["GET"])
 @jwt_required
 def get_have_read_book(book_id):
-    token_data = request.token_data
-    username = token_data['username']
-    user = users.find_one({"username": username}, {"have_read": 1})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
-    book = next((b for b in user.get("have_read", []) if b["_id"] == book_id), None)
+    book = shelf_entry(user_id, "have_read", book_id)
     if not book:
         return make_response(jsonify({"error": "Book not found in have read list"}), 404)
     return make_response(jsonify({"book": book}), 200)
@@ -598,17 +560,10 @@ def get_have_read_book(book_id):
 @books_bp.route("/api/v1.0/books/<string:id>/have-read", methods=["PUT"])
 @jwt_required
 def edit_have_read_book(id):
-    token_data = request.token_data
-    username = token_data["username"]
-
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    book_index = next((i for i, b in enumerate(user.get("have_read", [])) if b["_id"] == id), None)
-    if book_index is None:
-        return make_response(jsonify({"error": "Book not found in have read list"}), 404)
-
     data = request.get_json()
     updates = {}
 
@@ -627,10 +582,12 @@ def edit_have_read_book(id):
     if not updates:
         return make_response(jsonify({"error": "No valid fields to update"}), 400)
 
-    users.update_one(
-        {"_id": user["_id"], f"have_read.{book_index}._id": id},
-        {"$set": {f"have_read.{book_index}.{key}": value for key, value in updates.items()}}
-    )
+    if not update_shelf_entry(user_id, "have_read", id, updates):
+        return make_response(jsonify({"error": "Book not found in have read list"}), 404)
+
+    # Only the rating feeds the recommendations
+    if "stars" in updates:
+        users.update_one({"_id": user_id}, {"$set": STALE})
 
     return make_response(jsonify({"message": "Book details updated successfully"}), 200)
 
@@ -638,33 +595,26 @@ def edit_have_read_book(id):
 @books_bp.route('/api/v1.0/remove-all-have-read', methods=["POST"])
 @jwt_required
 def remove_all_have_read_books():
-    token_data = request.token_data
-    username = token_data['username']
-
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$set": {"have_read": []}})
-
-    
+    clear_shelf(user_id, "have_read")
+    users.update_one({"_id": user_id}, {"$set": {"have_read_count": 0, **STALE}})
 
     return make_response(jsonify({"message": "All books removed successfully"}), 200)
 
 @books_bp.route("/api/v1.0/books/<string:id>/have-read", methods=["DELETE"])
 @jwt_required
 def remove_have_read_book(id):
-    token_data = request.token_data
-    username = token_data["username"]
-
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    if "have_read" not in user or not any(b["_id"] == id for b in user["have_read"]):
+    if not remove_from_shelf(user_id, "have_read", id):
         return make_response(jsonify({"error": "Book not found in have_read list"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$pull": {"have_read": {"_id": id}}})
+    count_books_read(user_id, -1)
 
     return make_response(jsonify({
         "message": "Book removed from have_read list",
@@ -674,55 +624,39 @@ def remove_have_read_book(id):
 @books_bp.route("/api/v1.0/books/<string:id>/want-to-read", methods=["POST"])
 @jwt_required
 def want_to_read_book(id):
-    token_data = request.token_data
-    username = token_data["username"]
-    
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
     
-    book = books.find_one({"_id": ObjectId(id)})
-    if not book:
+    if not books.find_one({"_id": ObjectId(id)}, {"_id": 1}):
         return make_response(jsonify({"error": "Invalid Book ID"}), 404)
     
-    book_data = {
-        "_id": id,
-        "title": book.get("title"),
-        "coverImg": book.get("coverImg"),
-        "author": book.get("author"),
-        "genres": book.get("genres"),
-    }
-    
-    
-    users.update_one({"_id": user["_id"]}, {"$addToSet": {"want_to_read": book_data}})
-    
+    if add_to_shelf(user_id, "want_to_read", id):
+        users.update_one({"_id": user_id}, {"$set": STALE})
+        record_event(ObjectId(id), "want_to_read")
     
     return make_response(jsonify({"message": "Book added to tbr list"}), 200)
 
 @books_bp.route("/api/v1.0/want-to-read", methods=["GET"])
 @jwt_required
 def get_all_tbr_books():
-    token_data = request.token_data
-    username = token_data['username']
-    user = users.find_one({"username": username}, {"want_to_read": 1})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
-    return make_response(jsonify({"want_to_read": user.get("want_to_read", [])}), 200)
+    want_to_read, next_cursor = shelf_page(user_id, "want_to_read")
+    return make_response(jsonify({"want_to_read": want_to_read, "next_cursor": next_cursor}), 200)
 
 @books_bp.route("/api/v1.0/books/<string:id>/want-to-read", methods=["DELETE"])
 @jwt_required
 def remove_tbr_book(id):
-    token_data = request.token_data
-    username = token_data["username"]
-
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    if "have_read" not in user or not any(b["_id"] == id for b in user["want_to_read"]):
+    if not remove_from_shelf(user_id, "want_to_read", id):
         return make_response(jsonify({"error": "Book not found in tbr list"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$pull": {"want_to_read": {"_id": id}}})
+    users.update_one({"_id": user_id}, {"$set": STALE})
 
     return make_response(jsonify({
         "message": "Book removed from tbr list",
@@ -734,40 +668,27 @@ def start_to_read_book(id):
     token_data = request.token_data
     username = token_data["username"]
     
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
     
-    book = books.find_one({"_id": ObjectId(id)})
+    book = books.find_one({"_id": ObjectId(id)}, {"title": 1, "pages": 1})
     if not book:
         return make_response(jsonify({"error": "Invalid Book ID"}), 404)
     
     current_time = datetime.utcnow()
 
-    book_data = {
-        "_id": id,
-        "title": book.get("title"),
-        "coverImg": book.get("coverImg"),
-        "author": book.get("author"),
-        "genres": book.get("genres"),
-        "reading_time": current_time,
-        "total_pages": book.get("pages"),
-        "current_page": 0,
-        "progress": 0
-    }
-    
-    if "currently_reading" in user and any(b["_id"] == id for b in user["currently_reading"]):
+    # Moves the book off the tbr list in the same write
+    if not move_to_shelf(user_id, "want_to_read", "currently_reading", id, reading_time=current_time,
+                         total_pages=book.get("pages"), current_page=0, progress=0):
         return make_response(jsonify({"message": "Book already in currently reading list"}), 200)
 
-    if "want_to_read" in user:
-        users.update_one(
-            {"_id": user["_id"]},
-            {"$pull": {"want_to_read": {"_id": id}}}
-        )
+    users.update_one({"_id": user_id}, {"$set": STALE})
+    record_event(book["_id"], "currently_reading")
 
-    
-    users.update_one({"_id": user["_id"]}, {"$addToSet": {"currently_reading": book_data}})
-    
+    record_activity(username, "Started Reading", current_time,
+                    book_id=id, book_title=book.get("title", "Unknown Title"), progress="0%",
+                    current_page=f"0 / {book.get('pages', 0)}")
     
     return make_response(jsonify({"message": "Book added to current reads"}), 200)
 
@@ -777,22 +698,19 @@ def start_to_read_book(id):
 @books_bp.route("/api/v1.0/currently-reading", methods=["GET"])
 @jwt_required
 def get_all_current_reads():
-    token_data = request.token_data
-    username = token_data['username']
-    user = users.find_one({"username": username}, {"currently_reading": 1})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
-    return make_response(jsonify({"currently_reading": user.get("currently_reading", [])}), 200)
+    currently_reading, next_cursor = shelf_page(user_id, "currently_reading")
+    return make_response(jsonify({"currently_reading": currently_reading, "next_cursor": next_cursor}), 200)
 
 @books_bp.route("/api/v1.0/currently-reading/<string:book_id>", methods=["GET"])
 @jwt_required
 def get_current_read(book_id):
-    token_data = request.token_data
-    username = token_data['username']
-    user = users.find_one({"username": username}, {"currently_reading": 1})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
-    book = next((b for b in user.get("currently_reading", []) if b["_id"] == book_id), None)
+    book = shelf_entry(user_id, "currently_reading", book_id)
     if not book:
         return make_response(jsonify({"error": "Book not found in currently reading list"}), 404)
     return make_response(jsonify({"book": book}), 200)
@@ -812,32 +730,27 @@ def update_reading_progress(book_id):
     
     new_page = int(new_page)
     
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
     
-    currently_reading = user.get("currently_reading", [])
-    book = next((b for b in currently_reading if str(b["_id"]) == book_id), None)
-    
-    if not book:
+    # The page is only written if it fits the book, the entry is only read again to explain a refusal
+    entry = update_shelf_entry(user_id, "currently_reading", book_id,
+                               {"current_page": new_page, "reading_time": datetime.now()},
+                               condition={"total_pages": {"$gte": new_page}})
+    if not entry:
+        if has_entry(user_id, "currently_reading", book_id):
+            return make_response(jsonify({"error": "Page number exceeds total pages"}), 400)
         return make_response(jsonify({"error": "Book not found in currently reading list"}), 404)
     
-    total_pages = book.get("total_pages", 0)
+    progress = user_progress_aggregation(user_id)
     
-    if new_page > total_pages:
-        return make_response(jsonify({"error": "Page number exceeds total pages"}), 400)
-    
-    users.update_one(
-        {"_id": user["_id"], "currently_reading._id": book_id},
-        {"$set": {"currently_reading.$.current_page": new_page, "currently_reading.$.reading_time": datetime.now()}}
-    )
-    
-    progress = user_progress_aggregation(user["_id"])
-    
-    users.update_one(
-        {"_id": user["_id"], "currently_reading._id": book_id},
-        {"$set": {"currently_reading.$.progress": progress}}
-    )
+    update_shelf_entry(user_id, "currently_reading", book_id, {"progress": progress})
+
+    book = books.find_one({"_id": entry["book_id"]}, {"title": 1}) or {}
+    record_activity(username, "Reading Progress",
+                    book_id=book_id, book_title=book.get("title", "Unknown Title"), progress=f"{progress}%",
+                    current_page=f"{new_page} / {entry['total_pages']}")
     
     return make_response(jsonify({"message": "Progress updated", "progress": progress}), 200)
 
@@ -845,17 +758,14 @@ def update_reading_progress(book_id):
 @books_bp.route("/api/v1.0/books/<string:id>/currently-reading", methods=["DELETE"])
 @jwt_required
 def remove_currently_reading_book(id):
-    token_data = request.token_data
-    username = token_data["username"]
-
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    if "currently_reading" not in user or not any(b["_id"] == id for b in user["currently_reading"]):
+    if not remove_from_shelf(user_id, "currently_reading", id):
         return make_response(jsonify({"error": "Book not found in currently_reading list"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$pull": {"currently_reading": {"_id": id}}})
+    users.update_one({"_id": user_id}, {"$set": STALE})
 
     return make_response(jsonify({
         "message": "Book removed from current reads",
@@ -864,47 +774,31 @@ def remove_currently_reading_book(id):
 @books_bp.route("/api/v1.0/books/<string:id>/add-to-favourites", methods=["POST"])
 @jwt_required
 def add_to_favourites(id):
-    token_data = request.token_data
-    username = token_data["username"]
-    
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
     
-    book = books.find_one({"_id": ObjectId(id)})
-    if not book:
+    if not books.find_one({"_id": ObjectId(id)}, {"_id": 1}):
         return make_response(jsonify({"error": "Invalid Book ID"}), 404)
     
-    book_data = {
-        "_id": id,
-        "title": book.get("title"),
-        "coverImg": book.get("coverImg"),
-        "author": book.get("author"),
-        "genres": book.get("genres"),
-        "pages": book.get("pages"),
-    }
-    
-    if "favourite_books" in user and any(b["_id"] == id for b in user["favourite_books"]):
+    if not add_to_shelf(user_id, "favourite_books", id):
         return make_response(jsonify({"message": "Book already in favourites"}), 200)
 
-    users.update_one({"_id": user["_id"]}, {"$addToSet": {"favourite_books": book_data}})
+    users.update_one({"_id": user_id}, {"$set": STALE})
 
     return make_response(jsonify({"message": "Book added to favourites"}), 200)
 
 @books_bp.route("/api/v1.0/books/<string:id>/favourites", methods=["DELETE"])
 @jwt_required
 def remove_favourite_book(id):
-    token_data = request.token_data
-    username = token_data["username"]
-
-    user = users.find_one({"username": username})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
 
-    if "have_read" not in user or not any(b["_id"] == id for b in user["favourite_books"]):
+    if not remove_from_shelf(user_id, "favourite_books", id):
         return make_response(jsonify({"error": "Book not found in favourites list"}), 404)
 
-    users.update_one({"_id": user["_id"]}, {"$pull": {"favourite_books": {"_id": id}}})
+    users.update_one({"_id": user_id}, {"$set": STALE})
 
     return make_response(jsonify({
         "message": "Book removed from favourites list",
@@ -913,9 +807,8 @@ def remove_favourite_book(id):
 @books_bp.route("/api/v1.0/favourites", methods=["GET"])
 @jwt_required
 def get_all_favourite_reads():
-    token_data = request.token_data
-    username = token_data['username']
-    user = users.find_one({"username": username}, {"favourite_books": 1})
-    if not user:
+    user_id = session_profile(request.token_data).get("_id")
+    if not user_id:
         return make_response(jsonify({"error": "User not found"}), 404)
-    return make_response(jsonify({"favourite_books": user.get("favourite_books", [])}), 200)
+    favourite_books, next_cursor = shelf_page(user_id, "favourite_books")
+    return make_response(jsonify({"favourite_books": favourite_books, "next_cursor": next_cursor}), 200)
@@ -2,10 +2,10 @@ from flask import Blueprint, jsonify, make_response, request
 from bson import ObjectId
 from bson.regex import Regex
 from datetime import datetime
-from aggregation import user_score_aggregation
 from decorators import jwt_required, admin_required, author_required
 import globals
 from blueprints.messages.messages import send_message
+from pagination import paginate, page_response
 
 deleted_accounts_bp = Blueprint("deleted_accounts_bp", __name__)
 deleted_accounts = globals.db.deleted_accounts
@@ -18,11 +18,12 @@ deleted_accounts = globals.db.deleted_accounts
 def get_all_feedback():
     all_deleted_accounts = []
 
-    for deleted_account in deleted_accounts.find():
+    page, next_cursor = paginate(deleted_accounts, {}, default_page_size=None)
+    for deleted_account in page:
         deleted_account['_id'] = str(deleted_account['_id'])
         all_deleted_accounts.append(deleted_account)
 
-    return make_response(jsonify(all_deleted_accounts), 200)
+    return page_response(all_deleted_accounts, next_cursor)
 
 
 @deleted_accounts_bp.route("/api/v1.0/deleted-accounts/<string:deleted_account_id>", methods=["GET"])
@@ -1,4 +1,5 @@
 from flask import Blueprint, jsonify, make_response
+from facets import facet_response
 import globals
 
 # Initialize Blueprint
@@ -10,8 +11,6 @@ books = globals.db.books
 @genres_bp.route("/api/v1.0/genres", methods=["GET"])
 def get_all_genres():
     try:
-        # Aggregate unique genres from the books collection
-        genres = books.distinct("genres")
-        return make_response(jsonify(genres), 200)
+        return facet_response("genres")
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
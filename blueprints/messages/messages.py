@@ -1,12 +1,24 @@
-from flask import Blueprint, request, jsonify, make_response
+from flask import Blueprint, Response, request, jsonify, make_response
 from bson import ObjectId
-import datetime
-from decorators import jwt_required
+from datetime import datetime, timedelta
+from decorators import jwt_required, admin_required, verify_token, digest_revoked, token_digest, TokenRevoked
+import secrets
+import queue
+import json
+import time
+from pagination import paginate
+import notifications
+import push
 import globals
 
 messages_bp = Blueprint("messages_bp", __name__)
 messages = globals.db.messages
 users = globals.db.users
+stream_tickets = globals.db.stream_tickets
+STREAM_HEARTBEAT = 15 # Seconds between keep-alive comments on an idle stream
+STREAM_RECHECK = 30 # Seconds between checks that the session behind an open stream is still valid
+STREAM_TICKET_TTL = 60 # Seconds a stream ticket can be redeemed for
+STREAM_RETRY_AFTER = 60 # Seconds a client told the worker is full should poll for before reconnecting
 
 
 # MESSAGE APIS
@@ -16,30 +28,149 @@ users = globals.db.users
 def get_messages():
     token_data = request.token_data
     username = token_data['username']
-    user_messages = messages.find({"recipient_name": username})
+    page, next_cursor = paginate(messages, {"recipient_name": username}, sort=[("timestamp", -1)], default_page_size=20)
     messages_list = [{
         "_id": str(message["_id"]),
         "recipient_name": username,
         "content": message["content"],
         "timestamp": message["timestamp"],
         "is_read": message.get("is_read", False)
-    } for message in user_messages]
-    has_unread = any(not msg["is_read"] for msg in messages_list)
+    } for message in page]
+    unread_count = unread_messages(username)
     response = {
         "messages": messages_list,
-        "hasUnreadMessages": has_unread
+        "next_cursor": next_cursor,
+        "unread_count": unread_count,
+        "hasUnreadMessages": unread_count > 0
     }
     
     return make_response(jsonify(response), 200)
 
-def send_message( content, recipient_name):
-    message = { 
-        "recipient_name": recipient_name,
-        "content": content,
-        "timestamp": datetime.datetime.now(datetime.UTC),
-        "is_read": False
-    }
-    messages.insert_one(message)
+def unread_messages(username):
+    user = users.find_one({"username": username}, {"unread_messages": 1})
+    if not user:
+        return 0
+    if "unread_messages" not in user:
+        # Not seeded yet (see migrate_unread_counts.py), count once and keep the counter from here on
+        count = messages.count_documents({"recipient_name": username, "is_read": False})
+        users.update_one({"_id": user["_id"], "unread_messages": {"$exists": False}}, {"$set": {"unread_messages": count}})
+        return count
+    return max(user["unread_messages"], 0)
+
+def _change_unread(username, change):
+    if change:
+        users.update_one({"username": username}, {"$inc": {"unread_messages": change}})
+
+@messages_bp.route("/api/v1.0/inbox/unread-count", methods=["GET"])
+@jwt_required
+def get_unread_count():
+    unread_count = unread_messages(request.token_data['username'])
+    return make_response(jsonify({"unread_count": unread_count, "hasUnreadMessages": unread_count > 0}), 200)
+
+def send_message( content, recipient_name, coalesce_key=None, summary=None):
+    # Queued, the notification workers write it (see notifications.py)
+    notifications.enqueue(recipient_name, content, coalesce_key, summary)
+
+@messages_bp.route("/api/v1.0/notifications/metrics", methods=["GET"])
+@jwt_required
+@admin_required
+def notification_metrics():
+    return make_response(jsonify(notifications.metrics()), 200)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# EventSource cannot set headers, and a session token in the URL would end up in access and proxy logs. Browsers
+# first POST /inbox/stream-ticket with their token and open /inbox/stream?ticket=<ticket>: a random, single-use
+# ticket that expires after STREAM_TICKET_TTL seconds. Other clients can send x-access-token as usual.
+# Every STREAM_RECHECK seconds the stream checks that the session token is not blacklisted (logout, account
+# deletion) and closes with a "revoked" event if it is, or "expired" once the token expires.
+@messages_bp.route("/api/v1.0/inbox/stream-ticket", methods=["POST"])
+@jwt_required
+def create_stream_ticket():
+    token_data = request.token_data
+    ticket = secrets.token_urlsafe(32)
+    stream_tickets.insert_one({
+        "_id": ticket,
+        "username": token_data['username'],
+        "token_hash": token_digest(request.headers['x-access-token']),
+        "token_expires_at": token_data.get('exp', time.time() + 3600),
+        "expires_at": datetime.utcnow() + timedelta(seconds=STREAM_TICKET_TTL)
+    })
+    return make_response(jsonify({"ticket": ticket, "expires_in": STREAM_TICKET_TTL}), 201)
+
+def _stream_session():
+    """ (username, token digest, token expiry) of the caller of /inbox/stream, or an error response """
+    ticket = request.args.get('ticket')
+    if ticket:
+        # Deleted as it is redeemed, so a ticket seen in a log can't be replayed
+        entry = stream_tickets.find_one_and_delete({"_id": ticket, "expires_at": {"$gt": datetime.utcnow()}})
+        if not entry:
+            return None, make_response(jsonify({'message': 'Stream ticket is invalid or has expired'}), 401)
+        if digest_revoked(entry["token_hash"]):
+            return None, make_response(jsonify({'message': 'Token has been cancelled'}), 401)
+        return (entry["username"], entry["token_hash"], entry["token_expires_at"]), None
+
+    token = request.headers.get('x-access-token')
+    if not token:
+        return None, make_response(jsonify({'message': 'Token is Missing'}), 401)
+    try:
+        token_data = verify_token(token)
+    except TokenRevoked:
+        return None, make_response(jsonify({'message': 'Token has been cancelled'}), 401)
+    except Exception:
+        return None, make_response(jsonify({'message': 'Token is invalid'}), 401)
+    return (token_data['username'], token_digest(token), token_data.get('exp', time.time() + 3600)), None
+
+@messages_bp.route("/api/v1.0/inbox/stream", methods=["GET"])
+def stream_messages():
+    """ Server-Sent Events stream of new messages """
+    session, error = _stream_session()
+    if error:
+        return error
+
+    username, digest, expires_at = session
+    subscriber = push.subscribe(username)
+    if subscriber is None:
+        # This worker is holding as many streams as it can, fall back to polling
+        response = make_response(jsonify({
+            "error": "Too many open streams, poll for new messages instead",
+            "poll": "/api/v1.0/inbox/unread-count"
+        }), 503)
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER)
+        return response
+
+    def events():
+        try:
+            yield _sse("unread", {"unread_count": unread_messages(username)})
+            checked_at = time.time()
+            while time.time() < expires_at:
+                if time.time() - checked_at >= STREAM_RECHECK:
+                    if digest_revoked(digest):
+                        yield _sse("revoked", {})
+                        return
+                    checked_at = time.time()
+                try:
+                    message = subscriber.get(timeout=min(STREAM_HEARTBEAT, STREAM_RECHECK))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse("message", {
+                    "_id": str(message["_id"]),
+                    "recipient_name": message["recipient_name"],
+                    "content": message["content"],
+                    "timestamp": message["timestamp"].isoformat(),
+                    "is_read": message.get("is_read", False)
+                })
+            # The token has expired, the client reconnects with a fresh one
+            yield _sse("expired", {})
+        finally:
+            push.unsubscribe(username, subscriber)
+
+    response = Response(events(), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @messages_bp.route("/api/v1.0/inbox/<string:id>", methods=["GET"])
 @jwt_required
@@ -54,18 +185,43 @@ def show_one_message(id):
 @messages_bp.route("/api/v1.0/inbox/<message_id>/read", methods=["PUT"])
 @jwt_required
 def mark_as_read(message_id):
-    messages.update_one(
-        {"_id": ObjectId(message_id)},
+    username = request.token_data['username']
+    result = messages.update_one(
+        {"_id": ObjectId(message_id), "recipient_name": username, "is_read": False},
         {"$set": {"is_read": True}}
     )
+    _change_unread(username, -result.modified_count)
     return jsonify({"message": "Message marked as read"}), 200
 
+@messages_bp.route("/api/v1.0/inbox/read-all", methods=["PUT"])
+@jwt_required
+def mark_all_as_read():
+    username = request.token_data['username']
+    result = messages.update_many({"recipient_name": username, "is_read": False}, {"$set": {"is_read": True}})
+    _change_unread(username, -result.modified_count)
+    return make_response(jsonify({"message": f"{result.modified_count} messages marked as read"}), 200)
+
 
 @messages_bp.route("/api/v1.0/inbox/<string:id>", methods=["DELETE"])
 @jwt_required
 def delete_message(id):
-    result = messages.delete_one({"_id":ObjectId(id)})
-    if result.deleted_count == 1:
+    username = request.token_data['username']
+    message = messages.find_one_and_delete({"_id": ObjectId(id), "recipient_name": username}, projection={"is_read": 1})
+    if message is not None:
+        if not message.get("is_read", False):
+            _change_unread(username, -1)
         return make_response(jsonify({}), 204)
     else:
-        return make_response(jsonify({"error": "Invalid Message ID"}), 404)
\ No newline at end of file
+        return make_response(jsonify({"error": "Invalid Message ID"}), 404)
+
+@messages_bp.route("/api/v1.0/inbox", methods=["DELETE"])
+@jwt_required
+def delete_all_messages():
+    """ Empty the inbox, or only its read messages with ?read_only=true """
+    username = request.token_data['username']
+    deleted = messages.delete_many({"recipient_name": username, "is_read": True}).deleted_count
+    if request.args.get('read_only', '').lower() != 'true':
+        unread_deleted = messages.delete_many({"recipient_name": username, "is_read": {"$ne": True}}).deleted_count
+        _change_unread(username, -unread_deleted)
+        deleted += unread_deleted
+    return make_response(jsonify({"message": f"{deleted} messages deleted"}), 200)
@@ -2,30 +2,70 @@ from flask import Blueprint, jsonify, make_response, request
 from bson import ObjectId
 from bson.regex import Regex
 from datetime import datetime
-from aggregation import user_score_aggregation
+from aggregation import review_counter_update
 from decorators import jwt_required, admin_required, author_required
 import globals
 from blueprints.messages.messages import send_message
+from activity import remove_activities
+from pagination import paginate, page_response
+from cache import invalidate_book
+from leaderboard import update_leaderboard
 
 reports_bp = Blueprint("reports_bp", __name__)
 books = globals.db.books
+reviews = globals.db.reviews
+review_replies = globals.db.review_replies
 thoughts = globals.db.thoughts
 reports = globals.db.reports
 
+# New reports are created as "pending", older ones may have no status at all
+OPEN_REPORTS = {"status": {"$in": ["pending", None]}}
+
 # REPORT APIS
 #------------------------------------------------------------------------------------------------------------------
+# Approved and rejected reports are kept as resolved (status, resolved_at, resolved_by) rather than deleted, and
+# are archived by retention.py once they are old enough.
+def claim_report(report_id, status, admin_username):
+    """ Resolve an open report in one atomic write. (report, None), or (None, error response) when it doesn't exist
+        or was already resolved, so two admins can't act on the same report twice """
+    report = reports.find_one_and_update(
+        {"_id": ObjectId(report_id), **OPEN_REPORTS},
+        {"$set": {"status": status, "resolved_at": datetime.utcnow(), "resolved_by": admin_username}}
+    )
+    if report:
+        return report, None
+    if reports.count_documents({"_id": ObjectId(report_id)}, limit=1):
+        return None, make_response(jsonify({"error": "Report has already been resolved"}), 409)
+    return None, make_response(jsonify({"error": "Report not found"}), 404)
+
+
+def reopen_report(report_id):
+    """ Undo claim_report when the report could not be acted on """
+    reports.update_one(
+        {"_id": report_id},
+        {"$set": {"status": "pending"}, "$unset": {"resolved_at": "", "resolved_by": ""}}
+    )
+
+
 @reports_bp.route("/api/v1.0/reports", methods=["GET"])
 @jwt_required
 @admin_required
 def get_all_reports():
     all_reports = []
 
-    for report in reports.find():
+    # Open reports by default, ?status=approved|rejected|all for the resolved ones
+    status = request.args.get('status', 'open')
+    query = {} if status == 'all' else OPEN_REPORTS if status == 'open' else {"status": status}
+
+    page, next_cursor = paginate(reports, query, default_page_size=None)
+    for report in page:
         report['_id'] = str(report['_id'])
         report['reported_at'] = report['reported_at'].isoformat()
+        if 'resolved_at' in report:
+            report['resolved_at'] = report['resolved_at'].isoformat()
         all_reports.append(report)
 
-    return make_response(jsonify(all_reports), 200)
+    return page_response(all_reports, next_cursor)
 
 
 @reports_bp.route("/api/v1.0/reports/<string:report_id>", methods=["GET"])
@@ -49,10 +89,9 @@ def approve_report(report_id):
     token_data = request.token_data
     reporter_username = token_data['username']
 
-    report = reports.find_one({"_id": ObjectId(report_id)})
-
-    if not report:
-        return make_response(jsonify({"error": "Report not found"}), 404)
+    report, error = claim_report(report_id, "approved", reporter_username)
+    if error:
+        return error
 
     reported_id = ObjectId(report['item_id'])
     report_type = report['type']
@@ -66,47 +105,38 @@ def approve_report(report_id):
 
     if report_type == 'review':
         book_id = ObjectId(report['book_id'])
-        user_score = user_score_aggregation(book_id)
 
-        review = books.find_one(
-            {"_id": book_id, "user_reviews._id": reported_id},
-            {"user_reviews.$": 1}
-        )
-        if review and review.get("user_reviews"):
-            review_user = review["user_reviews"][0]["username"]
+        review = reviews.find_one({"_id": reported_id}, {"username": 1, "stars": 1})
+        if review:
+            review_user = review["username"]
 
-        update_result = books.update_one(
-            {"_id": book_id},
-            {"$pull": {"user_reviews": {"_id": reported_id}}}
-        )
+        update_result = reviews.delete_one({"_id": reported_id})
+        review_replies.delete_many({"review_id": reported_id})
 
-        books.update_one({"_id": book_id}, {"$set": {"user_score": user_score}})
+        if update_result.deleted_count == 1:
+            books.update_one({"_id": book_id}, review_counter_update(review["stars"], -1))
+            remove_activities(review_id=str(reported_id))
+            update_leaderboard(book_id)
+            invalidate_book(book_id)
 
     elif report_type == 'review reply':
-        book_id = ObjectId(report['book_id'])
+        reply = review_replies.find_one({"_id": reported_id}, {"username": 1, "book_id": 1})
+        if reply:
+            reply_user = reply['username']
 
-        parent_review = books.find_one(
-            {"_id": book_id, "user_reviews.replies._id": reported_id},
-            {"user_reviews.$": 1}
-        )
-        if parent_review and parent_review.get("user_reviews"):
-            replies = parent_review['user_reviews'][0].get('replies', [])
-            for reply in replies:
-                if reply['_id'] == reported_id:
-                    reply_user = reply['username']
-                    break
-
-        update_result = books.update_one(
-            {"_id": book_id, "user_reviews._id": parent_review['user_reviews'][0]['_id']},
-            {"$pull": {"user_reviews.$.replies": {"_id": reported_id}}}
-        )
+        update_result = review_replies.delete_one({"_id": reported_id})
+        remove_activities(reply_id=str(reported_id))
+        if update_result.deleted_count == 1:
+            invalidate_book(reply["book_id"], catalogue=False)
 
     elif report_type == 'thought':
         thought = thoughts.find_one({"_id": reported_id})
         if thought:
             thought_user = thought["username"]
             update_result = thoughts.delete_one({"_id": reported_id})
+            remove_activities(thought_id=str(reported_id))
         else:
+            reopen_report(report["_id"])
             return make_response(jsonify({"error": "Thought not found"}), 404)
 
     elif report_type == 'thought reply':
@@ -123,7 +153,9 @@ def approve_report(report_id):
             {"_id": thought_id},
             {"$pull": {"replies": {"_id": reported_id}}}
         )
+        remove_activities(reply_id=str(reported_id))
     else:
+        reopen_report(report["_id"])
         return make_response(jsonify({"error": "Invalid report type"}), 400)
 
     if isinstance(update_result, dict):
@@ -136,6 +168,7 @@ def approve_report(report_id):
         operation_count = 0
 
     if operation_count == 0:
+        reopen_report(report["_id"])
         return make_response(jsonify({"error": f"{report_type.capitalize()} not found or already removed"}), 404)
 
     send_message(
@@ -164,9 +197,7 @@ def approve_report(report_id):
             content="Your reply to a thought has been removed because it violated our community guidelines."
         )
 
-    reports.delete_one({"_id": ObjectId(report_id)})
-
-    return make_response(jsonify({"message": f"{report_type.capitalize()} and report deleted successfully"}), 200)
+    return make_response(jsonify({"message": f"{report_type.capitalize()} deleted and report resolved successfully"}), 200)
 
 
 
@@ -178,10 +209,9 @@ def reject_report(report_id):
     token_data = request.token_data
     reporter_username = token_data['username']
 
-    report = reports.find_one({"_id": ObjectId(report_id)})
-
-    if not report:
-        return make_response(jsonify({"error": "Report not found"}), 404)
+    report, error = claim_report(report_id, "rejected", reporter_username)
+    if error:
+        return error
 
     report_type = report['type']
     
@@ -190,9 +220,7 @@ def reject_report(report_id):
         content=f"Thank you for your report! After reviewing it, we have determined that the {report_type} does not violate our community guidlines and will not be removed."
     )
 
-    reports.delete_one({"_id": ObjectId(report_id)})
-
-    return make_response(jsonify({"message": "Report deleted successfully"}), 200)
+    return make_response(jsonify({"message": "Report resolved successfully"}), 200)
 
 @reports_bp.route("/api/v1.0/reports/<string:report_id>", methods=["DELETE"])
 @jwt_required
@@ -4,6 +4,11 @@ from bson import ObjectId
 from decorators import jwt_required, admin_required
 import globals
 from blueprints.messages.messages import send_message
+from pagination import paginate, page_response
+from search import search_keys
+from facets import update_facets
+from cache import invalidate, CATALOGUE
+from releases import release_dates, published_at, refresh_release
 
 request_books_bp = Blueprint("request_books_bp", __name__)
 
@@ -68,18 +73,12 @@ def add_new_book_request():
 @jwt_required
 @admin_required
 def show_all_book_requests():
-    page_num, page_size = 1, 20
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = page_size * (page_num - 1)
-
     all_requests = []
-    for book_request in requests.find().skip(page_start).limit(page_size):
+    page, next_cursor = paginate(requests, {}, default_page_size=20)
+    for book_request in page:
         book_request['_id'] = str(book_request['_id'])
         all_requests.append(book_request)
-    return make_response(jsonify(all_requests), 200)
+    return page_response(all_requests, next_cursor)
 
 @request_books_bp.route("/api/v1.0/requests/<string:id>", methods=["GET"])
 @jwt_required
@@ -121,6 +120,7 @@ def approve_book_request(id):
 
     publish_year = extract_year(approved_book_data['publishDate'])
     first_publish_year = extract_year(approved_book_data['firstPublishDate'])
+    dates = release_dates(approved_book_data)
 
     book_request_isbn = book_request.get('isbn', 0)
     approved_isbn = int(approved_book_data.get('isbn', 0))
@@ -133,8 +133,9 @@ def approve_book_request(id):
         'language': book_request['language'],
         'series': book_request['series'],
         'user_score': int(approved_book_data.get('user_score', 0)),
+        'total_reviews': 0,
+        'positive_reviews': 0,
         'description': approved_book_data.get('description', ''),
-        'user_reviews': [],
         'isbn': int(final_isbn),
         'characters': approved_book_data.get('characters', []), 
         'triggers': approved_book_data.get('triggers', []),
@@ -144,12 +145,18 @@ def approve_book_request(id):
         'publisher': approved_book_data.get('publisher', ''),
         "publishDate": int(publish_year),
         "firstPublishDate": int(first_publish_year),
+        "releaseDates": dates,
+        "publishedAt": published_at({"releaseDates": dates}),
         'awards': approved_book_data.get('awards', []),
         'coverImg': approved_book_data.get('coverImg', ''),
         'price': int(approved_book_data.get('price', 0.0))
     })
+    approved_book_data['search_keys'] = search_keys(approved_book_data)
     
     approved_book_id = books.insert_one(approved_book_data)
+    update_facets(None, approved_book_data)
+    refresh_release(approved_book_id.inserted_id)
+    invalidate(CATALOGUE)
     approved_book_link = f"http://localhost:4200/books/{approved_book_id.inserted_id}"
 
     send_message(
@@ -1,20 +1,54 @@
 from flask import Blueprint, request, make_response, jsonify
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from decorators import jwt_required, admin_required
-from datetime import datetime, timedelta
+from datetime import datetime
 import globals
-from aggregation import user_score_aggregation
+from aggregation import review_counter_update
 from blueprints.messages.messages import send_message
+from activity import record_activity, remove_activities
+from pagination import paginate, page_response
+from sessions import session_profile
+from quotas import take_review_quota, release_review_quota
+from cache import cached_response, invalidate_book
+from leaderboard import update_leaderboard
+from trending import record_event
 
 reviews_bp = Blueprint("reviews_bp", __name__)
 
 users = globals.db.users
 books = globals.db.books
+reviews = globals.db.reviews
+review_replies = globals.db.review_replies
 reports = globals.db.reports
 MAX_REVIEWS_PER_WEEK = 3 # Each user can only post 3 reviews a week
 MIN_ACCOUNT_AGE_DAYS = 3 # Each user needs to wait 3 days after signing up before they can add a review
 
 
+def serialize_review(review):
+    """ Convert ObjectId fields to string """
+    review['_id'] = str(review['_id'])
+    review['book_id'] = str(review['book_id'])
+    return review
+
+def serialize_reply(reply):
+    """ Convert ObjectId fields to string """
+    reply['_id'] = str(reply['_id'])
+    reply['review_id'] = str(reply['review_id'])
+    reply['book_id'] = str(reply['book_id'])
+    return reply
+
+def attach_replies(review_list):
+    """ Fetch the replies for a page of reviews in one query and nest them under each review """
+    replies_by_review = {review['_id']: [] for review in review_list}
+    for reply in review_replies.find({"review_id": {"$in": list(replies_by_review)}}).sort("created_at", 1):
+        replies_by_review[reply['review_id']].append(serialize_reply(reply))
+    for review in review_list:
+        review['replies'] = replies_by_review[review['_id']]
+        serialize_review(review)
+    return review_list
+
+
 # REVIEWS APIS
 #------------------------------------------------------------------------------------------------------------------
 # 1. BASIC REVIEW FEATURES
@@ -25,9 +59,8 @@ def add_new_review(id):
     username = token_data['username']  # USERNAME FROM LOGIN IS FILLED IN AUTOMATICALLY
 
     current_time = datetime.utcnow()
-    start_of_week = current_time - timedelta(days=current_time.weekday())
 
-    user = users.find_one({"username": username})
+    user = session_profile(token_data)
     if not user:
         return make_response(jsonify({"error": "User not found."}), 400)
     
@@ -35,31 +68,6 @@ def add_new_review(id):
     if (current_time - account_creation_date).days < MIN_ACCOUNT_AGE_DAYS:
         return make_response(jsonify({"error": f"Your account must be at least 3 days old to post reviews."}), 400)
 
-    reviews_by_user = []
-    for book in books.find({"user_reviews.username": username}):
-        for review in book.get("user_reviews", []):
-            if review.get("username") == username:
-                review["_id"] = str(review["_id"])
-                review["book_id"] = str(book["_id"])
-                review["book_title"] = book["title"]
-                reviews_by_user.append(review)
-
-    user_reviews_this_week = [
-        review for review in reviews_by_user
-        if review["created_at"] >= start_of_week
-    ]
-
-    review_count = sum(1 for _ in user_reviews_this_week)
-    
-    if review_count >= MAX_REVIEWS_PER_WEEK:
-        return make_response(jsonify({"error": f"You can only post {MAX_REVIEWS_PER_WEEK} reviews per week."}), 400)
-
-    existing_review = books.find_one(
-        {"_id": ObjectId(id), "user_reviews.username": username}
-    )
-    if existing_review:
-        return make_response(jsonify({"error": "You have already reviewed this book."}), 400)
-
     title = request.form.get('title', '')
     comment = request.form.get('comment')
     stars = float(request.form.get('stars'))
@@ -67,8 +75,16 @@ def add_new_review(id):
     if not comment or not stars:
         return make_response(jsonify({"error": "Title, comment, and stars are required."}), 400)
 
+    book = books.find_one({"_id": ObjectId(id)}, {"title": 1})
+    if book is None:
+        return make_response(jsonify({"error": "Invalid Book ID"}), 404)
+
+    if not take_review_quota(username, MAX_REVIEWS_PER_WEEK, current_time):
+        return make_response(jsonify({"error": f"You can only post {MAX_REVIEWS_PER_WEEK} reviews per week."}), 400)
+
     added_review = {
         '_id': ObjectId(),
+        'book_id': ObjectId(id),
         'username': username,
         'title': title,
         'comment': comment,
@@ -76,17 +92,25 @@ def add_new_review(id):
         'likes': 0,  
         'dislikes': 0, 
         'created_at': current_time,
-        'updated_at': current_time,
-        'replies': []
+        'updated_at': current_time
     }
 
-    books.update_one(
-        {"_id": ObjectId(id)},
-        {"$push": {"user_reviews": added_review}}
-    )
+    # The unique (book_id, username) index is the duplicate check
+    try:
+        reviews.insert_one(added_review)
+    except DuplicateKeyError:
+        release_review_quota(username, current_time)
+        return make_response(jsonify({"error": "You have already reviewed this book."}), 400)
 
-    user_score = user_score_aggregation(id)
-    books.update_one({"_id": ObjectId(id)}, {"$set": {"user_score": user_score}})
+    # One write moves the book's review counters and recalculates user_score from them
+    books.update_one({"_id": ObjectId(id)}, review_counter_update(stars, 1))
+    update_leaderboard(id)
+    invalidate_book(id)
+    record_event(ObjectId(id), "review")
+
+    record_activity(username, "reviewed", current_time,
+                    book_id=id, book_title=book["title"], review_id=str(added_review['_id']),
+                    review_content=comment)
 
     new_review_link = f"http://localhost:5000/api/v1.0/books/{id}/reviews/{str(added_review['_id'])}"
     return make_response(jsonify({"url": new_review_link}), 201)
@@ -94,36 +118,21 @@ def add_new_review(id):
 
 
 @reviews_bp.route("/api/v1.0/books/<string:id>/reviews", methods=["GET"])
+@cached_response("book:{id}")
 def show_all_reviews(id):
-    all_reviews = []
-    book = books.find_one({"_id": ObjectId(id)}, {"user_reviews": 1})
-    user_reviews = book.get('user_reviews', ())
-
-
-    for review in user_reviews:
-        review['_id'] = str(review['_id'])
-        all_reviews.append(review)
-        for reply in review['replies']:
-            reply['_id'] = str(reply['_id'])
-        
+    all_reviews, next_cursor = paginate(reviews, {"book_id": ObjectId(id)}, sort=[("created_at", -1)], default_page_size=None)
+    attach_replies(all_reviews)
 
-    return make_response(jsonify(all_reviews), 200)
+    return page_response(all_reviews, next_cursor)
 
 @reviews_bp.route("/api/v1.0/review/<string:review_id>", methods=["GET"])
 def get_one_review(review_id):
-    book = books.find_one(
-        {"user_reviews._id": ObjectId(review_id)},
-        {"_id": 1, "user_reviews.$": 1}
-    )
+    review = reviews.find_one({"_id": ObjectId(review_id)})
 
-    if book is None:
+    if review is None:
         return make_response(jsonify({"error": "Invalid Review ID"}), 400)
 
-    review = book["user_reviews"][0]
-    review["_id"] = str(review["_id"])
-    review["book_id"] = str(book["_id"])
-    for reply in review['replies']:
-        reply['_id'] = str(reply['_id'])
+    attach_replies([review])
 
     return make_response(jsonify(review), 200)
 
@@ -134,32 +143,34 @@ def like_review(book_id, review_id):
     token_data = request.token_data
     liker_username = token_data['username']
 
-    book = books.find_one(
-        {"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)},
-        {"user_reviews.$": 1}
+    review = reviews.find_one(
+        {"_id": ObjectId(review_id), "book_id": ObjectId(book_id)},
+        {"username": 1}
     )
 
-    if not book or "user_reviews" not in book:
+    if not review:
         return make_response(jsonify({"error": "Review not found"}), 404)
 
-    review = book["user_reviews"][0]
     recipient_username = review.get("username")
 
     if liker_username == recipient_username:
         return make_response(jsonify({"error": "You cannot like your own review"}), 400)
 
-    result = books.update_one(
-        {"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)},
-        {"$inc": {"user_reviews.$.likes": 1}}
+    result = reviews.update_one(
+        {"_id": ObjectId(review_id)},
+        {"$inc": {"likes": 1}}
     )
 
     if result.matched_count == 0:
         return make_response(jsonify({"error": "Invalid Review ID"}), 400)
+    invalidate_book(book_id, catalogue=False)
 
     if recipient_username:
         send_message(
             recipient_name=recipient_username,
-            content=f"{liker_username} liked your review!"
+            content=f"{liker_username} liked your review!",
+            coalesce_key=f"review-like:{review_id}",
+            summary="{count} people liked your review!"
         )
 
     return make_response(jsonify({"message": "Review liked successfully"}), 200)
@@ -172,32 +183,34 @@ def dislike_review(book_id, review_id):
     token_data = request.token_data
     disliker_username = token_data['username']
 
-    book = books.find_one(
-        {"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)},
-        {"user_reviews.$": 1}
+    review = reviews.find_one(
+        {"_id": ObjectId(review_id), "book_id": ObjectId(book_id)},
+        {"username": 1}
     )
 
-    if not book or "user_reviews" not in book:
+    if not review:
         return make_response(jsonify({"error": "Review not found"}), 404)
 
-    review = book["user_reviews"][0]
     recipient_username = review.get("username")
 
     if disliker_username == recipient_username:
         return make_response(jsonify({"error": "You cannot dislike your own review"}), 400)
 
-    result = books.update_one(
-        {"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)},
-        {"$inc": {"user_reviews.$.dislikes": 1}}
+    result = reviews.update_one(
+        {"_id": ObjectId(review_id)},
+        {"$inc": {"dislikes": 1}}
     )
 
     if result.matched_count == 0:
         return make_response(jsonify({"error": "Invalid Review ID"}), 400)
+    invalidate_book(book_id, catalogue=False)
 
     if recipient_username:
         send_message(
             recipient_name=recipient_username,
-            content=f"{disliker_username} disliked your review!"
+            content=f"{disliker_username} disliked your review!",
+            coalesce_key=f"review-dislike:{review_id}",
+            summary="{count} people disliked your review!"
         )
 
     return make_response(jsonify({"message": "Review disliked successfully"}), 200)
@@ -211,24 +224,30 @@ def delete_review(book_id, review_id):
     current_user = token_data['username']
     admin = token_data.get('admin', False)
 
-    book = books.find_one(
-        {"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)},
-        {"user_reviews.$": 1}
+    review = reviews.find_one(
+        {"_id": ObjectId(review_id), "book_id": ObjectId(book_id)},
+        {"username": 1, "stars": 1, "created_at": 1}
     )
 
-    if not book or "user_reviews" not in book:
+    if not review:
         return make_response(jsonify({"error": "Review not found"}), 404)
 
-    review = book["user_reviews"][0]
     review_username = review.get("username")
 
     if not admin and review_username != current_user:
         return make_response(jsonify({"error": "Unauthorized to delete this review"}), 403)
 
-    books.update_one({ "_id" : ObjectId(book_id) }, { "$pull" : { "user_reviews" : { "_id" : ObjectId(review_id) } } })
-    
-    user_score = user_score_aggregation(book_id)
-    books.update_one({"_id": ObjectId(book_id)}, {"$set": {"user_score": user_score}})
+    result = reviews.delete_one({"_id": ObjectId(review_id)})
+    review_replies.delete_many({"review_id": ObjectId(review_id)})
+
+    # Only the request that actually removed the review moves the counters
+    if result.deleted_count == 1:
+        books.update_one({"_id": ObjectId(book_id)}, review_counter_update(review["stars"], -1))
+        remove_activities(review_id=review_id)
+        update_leaderboard(book_id)
+        invalidate_book(book_id)
+        if review.get("created_at"):
+            release_review_quota(review_username, review["created_at"])
 
     return make_response(jsonify({}), 204)
 
@@ -244,8 +263,14 @@ def reply_to_review(book_id, review_id):
     if not content:
         return make_response(jsonify({"error": "Please provide a reply content."}), 400)
 
+    review = reviews.find_one({"_id": ObjectId(review_id), "book_id": ObjectId(book_id)}, {"username": 1})
+    if not review:
+        return make_response(jsonify({"error": "Review not found"}), 404)
+
     added_reply = {
         '_id': ObjectId(),
+        'review_id': ObjectId(review_id),
+        'book_id': ObjectId(book_id),
         'username': username,
         'content': content,
         'created_at': datetime.utcnow(),
@@ -253,13 +278,12 @@ def reply_to_review(book_id, review_id):
         'dislikes': 0
     }
 
-    result = books.update_one(
-        {"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)},
-        {"$push": {"user_reviews.$.replies": added_reply}}
-    )
+    review_replies.insert_one(added_reply)
+    invalidate_book(book_id, catalogue=False)
 
-    if result.matched_count == 0:
-        return make_response(jsonify({"error": "Review not found"}), 404)
+    record_activity(username, "replied to a review by", added_reply['created_at'],
+                    review_user=review["username"], book_id=book_id, review_id=review_id,
+                    reply_id=str(added_reply['_id']), review_reply_content=content)
 
     new_reply_link = f"http://localhost:5000/api/v1.0/books/" + str(book_id) + "/reviews/" + str(review_id) + "/replies/" + str(added_reply['_id'])
     return make_response(jsonify({"url": new_reply_link}), 201)
@@ -268,19 +292,13 @@ def reply_to_review(book_id, review_id):
 @reviews_bp.route("/api/v1.0/books/<string:book_id>/reviews/<string:review_id>/replies", methods=["GET"])
 def show_all_replies(book_id, review_id):
     all_replies = []
-    book = books.find_one({"_id": ObjectId(book_id), "user_reviews._id": ObjectId(review_id)}, {"user_reviews.$": 1})
+    review = reviews.find_one({"_id": ObjectId(review_id), "book_id": ObjectId(book_id)}, {"_id": 1})
 
-    if not book or "user_reviews" not in book:
+    if not review:
         return make_response(jsonify({"error": "Review not found"}), 404)
 
-    review = book["user_reviews"][0]
-    replies = review.get('replies', [])
-
-    for reply in replies:
-        reply['_id'] = str(reply['_id'])
-        reply['book_id'] = book_id
-        reply['review_id'] = review_id 
-        all_replies.append(reply)
+    for reply in review_replies.find({"review_id": ObjectId(review_id)}).sort("created_at", 1):
+        all_replies.append(serialize_reply(reply))
 
     return make_response(jsonify(all_replies), 200)
 
@@ -289,16 +307,12 @@ def show_all_replies(book_id, review_id):
 
 @reviews_bp.route("/api/v1.0/review/<string:review_id>/replies/<string:reply_id>", methods=["GET"])
 def get_one_reply(review_id, reply_id):
-    result = books.find_one(
-        {"user_reviews._id": ObjectId(review_id), "user_reviews.replies._id": ObjectId(reply_id)},
-        {"_id": 0, "user_reviews.replies.$": 1} 
-    )
+    reply = review_replies.find_one({"_id": ObjectId(reply_id), "review_id": ObjectId(review_id)})
 
-    if not result or "user_reviews" not in result or not result["user_reviews"]:
+    if not reply:
         return make_response(jsonify({"error": "Invalid reply ID"}), 400)
 
-    reply = result["user_reviews"][0]["replies"][0] 
-    reply["_id"] = str(reply["_id"]) 
+    serialize_reply(reply)
 
     return make_response(jsonify(reply), 200)
 
@@ -310,21 +324,11 @@ def like_reply(review_id, reply_id):
     token_data = request.token_data
     liker_username = token_data['username']
 
-    review = books.find_one(
-        {"user_reviews._id": ObjectId(review_id), "user_reviews.replies._id": ObjectId(reply_id)},
-        {"user_reviews.$": 1}
+    reply = review_replies.find_one(
+        {"_id": ObjectId(reply_id), "review_id": ObjectId(review_id)},
+        {"username": 1, "book_id": 1}
     )
 
-    if not review or not review.get("user_reviews"):
-        return make_response(jsonify({"error": "Review not found"}), 404)
-
-    user_reviews = review["user_reviews"]
-    reply = None
-    for r in user_reviews:
-        reply = next((rep for rep in r.get("replies", []) if str(rep["_id"]) == reply_id), None)
-        if reply:
-            break
-
     if not reply:
         return make_response(jsonify({"error": "Reply not found"}), 404)
 
@@ -333,19 +337,21 @@ def like_reply(review_id, reply_id):
     if liker_username == recipient_username:
         return make_response(jsonify({"message": "You cannot like your own review"}), 403)
 
-    result = books.update_one(
-        {"user_reviews._id": ObjectId(review_id), "user_reviews.replies._id": ObjectId(reply_id)},
-        {"$inc": {"user_reviews.$.replies.$[reply].likes": 1}},
-        array_filters=[{"reply._id": ObjectId(reply_id)}]
+    result = review_replies.update_one(
+        {"_id": ObjectId(reply_id)},
+        {"$inc": {"likes": 1}}
     )
 
     if result.matched_count == 0:
         return make_response(jsonify({"error": "Invalid reply ID"}), 400)
+    invalidate_book(reply["book_id"], catalogue=False)
 
     if recipient_username:
         send_message(
             recipient_name=recipient_username,
-            content=f"{liker_username} liked your reply!"
+            content=f"{liker_username} liked your reply!",
+            coalesce_key=f"reply-like:{reply_id}",
+            summary="{count} people liked your reply!"
         )
 
     return make_response(jsonify({"message": "Reply liked successfully"}), 200)
@@ -363,22 +369,16 @@ def report_review(review_id):
     if not reason:
         return make_response(jsonify({"error": "Please provide a reason for the report."}), 400)
 
-    book = books.find_one(
-        {"user_reviews._id": ObjectId(review_id)},
-        {"_id": 1, "user_reviews.$": 1}
-    )
-
+    review = reviews.find_one({"_id": ObjectId(review_id)})
 
-    if not book or "user_reviews" not in book:
+    if not review:
         return make_response(jsonify({"error": "Review not found"}), 404)
 
-    review = book["user_reviews"][0]
-
     report = {
         "_id": ObjectId(),
         "type": "review",
         "item_id": str(review_id),
-        "book_id": str(book["_id"]),
+        "book_id": str(review["book_id"]),
         "reported_by": reporter_username,
         "reason": reason,
         "reported_at": datetime.utcnow(),
@@ -415,16 +415,7 @@ def report_reply(review_id, reply_id):
     if not reason:
         return make_response(jsonify({"error": "Please provide a reason for the report."}), 400)
 
-    book = books.find_one(
-        {"user_reviews._id": ObjectId(review_id)},
-        {"_id": 1, "user_reviews.$": 1}
-    )
-
-    if not book or "user_reviews" not in book:
-        return make_response(jsonify({"error": "Review not found"}), 404)
-
-    review = book["user_reviews"][0]
-    reply = next((r for r in review.get("replies", []) if str(r["_id"]) == reply_id), None)
+    reply = review_replies.find_one({"_id": ObjectId(reply_id), "review_id": ObjectId(review_id)})
 
     if not reply:
         return make_response(jsonify({"error": "Reply not found"}), 404)
@@ -434,7 +425,7 @@ def report_reply(review_id, reply_id):
         "type": "review reply",
         "item_id": str(reply_id),
         "review_id": str(review_id),
-        "book_id": str(book["_id"]),
+        "book_id": str(reply["book_id"]),
         "reported_by": reporter_username,
         "reason": reason,
         "reported_at": datetime.utcnow(),
@@ -4,6 +4,8 @@ from datetime import datetime
 from decorators import jwt_required, admin_required
 import globals
 from blueprints.messages.messages import send_message
+from activity import record_activity, remove_activities
+from pagination import paginate, page_response
 
 thoughts_bp = Blueprint("thoughts_bp", __name__)
 
@@ -38,21 +40,18 @@ def post_thought():
 
     new_thought_id = thoughts.insert_one(posted_thought)
 
+    record_activity(username, "posted a thought", posted_thought['created_at'],
+                    thought_id=str(posted_thought['_id']), thought_content=comment)
+
     new_thoughts_link = f"http://localhost:4200/api/v1.0/thoughts/{new_thought_id.inserted_id}"
     return make_response(jsonify({"url": new_thoughts_link}), 201)
 
 @thoughts_bp.route("/api/v1.0/thoughts", methods=['GET'])
 @jwt_required
 def show_all_thoughts():
-    page_num, page_size = 1, 20
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = page_size * (page_num - 1)
-
     all_thoughts = []
-    for thought in thoughts.find().skip(page_start).limit(page_size):
+    page, next_cursor = paginate(thoughts, {}, default_page_size=20)
+    for thought in page:
         thought['_id'] = str(thought['_id'])
         thought_info = {
             "_id": thought['_id'],
@@ -67,7 +66,7 @@ def show_all_thoughts():
             reply['_id'] = str(reply['_id'])
         
         all_thoughts.append(thought_info)
-    return make_response(jsonify(all_thoughts), 200)
+    return page_response(all_thoughts, next_cursor)
 
 @thoughts_bp.route("/api/v1.0/thoughts/<string:id>", methods=["GET"])
 @jwt_required
@@ -107,7 +106,9 @@ def like_thought(id):
     if recipient_username:
         send_message(
             recipient_name=recipient_username,
-            content=f"{liker_username} liked your thought!"
+            content=f"{liker_username} liked your thought!",
+            coalesce_key=f"thought-like:{id}",
+            summary="{count} people liked your thought!"
         )
 
     return make_response(jsonify({"message": "Thought liked successfully"}), 200)
@@ -137,7 +138,9 @@ def dislike_thought(id):
     if recipient_username:
         send_message(
             recipient_name=recipient_username,
-            content=f"{disliker_username} disliked your thought!"
+            content=f"{disliker_username} disliked your thought!",
+            coalesce_key=f"thought-dislike:{id}",
+            summary="{count} people disliked your thought!"
         )
 
     return make_response(jsonify({"message": "Thought disliked successfully"}), 200)
@@ -166,6 +169,7 @@ def delete_thought(id):
 
     result = thoughts.delete_one({"_id":ObjectId(id)})
     if result.deleted_count == 1:
+        remove_activities(thought_id=id)
         return make_response(jsonify({}), 204)
     else:
         return make_response(jsonify({"error": "Invalid request ID"}), 404)
@@ -207,10 +211,17 @@ def reply_to_thought(id):
         'dislikes': 0
     }
 
-    thoughts.update_one(
+    thought = thoughts.find_one_and_update(
         {"_id": ObjectId(id)},
-        {"$push": {"replies": added_reply}}
+        {"$push": {"replies": added_reply}},
+        projection={"username": 1}
     )
+    if not thought:
+        return make_response(jsonify({"error": "Thought not found"}), 404)
+
+    record_activity(username, "replied to a thought by", added_reply['created_at'],
+                    thought_id=id, thought_user=thought["username"], reply_id=str(added_reply['_id']),
+                    reply_content=content)
 
     new_reply_link = f"http://localhost:5000/api/v1.0/thoughts/" + id + "/replies/" + str(added_reply['_id'])
     return make_response(jsonify({"url": new_reply_link}), 201)
@@ -277,7 +288,9 @@ def like_reply(thought_id, reply_id):
     if recipient_username:
         send_message(
             recipient_name=recipient_username,
-            content=f"{liker_username} liked your Reply!"
+            content=f"{liker_username} liked your Reply!",
+            coalesce_key=f"thought-reply-like:{reply_id}",
+            summary="{count} people liked your Reply!"
         )
 
     return make_response(jsonify({"message": "Reply liked successfully"}), 200)
@@ -305,6 +318,7 @@ def delete_reply(thought_id, reply_id):
         return make_response(jsonify({"error": "Unauthorized to delete this review"}), 403)
 
     thoughts.update_one({ "_id" : ObjectId(thought_id) }, { "$pull" : { "replies" : { "_id" : ObjectId(reply_id) } } })
+    remove_activities(reply_id=reply_id)
     
     
     return make_response(jsonify({}), 204)
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, make_response
 from bson import ObjectId
 from decorators import jwt_required, admin_required
+from facets import facet_response, update_facets
+from cache import invalidate_book
 import globals
 
 triggers_bp = Blueprint("triggers_bp", __name__)
@@ -11,8 +13,7 @@ books = globals.db.books
 @triggers_bp.route("/api/v1.0/triggers", methods=["GET"])
 def get_all_trigger_warnings():
     try:
-        triggers = books.distinct("triggers")
-        return make_response(jsonify(triggers), 200)
+        return facet_response("triggers")
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
     
@@ -26,9 +27,13 @@ def add_trigger_warnings(id):
 
     trigger_list = list(set(trigger_list))
 
-    books.update_one(
+    book = books.find_one_and_update(
         {"_id": ObjectId(id)},
-        {"$addToSet": {"triggers": {"$each": trigger_list}}} 
+        {"$addToSet": {"triggers": {"$each": trigger_list}}},
+        projection={"triggers": 1}
     )
+    if book:
+        update_facets(book, {"triggers": book.get("triggers", []) + trigger_list})
+        invalidate_book(id)
 
     return make_response(jsonify({"message": "Trigger(s) added successfully"}), 201)
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import request, make_response
+from pymongo import UpdateOne
+import threading
+import sqlite3
+import json
+import random
+import time
+import os
+import globals
+
+cache_versions = globals.db.cache_versions
+
+CACHE_SIZE = 2000 # Responses kept by the in-process LRU
+SHARED_CACHE_SIZE = 20000 # Responses kept by the sqlite store
+SHARED_CACHE_TRIM = 0.01 # Share of sqlite writes that also trim it back to SHARED_CACHE_SIZE
+CACHE_MAX_AGE = 300 # Seconds, backstop for what no write path versions (e.g. a book's same-author list)
+CACHED_HEADERS = ("Content-Type", "X-Next-Cursor")
+CATALOGUE = "catalogue" # Version of every book listing
+NEIGHBOURS = "neighbours" # Version of the "readers also read" lists, bumped by similarity.py
+
+# RESPONSE CACHE
+#------------------------------------------------------------------------------------------------------------------
+# Public, read-heavy GET views are cached per path and query string. Each cached view names the version counters
+# its response depends on ("book:<id>", CATALOGUE...), kept in the cache_versions collection, and their current
+# values are part of the cache key. Write paths bump the counters they affect, so the next read misses and
+# recomputes, while every other entry stays valid. Entries under old versions are never read again and age out.
+# Reading the counters is one _id lookup per request, shared by every worker, so no process serves a stale page.
+#
+# Responses are kept in a size-bound LRU per process. Set RESPONSE_CACHE_DB to a file path to share them between
+# the worker processes of a host through sqlite instead.
+class LRUBackend:
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteBackend:
+    """ Responses in a local sqlite file, shared by every worker process on the host. Stored as plain columns (the
+        JSON body as text, the headers as a JSON list) so nothing read back from the file is ever unpickled """
+    def __init__(self, path, max_entries=SHARED_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite connections can't cross threads or forks, each thread of each process opens its own
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("DROP TABLE IF EXISTS responses") # Pickled entries of earlier versions
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cached_responses (key TEXT PRIMARY KEY, body TEXT, headers TEXT, stored_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cached_responses_stored_at ON cached_responses (stored_at)")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                "SELECT stored_at, body, headers FROM cached_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            headers = [(str(name), str(value)) for name, value in json.loads(row[2])]
+            return row[0], (row[1].encode("utf-8"), headers)
+        except (sqlite3.Error, ValueError, TypeError):
+            return None
+
+    def set(self, key, value):
+        stored_at, (body, headers) = value
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO cached_responses VALUES (?, ?, ?, ?)",
+                (key, body.decode("utf-8"), json.dumps(headers), stored_at)
+            )
+            if random.random() < SHARED_CACHE_TRIM:
+                connection.execute(
+                    "DELETE FROM cached_responses WHERE key IN "
+                    "(SELECT key FROM cached_responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except (sqlite3.Error, UnicodeDecodeError) as e:
+            print(f"Response cache write failed: {e}")
+
+
+_backend = SqliteBackend(os.environ["RESPONSE_CACHE_DB"]) if os.environ.get("RESPONSE_CACHE_DB") else LRUBackend()
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def book_scope(book_id):
+    return f"book:{book_id}"
+
+
+def invalidate(*scopes):
+    """ Bump the version counters of everything a write changed """
+    cache_versions.bulk_write([
+        UpdateOne({"_id": scope}, {"$inc": {"version": 1}}, upsert=True) for scope in scopes
+    ], ordered=False)
+
+
+def invalidate_book(book_id, catalogue=True):
+    """ For writes to a book or its reviews. catalogue=False when nothing listings show changed (likes, replies) """
+    if catalogue:
+        invalidate(book_scope(book_id), CATALOGUE)
+    else:
+        invalidate(book_scope(book_id))
+
+
+def _versions(scopes):
+    found = {version["_id"]: version["version"] for version in cache_versions.find({"_id": {"$in": scopes}})}
+    return ",".join(f"{scope}={found.get(scope, 0)}" for scope in scopes)
+
+
+def cached_response(*scopes):
+    """ Cache a public GET view's 200 responses. scopes are formatted with the view's arguments, e.g. "book:{id}" """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            names = [scope.format(**kwargs) for scope in scopes]
+            key = f"{request.path}?{urlencode(sorted(request.args.items(multi=True)))}|{_versions(names)}"
+
+            cached = _backend.get(key)
+            if cached is not None and time.time() - cached[0] < CACHE_MAX_AGE:
+                body, headers = cached[1]
+                response = make_response(body, 200, headers)
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                headers = [(name, value) for name, value in response.headers if name in CACHED_HEADERS]
+                _backend.set(key, (time.time(), (response.get_data(), headers)))
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,81 @@
+import json
+import sys
+import jwt
+from datetime import datetime, timezone
+from pymongo import UpdateOne, DeleteOne
+from decorators import token_digest
+import globals
+
+blacklist = globals.db.blacklist
+
+BLACKLIST_EXPORT = "database collections/blacklist.json"
+
+# ONE-OFF BLACKLIST MIGRATION
+#------------------------------------------------------------------------------------------------------------------
+# Old blacklist entries hold the raw JWT ({"token": "eyJ..."}). New entries hold a fixed-size digest of the token
+# and the time it expires ({"token_hash": "...", "expires_at": date}), and the TTL index on expires_at removes them
+# once the token could no longer validate anyway. Run it once before deploying: the old entries (no token_hash)
+# would make the unique token_hash index that indexes.ensure_indexes builds at startup fail.
+def token_expiry(token):
+    # The signature was checked when the token was blacklisted, only the exp claim is needed here
+    data = jwt.decode(token, options={"verify_signature": False, "verify_exp": False})
+    return datetime.fromtimestamp(data["exp"], tz=timezone.utc)
+
+
+def compact_collection():
+    operations = []
+    digests = set()
+    for entry in blacklist.find({"token": {"$exists": True}}):
+        try:
+            expires_at = token_expiry(entry["token"])
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            # Can't be decoded, so it can't be presented as a valid token either
+            operations.append(DeleteOne({"_id": entry["_id"]}))
+            continue
+        digest = token_digest(entry["token"])
+        if digest in digests or blacklist.find_one({"token_hash": digest}, {"_id": 1}):
+            # The same token blacklisted twice, one entry is enough (and token_hash is unique)
+            operations.append(DeleteOne({"_id": entry["_id"]}))
+            continue
+        digests.add(digest)
+        operations.append(UpdateOne(
+            {"_id": entry["_id"]},
+            {
+                "$set": {"token_hash": digest, "expires_at": expires_at},
+                "$unset": {"token": ""}
+            }
+        ))
+    if operations:
+        blacklist.bulk_write(operations, ordered=False)
+        print(f"Compacted {len(operations)} blacklist entries")
+    return len(operations)
+
+
+def compact_export(path=BLACKLIST_EXPORT):
+    with open(path) as f:
+        entries = json.load(f)
+
+    compacted = []
+    for entry in entries:
+        if "token" not in entry:
+            compacted.append(entry)
+            continue
+        expires_at = token_expiry(entry["token"]).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        compacted.append({
+            "_id": entry["_id"],
+            "token_hash": token_digest(entry["token"]),
+            "expires_at": {"$date": expires_at}
+        })
+
+    with open(path, "w") as f:
+        json.dump(compacted, f, indent=4)
+    print(f"Compacted {len(compacted)} entries in {path}")
+
+
+if __name__ == "__main__":
+    # python compact_blacklist.py          -> migrate the live blacklist collection
+    # python compact_blacklist.py --export -> rewrite the JSON export in 'database collections'
+    if "--export" in sys.argv:
+        compact_export()
+    else:
+        compact_collection()
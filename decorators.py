@@ -1,10 +1,114 @@
 from flask import request, jsonify, make_response
 import jwt
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 from functools import wraps
 import globals
 
 blacklist = globals.db.blacklist
 
+# TOKEN VERIFICATION CACHE
+#------------------------------------------------------------------------------------------------------------------
+# Verified tokens are remembered per process so an authenticated request needs no decode and no blacklist lookup.
+# An entry is trusted until the token expires or TOKEN_CACHE_TTL passes, whichever is first. The TTL bounds how
+# long another worker process can keep accepting a token after it has been blacklisted somewhere else.
+TOKEN_CACHE_TTL = 60  # seconds
+TOKEN_CACHE_SIZE = 10000
+REVOKED_CACHE_SIZE = 10000
+TOKEN_LIFETIME = 3600  # seconds, how long auth's login issues a token for
+
+_verified_tokens = OrderedDict()  # token digest -> (token data, trusted until)
+_revoked_tokens = OrderedDict()  # token digest -> None, LRU of tokens known to be blacklisted
+_token_lock = threading.Lock()
+
+
+class TokenRevoked(Exception):
+    pass
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _remember(cache, key, value, max_size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def verify_token(token):
+    """ Decode a token and check the blacklist, using the per-process cache when possible """
+    digest = token_digest(token)
+    now = time.time()
+
+    with _token_lock:
+        if digest in _revoked_tokens:
+            raise TokenRevoked()
+        cached = _verified_tokens.get(digest)
+        if cached is not None and now < cached[1]:
+            _verified_tokens.move_to_end(digest)
+            return cached[0]
+
+    data = jwt.decode(token, globals.secret_key, algorithms=["HS256"])
+
+    if blacklist.find_one({"token_hash": digest}, {"_id": 1}) is not None:
+        with _token_lock:
+            _verified_tokens.pop(digest, None)
+            _remember(_revoked_tokens, digest, None, REVOKED_CACHE_SIZE)
+        raise TokenRevoked()
+
+    trusted_until = min(data.get("exp", now + TOKEN_CACHE_TTL), now + TOKEN_CACHE_TTL)
+    with _token_lock:
+        _remember(_verified_tokens, digest, (data, trusted_until), TOKEN_CACHE_SIZE)
+    return data
+
+
+def digest_revoked(digest):
+    """ Whether the token with this digest has been blacklisted, read from the database rather than the verified
+        cache, for connections that outlive the request that authenticated them """
+    with _token_lock:
+        if digest in _revoked_tokens:
+            return True
+    if blacklist.find_one({"token_hash": digest}, {"_id": 1}) is None:
+        return False
+    with _token_lock:
+        _verified_tokens.pop(digest, None)
+        _remember(_revoked_tokens, digest, None, REVOKED_CACHE_SIZE)
+    return True
+
+
+def blacklist_token(token):
+    """ Cancel a token: store it in the blacklist and drop it from this process's cache straight away """
+    # Only the digest and expiry are kept, the TTL index on expires_at removes the entry once the token has expired
+    data = jwt.decode(token, globals.secret_key, algorithms=["HS256"], options={"verify_exp": False})
+    digest = token_digest(token)
+    # A token without an exp claim is kept for as long as a freshly issued one would be valid
+    expires_at = data.get("exp", time.time() + TOKEN_LIFETIME)
+    blacklist.update_one(
+        {"token_hash": digest},
+        {"$setOnInsert": {"expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc)}},
+        upsert=True
+    )
+    with _token_lock:
+        _verified_tokens.pop(digest, None)
+        _remember(_revoked_tokens, digest, None, REVOKED_CACHE_SIZE)
+
+
+def _token_data():
+    # jwt_required has already decoded the token for this request, stacked decorators reuse it
+    data = getattr(request, 'token_data', None)
+    if data is None:
+        data = verify_token(request.headers['x-access-token'])
+        request.token_data = data
+    return data
+
+
+# DECORATORS
+#------------------------------------------------------------------------------------------------------------------
 def jwt_required(func):
     @wraps(func)
     def jwt_required_wrapper(*args, **kwargs):
@@ -14,21 +118,18 @@ def jwt_required(func):
         if not token:
             return make_response( jsonify( { 'message' : 'Token is Missing' } ), 401 )
         try:
-            data = jwt.decode( token, globals.secret_key, algorithms="HS256" )
-            request.token_data = data
+            request.token_data = verify_token(token)
+        except TokenRevoked:
+            return make_response(jsonify( {'message' : 'Token has been cancelled'} ), 401 )
         except:
             return make_response( jsonify( { 'message' : 'Token is invalid' } ), 401 )
-        bl_token = blacklist.find_one({"token":token})
-        if bl_token is not None:
-            return make_response(jsonify( {'message' : 'Token has been cancelled'} ), 401 )
         return func(*args, **kwargs)
     return jwt_required_wrapper
 
 def admin_required(func):
     @wraps(func)
     def admin_required_wrapper(*args, **kwargs):
-        token = request.headers['x-access-token']
-        data = jwt.decode(token, globals.secret_key, algorithms="HS256")
+        data = _token_data()
         if data["admin"]:
             return func(*args, **kwargs)
         else:
@@ -42,9 +143,11 @@ def author_required(func):
 
         if not token:
             return make_response(jsonify({'message': 'Token is missing'}), 403)
-        
+
         try:
-            data = jwt.decode(token, globals.secret_key, algorithms=["HS256"])
+            data = _token_data()
+        except TokenRevoked:
+            return make_response(jsonify({'message': 'Token has been cancelled'}), 401)
         except jwt.ExpiredSignatureError:
             return make_response(jsonify({'message': 'Token has expired'}), 401)
         except jwt.InvalidTokenError:
@@ -58,6 +161,5 @@ def author_required(func):
             return func(*args, **kwargs)
         else:
             return make_response(jsonify({'message': 'Author access denied'}), 403)
-    
-    return author_required_wrapper
 
+    return author_required_wrapper
@@ -0,0 +1,135 @@
+from flask import request, jsonify, make_response
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import threading
+import time
+import globals
+
+facet_counts = globals.db.facet_counts
+facet_versions = globals.db.facet_versions
+books = globals.db.books
+
+FACETS = ("genres", "author", "triggers")
+FACET_CACHE_TTL = 5 # Seconds a worker trusts its cached list before re-checking the shared version
+
+_cache = {} # facet -> {"version", "checked_at", "counts"}
+_cache_lock = threading.Lock()
+
+# CATALOGUE FACETS
+#------------------------------------------------------------------------------------------------------------------
+# facet_counts holds one {facet, value, count} document per genre / author / trigger warning, kept up to date by
+# the handlers that change books (update_facets(before, after)) instead of running books.distinct() per request.
+# Each change bumps the facet's version in facet_versions. The version is the ETag of the facet list, so a client
+# sending If-None-Match with the current version gets a 304 without the list being read or sent.
+def _values(book, facet):
+    if not book:
+        return set()
+    value = book.get(facet)
+    values = value if isinstance(value, list) else [value]
+    return {value for value in values if value}
+
+
+def update_facets(before, after):
+    """ Apply the facet changes between two versions of a book (None for an added or deleted book) """
+    for facet in FACETS:
+        old_values = _values(before, facet)
+        new_values = _values(after, facet)
+        changes = [(value, 1) for value in new_values - old_values] + [(value, -1) for value in old_values - new_values]
+        if not changes:
+            continue
+
+        facet_counts.bulk_write([
+            UpdateOne({"facet": facet, "value": value}, {"$inc": {"count": change}}, upsert=True)
+            for value, change in changes
+        ], ordered=False)
+        facet_counts.delete_many({"facet": facet, "count": {"$lte": 0}})
+        facet_versions.update_one({"_id": facet}, {"$inc": {"version": 1}}, upsert=True)
+
+        with _cache_lock:
+            _cache.pop(facet, None)
+
+
+def _current_version(facet):
+    version = facet_versions.find_one({"_id": facet})
+    return version["version"] if version else 0
+
+
+def facet_values(facet):
+    """ (version, [{"value", "count"}]) for a facet, from this worker's cache while it is still current """
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(facet)
+    if cached and now - cached["checked_at"] < FACET_CACHE_TTL:
+        return cached["version"], cached["counts"]
+
+    version = _current_version(facet)
+    if not cached or cached["version"] != version:
+        counts = [
+            {"value": count["value"], "count": count["count"]}
+            for count in facet_counts.find({"facet": facet}, {"_id": 0, "value": 1, "count": 1}).sort("value", 1)
+        ]
+        cached = {"version": version, "counts": counts}
+    cached = {**cached, "checked_at": now}
+
+    with _cache_lock:
+        _cache[facet] = cached
+    return cached["version"], cached["counts"]
+
+
+def facet_response(facet):
+    """ The facet list as a response: values only, or with book counts when ?counts=true """
+    with_counts = request.args.get('counts', '').lower() == 'true'
+    version, counts = facet_values(facet)
+    # The counts flag changes the body but not the version, so it is part of the ETag too
+    etag = f'{facet}-{version}{"-counts" if with_counts else ""}'
+
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    elif with_counts:
+        response = make_response(jsonify(counts), 200)
+    else:
+        response = make_response(jsonify([count["value"] for count in counts]), 200)
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def rebuild_facet(facet):
+    """ Recount one facet from the books collection """
+    counted = books.aggregate([
+        {"$unwind": f"${facet}"},
+        {"$group": {"_id": f"${facet}", "count": {"$sum": 1}}}
+    ])
+    facet_counts.delete_many({"facet": facet})
+    documents = [{"facet": facet, "value": count["_id"], "count": count["count"]} for count in counted if count["_id"]]
+    if documents:
+        facet_counts.insert_many(documents)
+    version = facet_versions.find_one_and_update({"_id": facet}, {"$inc": {"version": 1}}, upsert=True,
+                                                 return_document=ReturnDocument.AFTER)
+    with _cache_lock:
+        _cache.pop(facet, None)
+    print(f"{facet}: {len(documents)} values (version {version['version']})")
+
+
+def rebuild_facets():
+    """ One-off / reconciliation: recount every facet from the books collection """
+    for facet in FACETS:
+        rebuild_facet(facet)
+
+
+def seed_facets():
+    """ Run at startup: count the facets that have never been counted, e.g. on the first deploy of facet_counts.
+        The process that creates a facet's version document does the count, so workers starting together don't
+        count the same facet twice """
+    for facet in FACETS:
+        try:
+            result = facet_versions.update_one({"_id": facet}, {"$setOnInsert": {"version": 0}}, upsert=True)
+        except DuplicateKeyError:
+            continue # Another process created it first
+        if result.upserted_id is not None:
+            rebuild_facet(facet)
+
+
+if __name__ == "__main__":
+    rebuild_facets()
@@ -0,0 +1,96 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import globals
+
+users = globals.db.users
+follows = globals.db.follows
+
+# FOLLOW GRAPH
+#------------------------------------------------------------------------------------------------------------------
+# One {follower, followee} edge per follow instead of embedded followers/following arrays on both users.
+# Edges are unique on (follower, followee) and also indexed on (followee, follower), so "who do I follow",
+# "who follows me" and "do I follow them" are all index reads. The user ids are kept next to the usernames for the
+# API responses. Each user carries followers_count and following_count, maintained alongside the edges.
+def follow(user, followee):
+    """ Add the edge user -> followee. False if it already existed """
+    try:
+        follows.insert_one({
+            "follower": user["username"],
+            "follower_id": user["_id"],
+            "followee": followee["username"],
+            "followee_id": followee["_id"],
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        return False
+
+    users.bulk_write([
+        UpdateOne({"_id": user["_id"]}, {"$inc": {"following_count": 1}}),
+        UpdateOne({"_id": followee["_id"]}, {"$inc": {"followers_count": 1}})
+    ], ordered=False)
+    return True
+
+
+def unfollow(user, followee):
+    """ Remove the edge user -> followee. False if there was none """
+    result = follows.delete_one({"follower": user["username"], "followee": followee["username"]})
+    if result.deleted_count == 0:
+        return False
+
+    users.bulk_write([
+        UpdateOne({"_id": user["_id"]}, {"$inc": {"following_count": -1}}),
+        UpdateOne({"_id": followee["_id"]}, {"$inc": {"followers_count": -1}})
+    ], ordered=False)
+    return True
+
+
+def remove_followers(user):
+    """ Drop every edge into the user. Returns the usernames that were following them """
+    edges = list(follows.find({"followee": user["username"]}, {"follower": 1, "follower_id": 1}))
+    if edges:
+        follows.delete_many({"followee": user["username"]})
+        users.update_many({"_id": {"$in": [edge["follower_id"] for edge in edges]}}, {"$inc": {"following_count": -1}})
+    users.update_one({"_id": user["_id"]}, {"$set": {"followers_count": 0}})
+    return [edge["follower"] for edge in edges]
+
+
+def remove_following(user):
+    """ Drop every edge out of the user. Returns the usernames they were following """
+    edges = list(follows.find({"follower": user["username"]}, {"followee": 1, "followee_id": 1}))
+    if edges:
+        follows.delete_many({"follower": user["username"]})
+        users.update_many({"_id": {"$in": [edge["followee_id"] for edge in edges]}}, {"$inc": {"followers_count": -1}})
+    users.update_one({"_id": user["_id"]}, {"$set": {"following_count": 0}})
+    return [edge["followee"] for edge in edges]
+
+
+def remove_user(user):
+    """ Drop all of a deleted user's edges and fix the counters of the other side """
+    remove_followers(user)
+    remove_following(user)
+
+
+def rename_user(old_username, new_username):
+    follows.update_many({"follower": old_username}, {"$set": {"follower": new_username}})
+    follows.update_many({"followee": old_username}, {"$set": {"followee": new_username}})
+
+
+def follower_usernames(username):
+    return [edge["follower"] for edge in follows.find({"followee": username}, {"_id": 0, "follower": 1})]
+
+
+def follows_any(username, followees):
+    """ The subset of followees that username follows """
+    if not followees:
+        return []
+    return [
+        edge["followee"]
+        for edge in follows.find({"follower": username, "followee": {"$in": followees}}, {"_id": 0, "followee": 1})
+    ]
+
+
+def follow_count_aggregation(field):
+    """ Edges grouped by follower ("following_count") or by followee ("followers_count") """
+    key = "$follower_id" if field == "following_count" else "$followee_id"
+    return follows.aggregate([{"$group": {"_id": key, "count": {"$sum": 1}}}])
@@ -1,6 +1,73 @@
 from pymongo import MongoClient
+import threading
+import os
 
 secret_key = 'Moyola'
 
-client = MongoClient("mongodb://127.0.0.1:27017")
-db = client.comnibusDB
\ No newline at end of file
+MONGO_URI = "mongodb://127.0.0.1:27017"
+DATABASE_NAME = "comnibusDB"
+
+_clients = {} # pid -> the MongoClient of that process
+_clients_lock = threading.Lock()
+
+# MONGO CLIENT PER PROCESS
+#------------------------------------------------------------------------------------------------------------------
+# A MongoClient is not fork-safe: its connection pool and monitor threads belong to the process that opened them.
+# Under gunicorn the app is imported once in the master and the workers are forked from it, so each process
+# opens its own client on first use (connect=False, nothing is opened at import) and gunicorn.conf.py's post_fork
+# hook opens the worker's one before it takes requests. Modules keep their handles as before, x = globals.db.x:
+# those are proxies that resolve to the current process's collection.
+def get_client():
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                _clients.clear() # A client inherited from the parent is never used in this process
+                client = _clients[pid] = MongoClient(MONGO_URI, connect=False)
+    return client
+
+
+class _Collection:
+    def __init__(self, name):
+        self._name = name
+        self._pid = None
+        self._collection = None
+
+    def _target(self):
+        if self._pid != os.getpid():
+            self._collection = get_client()[DATABASE_NAME][self._name]
+            self._pid = os.getpid()
+        return self._collection
+
+    def __getattr__(self, attribute):
+        return getattr(self._target(), attribute)
+
+    def __repr__(self):
+        return f"<collection {DATABASE_NAME}.{self._name}>"
+
+
+class _Database:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = _Collection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+db = _Database()
+
+
+def __getattr__(name):
+    # globals.client is the current process's client
+    if name == "client":
+        return get_client()
+    raise AttributeError(name)
@@ -0,0 +1,49 @@
+import importlib.util
+import multiprocessing
+import os
+
+# PRODUCTION SERVER
+#------------------------------------------------------------------------------------------------------------------
+# gunicorn -c gunicorn.conf.py wsgi:app
+# The app is imported once in the master (preload, except for gevent) and forked into the workers. Each worker opens its own Mongo
+# client after the fork, see globals.py. Every setting can be overridden from the environment:
+#   WEB_CONCURRENCY    worker processes            (default 2 * cores + 1)
+#   WEB_THREADS        threads per gthread worker  (default 4)
+#   WEB_WORKER_CLASS   gevent or gthread (default gevent when it is installed, gthread otherwise)
+#   WEB_CONNECTIONS    concurrent connections per gevent worker (default 1000)
+#   WEB_KEEPALIVE      seconds an idle keep-alive connection is held (default 5)
+#   BIND               (default 0.0.0.0:5000)
+#   INBOX_STREAMS_PER_WORKER
+#                      open /inbox/stream connections per worker (default WEB_THREADS // 2 for gthread,
+#                      WEB_CONNECTIONS // 2 for gevent)
+# An /inbox/stream connection holds a gthread thread for as long as the token is valid (up to an hour). With the
+# gthread worker at most half of its threads stream, so the rest keep serving ordinary requests; past the limit
+# the stream is refused with a 503 and the client polls /inbox/unread-count. gevent streams on greenlets and can
+# hold far more.
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# /inbox/stream keeps connections open for up to an hour, gevent holds them on greenlets instead of threads
+worker_class = os.environ.get("WEB_WORKER_CLASS") or ("gevent" if importlib.util.find_spec("gevent") else "gthread")
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_connections = int(os.environ.get("WEB_CONNECTIONS", 1000))
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))
+# Read by push.py in the workers, which inherit the master's environment
+os.environ.setdefault("INBOX_STREAMS_PER_WORKER", str(max(1, (worker_connections if worker_class == "gevent" else threads) // 2)))
+
+# gevent patches the standard library when its worker starts, which must happen before the app creates its locks
+preload_app = worker_class != "gevent"
+timeout = 30
+graceful_timeout = 30
+# Recycle workers now and then so a slow leak can't grow forever, staggered so they don't all restart at once
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Open this worker's Mongo client now, rather than on its first request
+    import globals
+    globals.get_client()
+    server.log.info(f"Worker {worker.pid} opened its Mongo client")
@@ -0,0 +1,260 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+import sys
+import globals
+
+db = globals.db
+
+# INDEX DEFINITIONS
+#------------------------------------------------------------------------------------------------------------------
+# Every collection the blueprints query, with the indexes those queries need.
+# Each entry is (keys, options). Array fields (genres, author, replies...) become multikey indexes.
+INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"name": "username_1", "unique": True}),
+        ([("email", ASCENDING)], {"name": "email_1", "unique": True}),
+        ([("skip_fanout", ASCENDING)], {"name": "skip_fanout_1", "partialFilterExpression": {"skip_fanout": True}}),
+    ],
+    "books": [
+        ([("title", ASCENDING)], {"name": "title_1"}),
+        ([("author", ASCENDING)], {"name": "author_1"}),
+        ([("genres", ASCENDING)], {"name": "genres_1"}),
+        ([("characters", ASCENDING)], {"name": "characters_1"}),
+        ([("triggers", ASCENDING)], {"name": "triggers_1"}),
+        ([("search_keys", ASCENDING)], {"name": "search_keys_1"}),
+        ([("user_score", DESCENDING)], {"name": "user_score_-1"}),
+        # "Published in the last N days, newest first" beyond the new releases list, or with filters
+        ([("publishedAt", DESCENDING), ("_id", DESCENDING)], {"name": "publishedAt_-1__id_-1"}),
+    ],
+    "reviews": [
+        # One review per user per book, also serves the reviews-of-a-book lookups
+        ([("book_id", ASCENDING), ("username", ASCENDING)], {"name": "book_id_1_username_1", "unique": True}),
+        ([("book_id", ASCENDING), ("created_at", DESCENDING)], {"name": "book_id_1_created_at_-1"}),
+        ([("username", ASCENDING), ("created_at", DESCENDING)], {"name": "username_1_created_at_-1"}),
+        ([("created_at", DESCENDING)], {"name": "created_at_-1"}),
+    ],
+    "review_replies": [
+        ([("review_id", ASCENDING), ("created_at", ASCENDING)], {"name": "review_id_1_created_at_1"}),
+        ([("book_id", ASCENDING)], {"name": "book_id_1"}),
+        ([("username", ASCENDING), ("created_at", DESCENDING)], {"name": "username_1_created_at_-1"}),
+    ],
+    "activities": [
+        ([("username", ASCENDING), ("timestamp", DESCENDING)], {"name": "username_1_timestamp_-1"}),
+        ([("review_id", ASCENDING)], {"name": "review_id_1", "sparse": True}),
+        ([("reply_id", ASCENDING)], {"name": "reply_id_1", "sparse": True}),
+        ([("thought_id", ASCENDING)], {"name": "thought_id_1", "sparse": True}),
+        ([("book_id", ASCENDING)], {"name": "book_id_1", "sparse": True}),
+    ],
+    "follows": [
+        ([("follower", ASCENDING), ("followee", ASCENDING)], {"name": "follower_1_followee_1", "unique": True}),
+        ([("followee", ASCENDING), ("follower", ASCENDING)], {"name": "followee_1_follower_1"}),
+        ([("followee", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {"name": "followee_1_created_at_-1__id_-1"}),
+        ([("follower", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {"name": "follower_1_created_at_-1__id_-1"}),
+    ],
+    "shelves": [
+        # One entry per (user, shelf, book): add / remove / "is it on my shelf" are single index operations
+        ([("user_id", ASCENDING), ("shelf", ASCENDING), ("book_id", ASCENDING)], {"name": "user_id_1_shelf_1_book_id_1", "unique": True}),
+        ([("user_id", ASCENDING), ("shelf", ASCENDING), ("added_at", DESCENDING), ("_id", DESCENDING)], {"name": "user_id_1_shelf_1_added_at_-1__id_-1"}),
+        # Readers of a book (co-reads) and removing a deleted book from every shelf
+        ([("book_id", ASCENDING), ("shelf", ASCENDING), ("stars", ASCENDING)], {"name": "book_id_1_shelf_1_stars_1"}),
+    ],
+    "stream_tickets": [
+        # Tickets are redeemed by _id, this only expires the unused ones
+        ([("expires_at", ASCENDING)], {"name": "expires_at_1", "expireAfterSeconds": 0}),
+    ],
+    "review_quotas": [
+        # Weekly ledger entries are looked up by _id, this only expires them
+        ([("expires_at", ASCENDING)], {"name": "expires_at_1", "expireAfterSeconds": 0}),
+    ],
+    "leaderboard": [
+        # A page of a board is one range read on this index
+        ([("board", ASCENDING), ("score", DESCENDING), ("_id", DESCENDING)], {"name": "board_1_score_-1__id_-1"}),
+        ([("book_id", ASCENDING), ("board", ASCENDING)], {"name": "book_id_1_board_1", "unique": True}),
+    ],
+    "new_releases": [
+        ([("publishedAt", DESCENDING), ("_id", DESCENDING)], {"name": "publishedAt_-1__id_-1"}),
+    ],
+    "trending": [
+        # The trending list of a window is the top of its index
+        ([("scores.24h", DESCENDING)], {"name": "scores.24h_-1"}),
+        ([("scores.7d", DESCENDING)], {"name": "scores.7d_-1"}),
+        ([("scores.30d", DESCENDING)], {"name": "scores.30d_-1"}),
+    ],
+    "timelines": [
+        ([("owner", ASCENDING), ("timestamp", DESCENDING), ("activity_id", DESCENDING)], {"name": "owner_1_timestamp_-1_activity_id_-1"}),
+        ([("owner", ASCENDING), ("actor", ASCENDING)], {"name": "owner_1_actor_1"}),
+        ([("activity_id", ASCENDING)], {"name": "activity_id_1"}),
+        ([("timestamp", ASCENDING)], {"name": "timestamp_1"}),
+    ],
+    "messages": [
+        ([("recipient_name", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {"name": "recipient_name_1_timestamp_-1__id_-1"}),
+        ([("recipient_name", ASCENDING), ("is_read", ASCENDING)], {"name": "recipient_name_1_is_read_1"}),
+        ([("is_read", ASCENDING), ("timestamp", ASCENDING)], {"name": "is_read_1_timestamp_1"}),
+    ],
+    "facet_counts": [
+        ([("facet", ASCENDING), ("value", ASCENDING)], {"name": "facet_1_value_1", "unique": True}),
+    ],
+    "recommendations": [
+        ([("user_id", ASCENDING), ("score", DESCENDING), ("_id", DESCENDING)], {"name": "user_id_1_score_-1__id_-1"}),
+    ],
+    "blacklist": [
+        # Old raw-token entries all collide on a null token_hash, run compact_blacklist.py before deploying
+        ([("token_hash", ASCENDING)], {"name": "token_hash_1", "unique": True}),
+        # Entries are removed as soon as the blacklisted token has expired
+        ([("expires_at", ASCENDING)], {"name": "expires_at_1", "expireAfterSeconds": 0}),
+    ],
+    "thoughts": [
+        ([("username", ASCENDING), ("created_at", DESCENDING)], {"name": "username_1_created_at_-1"}),
+        ([("replies.username", ASCENDING)], {"name": "replies.username_1"}),
+        ([("replies._id", ASCENDING)], {"name": "replies._id_1"}),
+    ],
+    "banned_emails": [
+        ([("emails", ASCENDING)], {"name": "emails_1"}),
+    ],
+    "requests": [
+        ([("username", ASCENDING)], {"name": "username_1"}),
+    ],
+    "reports": [
+        ([("reported_at", DESCENDING)], {"name": "reported_at_-1"}),
+        ([("status", ASCENDING), ("_id", ASCENDING)], {"name": "status_1__id_1"}),
+        ([("status", ASCENDING), ("resolved_at", ASCENDING)], {"name": "status_1_resolved_at_1"}),
+    ],
+    "deleted_accounts": [
+        ([("timestamp", DESCENDING)], {"name": "timestamp_-1"}),
+    ],
+}
+
+# Indexes earlier versions created that no query uses any more. ensure_indexes drops them.
+OBSOLETE_INDEXES = {
+    "blacklist": ["token_1"], # Raw-token entries, replaced by token_hash
+    "books": ["user_reviews.username_1", "user_reviews._id_1", "user_reviews.replies._id_1", "publishDate_1", "firstPublishDate_1"],
+    "users": ["have_read._id_1"],
+    "timelines": ["owner_1_timestamp_-1"],
+    "messages": ["recipient_name_1_timestamp_-1"],
+}
+
+# Representative shapes of the hot queries in the codebase, used to check that each one is index-backed.
+# (where it is used, collection, filter, sort)
+QUERIES = [
+    ("auth.login / every @jwt_required handler", "users", {"username": ""}, None),
+    ("auth.signup", "users", {"email": ""}, None),
+    ("auth.signup", "banned_emails", {"emails": ""}, None),
+    ("decorators.jwt_required", "blacklist", {"token_hash": ""}, None),
+    ("auth.show_one_user / auth.user_feed", "reviews", {"username": ""}, [("created_at", DESCENDING)]),
+    ("reviews.show_all_reviews / books.show_one_book", "reviews", {"book_id": None}, [("created_at", DESCENDING)]),
+    ("reviews.attach_replies / reviews.show_all_replies", "review_replies", {"review_id": None}, [("created_at", ASCENDING)]),
+    ("activity.read_feed", "timelines", {"owner": ""}, [("timestamp", DESCENDING), ("activity_id", DESCENDING)]),
+    ("activity.read_feed / activity.follow_timeline", "activities", {"username": ""}, [("timestamp", DESCENDING)]),
+    ("activity.remove_activities", "activities", {"review_id": ""}, None),
+    ("books.delete_books", "activities", {"book_id": ""}, None),
+    ("activity.remove_activities", "timelines", {"activity_id": None}, None),
+    ("books.show_one_book / auth.show_one_user", "books", {"author": {"$in": [""]}}, None),
+    ("search.search_books / search.apply_filters", "books", {"search_keys": {"$regex": "^title:a"}}, None),
+    ("search.backfill_search_keys", "books", {"search_keys": None}, None),
+    ("books.show_high_rated_books", "leaderboard", {"board": ""}, [("score", DESCENDING), ("_id", DESCENDING)]),
+    ("trending.trending_books", "trending", {"scores.24h": {"$gt": 0}}, [("scores.24h", DESCENDING)]),
+    ("leaderboard.update_leaderboard", "leaderboard", {"book_id": None, "board": {"$nin": [""]}}, None),
+    ("releases.recent_releases", "new_releases", {"publishedAt": {"$gte": None, "$lte": None}}, [("publishedAt", DESCENDING), ("_id", DESCENDING)]),
+    ("releases.recent_releases", "books", {"publishedAt": {"$gte": None, "$lte": None}}, [("publishedAt", DESCENDING), ("_id", DESCENDING)]),
+    ("books.get_recommendations", "recommendations", {"user_id": None}, [("score", DESCENDING), ("_id", DESCENDING)]),
+    ("recommendations.score_candidates", "books", {"genres": {"$in": [""]}}, None),
+    ("recommendations._co_reads", "shelves", {"book_id": {"$in": [None]}, "shelf": "have_read", "stars": {"$gt": 3.5}}, None),
+    ("shelves.add_to_shelf / shelves.remove_from_shelf / shelves.shelf_entry", "shelves", {"user_id": None, "shelf": "", "book_id": None}, None),
+    ("shelves.shelf_page", "shelves", {"user_id": None, "shelf": ""}, [("added_at", DESCENDING), ("_id", DESCENDING)]),
+    ("shelves.remove_book_from_shelves", "shelves", {"book_id": None}, None),
+    ("follows.follower_usernames / activity.record_activity", "follows", {"followee": ""}, None),
+    ("follows.follows_any / activity.read_feed", "follows", {"follower": "", "followee": {"$in": [""]}}, None),
+    ("auth.show_followers", "follows", {"followee": ""}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("activity.read_feed", "users", {"skip_fanout": True}, None),
+    ("messages.get_messages", "messages", {"recipient_name": ""}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("reports.get_all_reports", "reports", {"status": {"$in": ["pending", None]}}, [("_id", ASCENDING)]),
+    ("retention.enforce_retention", "timelines", {"timestamp": {"$lt": None}}, None),
+    ("retention.enforce_retention", "messages", {"is_read": True, "timestamp": {"$lt": None}}, None),
+    ("messages.mark_all_as_read", "messages", {"recipient_name": "", "is_read": False}, None),
+    ("thoughts.get_one_reply / thoughts.like_reply", "thoughts", {"replies._id": None}, None),
+]
+
+
+# INDEX BOOTSTRAP
+#------------------------------------------------------------------------------------------------------------------
+def ensure_indexes():
+    """ Create every declared index and drop the obsolete ones. Safe to run on every startup, existing indexes are
+        left alone. Raises if a unique index can't be built, the code relies on those to reject duplicates """
+    created = []
+    failed_unique = []
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        for keys, options in indexes:
+            try:
+                created.append(collection.create_index(keys, background=True, **options))
+            except OperationFailure as e:
+                # e.g. a unique index over data that still has duplicates
+                print(f"Could not create index {options['name']} on {collection_name}: {e}")
+                if options.get("unique"):
+                    failed_unique.append(f"{collection_name}.{options['name']}")
+
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        existing = db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                db[collection_name].drop_index(name)
+                print(f"Dropped obsolete index {name} on {collection_name}")
+
+    if failed_unique:
+        raise RuntimeError(f"Unique indexes could not be built: {', '.join(failed_unique)}")
+    missing = missing_unique_indexes()
+    if missing:
+        raise RuntimeError(f"Unique indexes are missing or not unique: {', '.join(missing)}")
+    return created
+
+
+def missing_unique_indexes():
+    """ The declared unique indexes that are not in place as unique indexes, e.g. when an older non-unique index
+        holds the name. Duplicate reviews, follows and shelf entries are only rejected through these """
+    missing = []
+    for collection_name, indexes in INDEXES.items():
+        existing = db[collection_name].index_information()
+        for _, options in indexes:
+            if options.get("unique") and not existing.get(options["name"], {}).get("unique"):
+                missing.append(f"{collection_name}.{options['name']}")
+    return missing
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages.extend(_plan_stages(plan["inputStage"]))
+    for input_stage in plan.get("inputStages", []):
+        stages.extend(_plan_stages(input_stage))
+    return stages
+
+
+def find_collection_scans():
+    """ Explain each query in QUERIES and return the ones whose winning plan is still a COLLSCAN """
+    collection_scans = []
+    for used_in, collection_name, query, sort in QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(plan):
+            collection_scans.append((used_in, collection_name, query))
+    return collection_scans
+
+
+def report_collection_scans():
+    collection_scans = find_collection_scans()
+    for used_in, collection_name, query in collection_scans:
+        print(f"COLLSCAN: {collection_name}.find({query}) used in {used_in}")
+    if not collection_scans:
+        print("All known queries are index-backed")
+    return collection_scans
+
+
+if __name__ == "__main__":
+    # python indexes.py               -> create the indexes and report any collection scans
+    # python indexes.py --report-only -> only report
+    if "--report-only" not in sys.argv:
+        for name in ensure_indexes():
+            print(f"Index ready: {name}")
+    sys.exit(1 if report_collection_scans() else 0)
@@ -0,0 +1,84 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pagination import paginate
+import math
+import globals
+
+books = globals.db.books
+leaderboard = globals.db.leaderboard
+
+OVERALL = "overall"
+CONFIDENCE_Z = 1.96 # 95% confidence
+CARD_FIELDS = ["title", "author", "coverImg", "user_score", "total_reviews", "genres"]
+
+# TOP BOOKS LEADERBOARD
+#------------------------------------------------------------------------------------------------------------------
+# Books are ranked by the lower bound of the Wilson score interval of their share of positive reviews, so a book
+# with 2 glowing reviews no longer outranks one with 200 mostly positive ones. Each ranked book has one entry on
+# the overall board and one per genre, carrying its card, so a page of any board is one indexed range read:
+#   {board: "overall" | "genre:<genre>", book_id, score, card: {...}, updated_at}
+# update_leaderboard(book_id) re-ranks one book and is called wherever its review counters or card change.
+# python leaderboard.py rebuilds every board.
+def wilson_lower_bound(positive, total, z=CONFIDENCE_Z):
+    if not total:
+        return 0.0
+    share = positive / total
+    spread = z * math.sqrt(share * (1 - share) / total + z * z / (4 * total * total))
+    return (share + z * z / (2 * total) - spread) / (1 + z * z / total)
+
+
+def genre_board(genre):
+    return f"genre:{genre}"
+
+
+def _entries(book, updated_at):
+    score = round(wilson_lower_bound(book.get("positive_reviews") or 0, book.get("total_reviews") or 0), 6)
+    if score <= 0:
+        return []
+    card = {field: book.get(field) for field in CARD_FIELDS}
+    boards = [OVERALL] + [genre_board(genre) for genre in set(book.get("genres") or [])]
+    return [
+        {"board": board, "book_id": book["_id"], "score": score, "card": card, "updated_at": updated_at}
+        for board in boards
+    ]
+
+
+def update_leaderboard(book_id):
+    """ Re-rank one book on every board it belongs to, and take it off the ones it left """
+    book_id = ObjectId(book_id)
+    book = books.find_one({"_id": book_id}, CARD_FIELDS + ["positive_reviews"])
+    entries = _entries(book, datetime.utcnow()) if book else []
+
+    if entries:
+        leaderboard.bulk_write([
+            ReplaceOne({"board": entry["board"], "book_id": book_id}, entry, upsert=True) for entry in entries
+        ], ordered=False)
+    leaderboard.delete_many({"book_id": book_id, "board": {"$nin": [entry["board"] for entry in entries]}})
+
+
+def top_books(board=OVERALL):
+    """ (entries, next_cursor) for the page of a board the current request asks for, best first """
+    return paginate(leaderboard, {"board": board}, sort=[("score", -1)], projection={"book_id": 1, "score": 1, "card": 1})
+
+
+def rebuild_leaderboard():
+    updated_at = datetime.utcnow()
+    operations = []
+    for book in books.find({"total_reviews": {"$gt": 0}}, CARD_FIELDS + ["positive_reviews"]):
+        operations.extend(
+            ReplaceOne({"board": entry["board"], "book_id": book["_id"]}, entry, upsert=True)
+            for entry in _entries(book, updated_at)
+        )
+        if len(operations) >= 1000:
+            leaderboard.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        leaderboard.bulk_write(operations, ordered=False)
+    # Entries of books that dropped off every board (or were deleted) since the last run
+    leaderboard.delete_many({"updated_at": {"$lt": updated_at}})
+    print(f"Leaderboard: {leaderboard.count_documents({'board': OVERALL})} ranked books")
+
+
+if __name__ == "__main__":
+    rebuild_leaderboard()
@@ -0,0 +1,44 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from reconcile import reconcile_follow_counters
+import globals
+
+users = globals.db.users
+follows = globals.db.follows
+
+# ONE-OFF FOLLOW MIGRATION
+#------------------------------------------------------------------------------------------------------------------
+# Turns the embedded followers/following arrays into follows edges, recounts followers_count/following_count and
+# removes the arrays. Edges are upserted on (follower, followee), so the migration can be re-run safely. An edge is
+# created if either side recorded it, since unfollow used to pull the two arrays with different shapes.
+def migrate_follows():
+    ids = {user["username"]: user["_id"] for user in users.find({}, {"username": 1})}
+
+    edges = set()
+    for user in users.find({}, {"username": 1, "followers": 1, "following": 1}):
+        for followed in user.get("following", []):
+            if isinstance(followed, dict) and followed.get("username") in ids:
+                edges.add((user["username"], followed["username"]))
+        for follower in user.get("followers", []):
+            if isinstance(follower, dict) and follower.get("username") in ids:
+                edges.add((follower["username"], user["username"]))
+
+    migrated_at = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"follower": follower, "followee": followee},
+            {"$setOnInsert": {"follower_id": ids[follower], "followee_id": ids[followee], "created_at": migrated_at}},
+            upsert=True
+        )
+        for follower, followee in edges if follower != followee
+    ]
+    if operations:
+        follows.bulk_write(operations, ordered=False)
+    print(f"Migrated {len(operations)} follow edges")
+
+    reconcile_follow_counters()
+    users.update_many({}, {"$unset": {"followers": "", "following": ""}})
+
+
+if __name__ == "__main__":
+    migrate_follows()
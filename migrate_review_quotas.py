@@ -0,0 +1,36 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from quotas import week_key, week_start, quota_expiry, QUOTA_KEPT_DAYS
+import globals
+
+reviews = globals.db.reviews
+review_quotas = globals.db.review_quotas
+
+# ONE-OFF REVIEW QUOTA MIGRATION
+#------------------------------------------------------------------------------------------------------------------
+# Counts the reviews already written in the weeks the ledger still keeps into review_quotas, so a user can't post
+# a second full quota in the week the ledger is deployed. Counts are raised with $max, never lowered, so the
+# migration can be re-run safely after the new code is live.
+def migrate_review_quotas(now=None):
+    now = now or datetime.utcnow()
+    since = week_start(now - timedelta(days=QUOTA_KEPT_DAYS))
+
+    counts = Counter()
+    expiries = {}
+    for review in reviews.find({"created_at": {"$gte": since}}, {"username": 1, "created_at": 1}):
+        key = week_key(review["username"], review["created_at"])
+        counts[key] += 1
+        expiries[key] = quota_expiry(review["created_at"])
+
+    operations = [
+        UpdateOne({"_id": key}, {"$max": {"count": count}, "$setOnInsert": {"expires_at": expiries[key]}}, upsert=True)
+        for key, count in counts.items() if expiries[key] > now
+    ]
+    if operations:
+        review_quotas.bulk_write(operations, ordered=False)
+    print(f"Seeded {len(operations)} weekly review quota entries")
+
+
+if __name__ == "__main__":
+    migrate_review_quotas()
@@ -0,0 +1,45 @@
+from pymongo import ReplaceOne
+import globals
+
+books = globals.db.books
+reviews = globals.db.reviews
+review_replies = globals.db.review_replies
+
+# ONE-OFF REVIEW MIGRATION
+#------------------------------------------------------------------------------------------------------------------
+# Moves the embedded book.user_reviews arrays (and the replies nested in each review) into the reviews and
+# review_replies collections. The original _ids are kept so links, reports and likes still resolve. Documents are
+# upserted by _id, so the migration can be re-run safely if it is interrupted.
+def migrate_reviews():
+    migrated_reviews = 0
+    migrated_replies = 0
+
+    for book in books.find({"user_reviews": {"$exists": True}}, {"user_reviews": 1}):
+        review_operations = []
+        reply_operations = []
+
+        for review in book.get("user_reviews", []):
+            replies = review.pop("replies", [])
+            review["book_id"] = book["_id"]
+            review_operations.append(ReplaceOne({"_id": review["_id"]}, review, upsert=True))
+
+            for reply in replies:
+                reply["review_id"] = review["_id"]
+                reply["book_id"] = book["_id"]
+                reply_operations.append(ReplaceOne({"_id": reply["_id"]}, reply, upsert=True))
+
+        if review_operations:
+            reviews.bulk_write(review_operations, ordered=False)
+        if reply_operations:
+            review_replies.bulk_write(reply_operations, ordered=False)
+
+        books.update_one({"_id": book["_id"]}, {"$unset": {"user_reviews": ""}})
+
+        migrated_reviews += len(review_operations)
+        migrated_replies += len(reply_operations)
+
+    print(f"Migrated {migrated_reviews} reviews and {migrated_replies} replies")
+
+
+if __name__ == "__main__":
+    migrate_reviews()
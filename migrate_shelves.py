@@ -0,0 +1,51 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from shelves import SHELVES
+from reconcile import reconcile_have_read_counters
+import globals
+
+users = globals.db.users
+shelves = globals.db.shelves
+
+# Fields of the old array entries that belong to the shelf entry, the rest is joined from books when read
+ENTRY_FIELDS = {
+    "have_read": ("stars", "date_read"),
+    "currently_reading": ("reading_time", "total_pages", "current_page", "progress"),
+    "want_to_read": (),
+    "favourite_books": (),
+}
+
+# ONE-OFF SHELF MIGRATION
+#------------------------------------------------------------------------------------------------------------------
+# Turns the embedded have_read / want_to_read / currently_reading / favourite_books arrays into shelves entries,
+# recounts have_read_count and removes the arrays. Entries are upserted on (user_id, shelf, book_id), so the
+# migration can be re-run safely. Array entries whose _id is not a valid book id are dropped.
+# Run python indexes.py first, the upserts rely on the unique (user_id, shelf, book_id) index.
+def migrate_shelves():
+    migrated_at = datetime.utcnow()
+    migrated = 0
+    for user in users.find({}, {shelf: 1 for shelf in SHELVES}):
+        operations = []
+        for shelf in SHELVES:
+            for book in user.get(shelf, []):
+                if not isinstance(book, dict) or not ObjectId.is_valid(book.get("_id")):
+                    continue
+                added_at = book.get("reading_time") if isinstance(book.get("reading_time"), datetime) else migrated_at
+                fields = {field: book[field] for field in ENTRY_FIELDS[shelf] if field in book}
+                operations.append(UpdateOne(
+                    {"user_id": user["_id"], "shelf": shelf, "book_id": ObjectId(book["_id"])},
+                    {"$setOnInsert": {"added_at": added_at, **fields}},
+                    upsert=True
+                ))
+        if operations:
+            shelves.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+    print(f"Migrated {migrated} shelf entries")
+
+    reconcile_have_read_counters()
+    users.update_many({}, {"$unset": {shelf: "" for shelf in SHELVES}})
+
+
+if __name__ == "__main__":
+    migrate_shelves()
@@ -0,0 +1,13 @@
+from reconcile import reconcile_unread_counters
+
+# ONE-OFF UNREAD COUNTER MIGRATION
+#------------------------------------------------------------------------------------------------------------------
+# Seeds users.unread_messages from the messages collection. The inbox reads the counter instead of counting the
+# messages, so users who had unread messages before the counter existed would show none. Run it before deploying
+# and once more right after, to pick up what arrived in between; it $sets the recount, so it can be re-run safely.
+def migrate_unread_counts():
+    reconcile_unread_counters()
+
+
+if __name__ == "__main__":
+    migrate_unread_counts()
@@ -0,0 +1,186 @@
+from collections import OrderedDict, Counter
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import datetime
+import atexit
+import queue
+import threading
+import time
+import os
+import push
+import globals
+
+messages = globals.db.messages
+users = globals.db.users
+
+NOTIFICATION_WORKERS = 2
+BATCH_SIZE = 500 # Most messages written by one insert_many
+BATCH_WINDOW = 0.25 # Seconds a worker keeps collecting after the first event of a batch, so repeats can coalesce
+WRITE_ATTEMPTS = 5 # Tries at writing a batch before it is dropped
+RETRY_DELAY = 0.5 # Seconds before the first retry, doubled after each failed attempt
+
+_queue = None
+_started_pid = None
+_start_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_metrics = {"enqueued": 0, "written": 0, "coalesced": 0, "failed": 0, "retries": 0, "batches": 0, "last_lag": 0.0, "max_lag": 0.0}
+
+# NOTIFICATION DISPATCHER
+#------------------------------------------------------------------------------------------------------------------
+# send_message() only puts an event on an in-process queue. A small pool of worker threads takes events off in
+# batches and writes each batch with one insert_many, so a request that notifies many users (e.g. an author with
+# thousands of followers publishing a book) no longer waits on one insert per recipient.
+# Events that share a coalesce_key and recipient within a batch become a single message using their summary,
+# e.g. five likes on the same review -> "5 people liked your review!".
+# Recipients' unread_messages counters are raised with one bulk write per batch.
+# A batch that fails to write (e.g. a primary election) is retried with backoff, up to WRITE_ATTEMPTS times, and
+# only then dropped and counted as failed. Messages carry their _id from the start, so a retry after a partly
+# applied insert_many skips the ones already written instead of duplicating them.
+# The workers are started lazily in each process (and again after a fork), pending events are flushed at exit.
+def _ensure_started():
+    global _queue, _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _queue = queue.Queue()
+        for i in range(NOTIFICATION_WORKERS):
+            threading.Thread(target=_worker, name=f"notifications-{i}", daemon=True).start()
+        _started_pid = os.getpid()
+
+
+def enqueue(recipient_name, content, coalesce_key=None, summary=None):
+    """ Queue a message. Events with the same coalesce_key for the same recipient may be merged into `summary`,
+        which is formatted with {count} """
+    _ensure_started()
+    _queue.put((time.time(), {
+        "recipient_name": recipient_name,
+        "content": content,
+        "coalesce_key": coalesce_key,
+        "summary": summary
+    }))
+    with _metrics_lock:
+        _metrics["enqueued"] += 1
+
+
+def _take_batch(events_queue):
+    batch = [events_queue.get()]
+    deadline = time.time() + BATCH_WINDOW
+    while len(batch) < BATCH_SIZE:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(events_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _coalesce(batch):
+    """ Message documents for a batch of (enqueued_at, event), merging events that share a coalesce key """
+    now = datetime.datetime.now(datetime.UTC)
+    groups = OrderedDict()
+    for _, event in batch:
+        key = (event["recipient_name"], event["coalesce_key"]) if event["coalesce_key"] else id(event)
+        groups.setdefault(key, []).append(event)
+
+    documents = []
+    for events in groups.values():
+        content = events[0]["content"]
+        if len(events) > 1 and events[0]["summary"]:
+            content = events[0]["summary"].format(count=len(events))
+        documents.append({
+            "_id": ObjectId(),
+            "recipient_name": events[0]["recipient_name"],
+            "content": content,
+            "timestamp": now,
+            "is_read": False
+        })
+    return documents
+
+
+def _insert(documents):
+    try:
+        messages.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate _ids were written by an earlier attempt, anything else is a real failure
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+            raise
+
+
+def _write(batch):
+    documents = _coalesce(batch)
+    inserted = counted = False
+    for attempt in range(1, WRITE_ATTEMPTS + 1):
+        try:
+            if not inserted:
+                _insert(documents)
+                inserted = True
+            if not counted:
+                # Each recipient's unread counter goes up by what they were sent in this batch
+                unread = Counter(document["recipient_name"] for document in documents)
+                users.bulk_write([
+                    UpdateOne({"username": recipient}, {"$inc": {"unread_messages": count}})
+                    for recipient, count in unread.items()
+                ], ordered=False)
+                counted = True
+            break
+        except Exception as e:
+            print(f"Notification batch of {len(documents)}, attempt {attempt}/{WRITE_ATTEMPTS} failed: {e}")
+            if attempt < WRITE_ATTEMPTS:
+                with _metrics_lock:
+                    _metrics["retries"] += 1
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+    # Messages written without their counter update are picked up by reconcile.reconcile_unread_counters
+    failed = 0 if inserted else len(documents)
+    if inserted:
+        push.publish_local(documents)
+
+    lag = time.time() - batch[0][0]
+    with _metrics_lock:
+        _metrics["batches"] += 1
+        _metrics["written"] += len(documents) - failed
+        _metrics["failed"] += failed
+        _metrics["coalesced"] += len(batch) - len(documents)
+        _metrics["last_lag"] = lag
+        _metrics["max_lag"] = max(_metrics["max_lag"], lag)
+
+
+def _worker():
+    events_queue = _queue
+    while True:
+        batch = _take_batch(events_queue)
+        try:
+            _write(batch)
+        finally:
+            for _ in batch:
+                events_queue.task_done()
+
+
+def flush():
+    """ Block until every queued event has been written """
+    if _started_pid == os.getpid():
+        _queue.join()
+
+
+def metrics():
+    """ Queue depth, age of the oldest queued event and dispatcher counters for this process """
+    depth = _queue.qsize() if _started_pid == os.getpid() else 0
+    try:
+        oldest = _queue.queue[0][0] if depth else None
+    except IndexError:
+        oldest = None
+    with _metrics_lock:
+        return {
+            **_metrics,
+            "pid": os.getpid(),
+            "queue_depth": depth,
+            "oldest_event_age": round(time.time() - oldest, 3) if oldest else 0.0
+        }
+
+
+atexit.register(flush)
@@ -0,0 +1,124 @@
+from flask import request, jsonify, make_response, abort
+from bson import json_util, ObjectId
+from bson.errors import BSONError
+from datetime import datetime
+import binascii
+import base64
+
+MAX_PAGE_SIZE = 100
+# Sort key values a cursor may hold. Anything else (a dict or list) would reach the query as an operator
+CURSOR_VALUE_TYPES = (str, int, float, datetime, ObjectId, type(None))
+
+# CURSOR PAGINATION
+#------------------------------------------------------------------------------------------------------------------
+# List endpoints page with an opaque cursor instead of skip(). The cursor holds the sort key values of the last
+# document on the page (always ending with _id as a tiebreak), and the next page starts strictly after it, so
+# deep pages cost the same as the first one and rows are not skipped or repeated while data changes.
+#
+#   GET /api/v1.0/books?limit=20                -> {"items": [...], "next_cursor": "eyJ..."}
+#   GET /api/v1.0/books?limit=20&cursor=eyJ...  -> the next page, next_cursor is null on the last page
+#
+# The old ?pn=&ps= form still works as a compatibility path and still returns a bare list. Every response also
+# carries the next cursor in the X-Next-Cursor header. Endpoints that used to return everything
+# (default_page_size=None) still do when the request has no paging arguments at all.
+# A malformed limit, page number or cursor is a 400.
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    return json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+
+def _field_value(document, field):
+    for part in field.split('.'):
+        document = document.get(part) if isinstance(document, dict) else None
+    return document
+
+
+def with_tiebreak(sort, tiebreak="_id"):
+    if any(field == tiebreak for field, _ in sort):
+        return list(sort)
+    return list(sort) + [(tiebreak, sort[-1][1] if sort else 1)]
+
+
+def keyset_filter(sort, values):
+    """ Filter matching the documents that come strictly after `values` in `sort` order """
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        branch = {sort[j][0]: values[j] for j in range(i)}
+        branch[field] = {"$gt" if direction > 0 else "$lt": values[i]}
+        branches.append(branch)
+    return {"$or": branches}
+
+
+def cursor_for(document, sort):
+    return encode_cursor([_field_value(document, field) for field, _ in sort])
+
+
+def bad_page_request(message):
+    abort(make_response(jsonify({"error": message}), 400))
+
+
+def page_args(default_page_size=10, keys=None):
+    """ (cursor values or None, page size, legacy page number or None) for the current request. The page size is
+        None when default_page_size is None and no paging was asked for. keys is how many sort values a cursor holds """
+    paging = [name for name in ('limit', 'ps', 'cursor', 'pn') if request.args.get(name)]
+    if default_page_size is None and paging:
+        default_page_size = MAX_PAGE_SIZE
+
+    page_size = request.args.get('limit') or request.args.get('ps') or default_page_size
+    page_num = request.args.get('pn')
+    try:
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE)) if page_size is not None else None
+        page_num = max(1, int(page_num)) if page_num else None
+    except ValueError:
+        bad_page_request("limit, ps and pn must be whole numbers")
+
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except (ValueError, TypeError, BSONError, binascii.Error):
+            bad_page_request("Invalid cursor")
+        if not isinstance(after, list) or (keys is not None and len(after) != keys):
+            bad_page_request("Invalid cursor")
+        if not all(isinstance(value, CURSOR_VALUE_TYPES) for value in after):
+            bad_page_request("Invalid cursor")
+    return after, page_size, page_num
+
+
+def paginate(collection, query, sort=(("_id", 1),), projection=None, default_page_size=10):
+    """ Return (documents, next_cursor) for the page the current request asks for """
+    sort = with_tiebreak(sort)
+    after, page_size, page_num = page_args(default_page_size, keys=len(sort))
+
+    # The next cursor is read from the last document, so an inclusion projection must carry the sort keys
+    if projection and any(projection.values()):
+        projection = {**projection, **{field: 1 for field, _ in sort if field not in projection}}
+
+    if after is not None:
+        query = {"$and": [query, keyset_filter(sort, after)]} if query else keyset_filter(sort, after)
+
+    cursor = collection.find(query, projection).sort(sort)
+    if page_size is None:
+        return list(cursor), None
+    if page_num is not None and after is None:
+        cursor = cursor.skip(page_size * (page_num - 1))
+
+    # One extra document tells us whether there is a next page
+    documents = list(cursor.limit(page_size + 1))
+    next_cursor = cursor_for(documents[page_size - 1], sort) if len(documents) > page_size else None
+    return documents[:page_size], next_cursor
+
+
+def page_response(items, next_cursor):
+    """ Cursor requests get {"items", "next_cursor"}, legacy pn/ps (or bare) requests keep getting a list """
+    if 'cursor' in request.args or 'limit' in request.args:
+        response = make_response(jsonify({"items": items, "next_cursor": next_cursor}), 200)
+    else:
+        response = make_response(jsonify(items), 200)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
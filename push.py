@@ -0,0 +1,102 @@
+from pymongo.errors import OperationFailure, PyMongoError
+import queue
+import threading
+import time
+import os
+import globals
+
+messages = globals.db.messages
+
+SUBSCRIBER_QUEUE_SIZE = 100 # Events buffered per open stream before new ones are dropped for it
+WATCH_RETRY_DELAY = 5 # Seconds before re-opening a change stream that failed
+# Open streams this process holds at once, 0 for no limit. gunicorn.conf.py sets it from the worker class
+MAX_STREAMS = int(os.environ.get("INBOX_STREAMS_PER_WORKER", 0))
+
+_subscribers = {} # username -> set of queues, one per open stream
+_subscribers_lock = threading.Lock()
+_open_streams = 0
+_watcher_pid = None
+_change_stream_active = False
+_start_lock = threading.Lock()
+
+# PUSH NOTIFICATIONS
+#------------------------------------------------------------------------------------------------------------------
+# Each open /inbox/stream connection subscribes a queue for its user. New messages reach the queues from a Mongo
+# change stream on `messages`, watched by one thread per process, so a message written by any worker is pushed to
+# streams held by every worker. Without a replica set there are no change streams: the watcher stops and the
+# notification workers publish what they write straight to this process's subscribers instead.
+# A stream holds its worker thread (or greenlet) for as long as it is open, so at most MAX_STREAMS are open per
+# process. Past that subscribe returns None and the client polls /inbox/unread-count instead.
+def subscribe(username):
+    global _open_streams
+    _ensure_watching()
+    subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with _subscribers_lock:
+        if MAX_STREAMS and _open_streams >= MAX_STREAMS:
+            return None
+        _open_streams += 1
+        _subscribers.setdefault(username, set()).add(subscriber)
+    return subscriber
+
+
+def unsubscribe(username, subscriber):
+    global _open_streams
+    with _subscribers_lock:
+        subscribers = _subscribers.get(username, set())
+        if subscriber in subscribers:
+            _open_streams -= 1
+        subscribers.discard(subscriber)
+        if not subscribers:
+            _subscribers.pop(username, None)
+
+
+def publish(message):
+    """ Hand a new message document to its recipient's open streams in this process """
+    with _subscribers_lock:
+        subscribers = list(_subscribers.get(message["recipient_name"], ()))
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            pass # A stalled client, it can catch up from the inbox endpoint
+
+
+def publish_local(documents):
+    """ Called by the notification writer. Only needed when the change stream is not delivering """
+    if not _change_stream_active:
+        for document in documents:
+            publish(document)
+
+
+def _watch():
+    global _change_stream_active
+    resume_after = None
+    while True:
+        try:
+            with messages.watch([{"$match": {"operationType": "insert"}}], resume_after=resume_after) as stream:
+                _change_stream_active = True
+                for change in stream:
+                    resume_after = stream.resume_token
+                    publish(change["fullDocument"])
+        except OperationFailure as e:
+            _change_stream_active = False
+            if e.code in (40573, 40324, 20): # Not a replica set / change streams unsupported
+                print(f"Change streams unavailable, pushing messages from this process only: {e}")
+                return
+            print(f"Change stream failed, retrying: {e}")
+        except PyMongoError as e:
+            _change_stream_active = False
+            print(f"Change stream failed, retrying: {e}")
+        time.sleep(WATCH_RETRY_DELAY)
+
+
+def _ensure_watching():
+    global _watcher_pid, _change_stream_active
+    if _watcher_pid == os.getpid():
+        return
+    with _start_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _change_stream_active = False # A forked worker has no watcher of its own yet
+        threading.Thread(target=_watch, name="push-watcher", daemon=True).start()
+        _watcher_pid = os.getpid()
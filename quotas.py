@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+import globals
+
+review_quotas = globals.db.review_quotas
+
+QUOTA_KEPT_DAYS = 14 # Ledger entries expire (TTL index on expires_at) this long after their week started
+
+# WEEKLY REVIEW QUOTA
+#------------------------------------------------------------------------------------------------------------------
+# One ledger document per user per ISO week, {_id: "<username>:<YYYY-Www>", count, expires_at}, so the quota check
+# is a single atomic increment-and-check on _id however many reviews the user has written:
+#   - the filter only matches while count is under the limit, and the upsert creates the week's entry
+#   - once the limit is reached the filter misses, the upsert collides with the existing _id and raises
+#     DuplicateKeyError, which means the user is over quota
+# That relies only on the unique _id index MongoDB keeps on every collection. The reviews written before the ledger
+# existed are counted into it by migrate_review_quotas.py.
+def week_key(username, moment):
+    return f"{username}:{moment:%G-W%V}"
+
+
+def week_start(moment):
+    return (moment - timedelta(days=moment.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def quota_expiry(moment):
+    """ When the ledger entry of moment's week expires """
+    return week_start(moment) + timedelta(days=QUOTA_KEPT_DAYS)
+
+
+def take_review_quota(username, limit, now=None):
+    """ Count one review against the user's week. False, without counting it, if they are already at limit """
+    now = now or datetime.utcnow()
+    try:
+        review_quotas.update_one(
+            {"_id": week_key(username, now), "count": {"$lt": limit}},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": quota_expiry(now)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def release_review_quota(username, created_at):
+    """ Give back the quota a review took, when it is deleted or could not be written """
+    review_quotas.update_one({"_id": week_key(username, created_at), "count": {"$gt": 0}}, {"$inc": {"count": -1}})
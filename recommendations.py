@@ -0,0 +1,192 @@
+from collections import Counter
+from datetime import datetime
+from pymongo import DESCENDING, ReturnDocument
+from shelves import shelved_book_ids
+import threading
+import queue
+import os
+import globals
+
+users = globals.db.users
+books = globals.db.books
+shelves = globals.db.shelves
+recommendations = globals.db.recommendations
+
+LIKED_STARS = 3.5 # have_read ratings above this count as liked
+CANDIDATE_POOL = 500 # Catalogue books scored per user
+RECOMMENDATIONS_KEPT = 200 # Scored candidates stored per user
+GENRE_WEIGHT = 1.0
+AUTHOR_WEIGHT = 2.0
+CO_READ_WEIGHT = 1.5
+SCORE_PRIOR_WEIGHT = 0.1 # Nudge towards well rated books when affinities tie
+
+# Set on a user by every handler that changes their shelves, favourites or favourite genres/authors
+STALE = {"recommendations_stale": True}
+# A list that was never computed counts as stale too
+NEEDS_REFRESH = {"$or": [{"recommendations_stale": True}, {"recommendations_at": {"$exists": False}}]}
+
+_queue = None
+_queued = set() # user ids waiting in this process's queue
+_queued_lock = threading.Lock()
+_started_pid = None
+_start_lock = threading.Lock()
+
+# RECOMMENDATIONS
+#------------------------------------------------------------------------------------------------------------------
+# Candidates are precomputed per user and stored as {user_id, book_id, score} so the endpoint is a single indexed,
+# paged read. A user's list is rebuilt from:
+#   - genre / author affinity: favourite genres and authors plus the genres and authors of liked have_read books
+#   - co-reads: books that other readers who liked the same books also liked
+# Handlers mark the user STALE when their shelves change. The endpoint keeps serving the stored list (empty the
+# first time) and queues the user for a background thread in the process, which rebuilds it off the request path.
+# python recommendations.py rebuilds every user offline.
+def _liked_ids(user):
+    liked = shelves.find({"user_id": user["_id"], "shelf": "have_read", "stars": {"$gt": LIKED_STARS}}, {"_id": 0, "book_id": 1})
+    return [entry["book_id"] for entry in liked]
+
+
+def _affinities(user, liked_ids):
+    genres, authors = Counter(), Counter()
+    for genre in user.get("favourite_genres", []):
+        genres[genre] += 2
+    for author in user.get("favourite_authors", []):
+        authors[author] += 2
+    for book in books.find({"_id": {"$in": liked_ids}}, {"genres": 1, "author": 1}):
+        genres.update(book.get("genres") or [])
+        authors.update(book.get("author") or [])
+    return genres, authors
+
+
+def _co_reads(user, liked_ids):
+    """ How many other readers liked each book, among those who liked one of the user's liked books """
+    if not liked_ids:
+        return Counter()
+    readers = shelves.distinct("user_id", {
+        "book_id": {"$in": liked_ids},
+        "shelf": "have_read",
+        "stars": {"$gt": LIKED_STARS},
+        "user_id": {"$ne": user["_id"]}
+    })
+    if not readers:
+        return Counter()
+    pipeline = [
+        {"$match": {"user_id": {"$in": readers}, "shelf": "have_read", "stars": {"$gt": LIKED_STARS}}},
+        {"$group": {"_id": "$book_id", "readers": {"$sum": 1}}}
+    ]
+    return Counter({result["_id"]: result["readers"] for result in shelves.aggregate(pipeline)})
+
+
+def score_candidates(user):
+    """ [(book_id, score)] best first, for the books the user has not shelved yet """
+    liked_ids = _liked_ids(user)
+    genres, authors = _affinities(user, liked_ids)
+    shelved = shelved_book_ids(user["_id"], ("have_read", "currently_reading", "want_to_read"))
+    co_reads = _co_reads(user, liked_ids)
+
+    candidate_query = {"$or": [
+        {"genres": {"$in": list(genres)}},
+        {"author": {"$in": list(authors)}},
+        {"_id": {"$in": list(co_reads)}}
+    ]}
+    if not (genres or authors or co_reads):
+        candidate_query = {} # Nothing to go on yet, fall back to the best rated books
+    candidates = books.find(candidate_query, {"genres": 1, "author": 1, "user_score": 1}) \
+        .sort("user_score", DESCENDING).limit(CANDIDATE_POOL)
+
+    genre_total = sum(genres.values()) or 1
+    author_total = sum(authors.values()) or 1
+    co_read_top = max(co_reads.values(), default=0) or 1
+
+    scored = []
+    for book in candidates:
+        if book["_id"] in shelved:
+            continue
+        score = (
+            GENRE_WEIGHT * sum(genres[genre] for genre in book.get("genres") or []) / genre_total
+            + AUTHOR_WEIGHT * sum(authors[author] for author in book.get("author") or []) / author_total
+            + CO_READ_WEIGHT * co_reads[book["_id"]] / co_read_top
+            + SCORE_PRIOR_WEIGHT * (book.get("user_score") or 0) / 5
+        )
+        scored.append((book["_id"], round(score, 4)))
+
+    scored.sort(key=lambda candidate: candidate[1], reverse=True)
+    return scored[:RECOMMENDATIONS_KEPT]
+
+
+def refresh_recommendations(user):
+    """ Rebuild and store one user's candidate list """
+    computed_at = datetime.utcnow()
+    # Cleared before computing, so a shelf change made meanwhile marks the list stale again
+    users.update_one({"_id": user["_id"]}, {"$set": {"recommendations_stale": False, "recommendations_at": computed_at}})
+    _store(user, computed_at)
+
+
+def _store(user, computed_at):
+    documents = [
+        {"user_id": user["_id"], "book_id": book_id, "score": score, "computed_at": computed_at}
+        for book_id, score in score_candidates(user)
+    ]
+    recommendations.delete_many({"user_id": user["_id"]})
+    if documents:
+        recommendations.insert_many(documents, ordered=False)
+
+
+def _ensure_started():
+    global _queue, _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _queue = queue.Queue()
+        _queued.clear()
+        threading.Thread(target=_worker, name="recommendations", daemon=True).start()
+        _started_pid = os.getpid()
+
+
+def _worker():
+    while True:
+        user_id = _queue.get()
+        with _queued_lock:
+            _queued.discard(user_id)
+        computed_at = datetime.utcnow()
+        # Claimed by clearing the flag, so a user queued in several workers is only rebuilt once
+        user = users.find_one_and_update(
+            {"_id": user_id, **NEEDS_REFRESH},
+            {"$set": {"recommendations_stale": False, "recommendations_at": computed_at}},
+            projection={"favourite_genres": 1, "favourite_authors": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            continue
+        try:
+            _store(user, computed_at)
+        except Exception as e:
+            users.update_one({"_id": user_id}, {"$set": STALE})
+            print(f"Could not refresh recommendations for {user_id}: {e}")
+
+
+def ensure_recommendations(user):
+    """ Queue a rebuild of a user's list if their shelves changed since it was computed (or it never was).
+        Returns whether one is pending, the caller serves the stored list meanwhile """
+    if not (user.get("recommendations_stale", True) or "recommendations_at" not in user):
+        return False
+    _ensure_started()
+    with _queued_lock:
+        if user["_id"] in _queued:
+            return True
+        _queued.add(user["_id"])
+    _queue.put(user["_id"])
+    return True
+
+
+def refresh_all():
+    refreshed = 0
+    for user in users.find({}, {"favourite_genres": 1, "favourite_authors": 1}):
+        refresh_recommendations(user)
+        refreshed += 1
+    print(f"Refreshed recommendations for {refreshed} users")
+
+
+if __name__ == "__main__":
+    refresh_all()
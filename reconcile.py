@@ -0,0 +1,118 @@
+from pymongo import UpdateOne
+from aggregation import review_counter_aggregation
+from facets import rebuild_facets
+from follows import follow_count_aggregation
+from cache import invalidate, book_scope, CATALOGUE
+from leaderboard import update_leaderboard, rebuild_leaderboard
+from releases import rebuild_new_releases
+import globals
+
+books = globals.db.books
+users = globals.db.users
+messages = globals.db.messages
+shelves = globals.db.shelves
+
+COUNTER_FIELDS = ("total_reviews", "positive_reviews", "user_score")
+
+# PERIODIC RECONCILIATION
+#------------------------------------------------------------------------------------------------------------------
+# The handlers keep running counters up to date on every write. This job recounts them from the source
+# collections and repairs any drift (e.g. a request that failed between its two writes). Schedule it with cron:
+#   */30 * * * * cd /path/to/Comnibus_BE && python reconcile.py
+def reconcile_review_counters():
+    """ Recount each book's review counters from the reviews collection and fix the ones that drifted """
+    counted = {result["_id"]: result for result in review_counter_aggregation()}
+
+    operations, repaired = [], []
+    for book in books.find({}, {field: 1 for field in COUNTER_FIELDS}):
+        expected = counted.get(book["_id"], {"total_reviews": 0, "positive_reviews": 0, "user_score": 0})
+        drifted = {field: expected[field] for field in COUNTER_FIELDS if book.get(field) != expected[field]}
+        if drifted:
+            operations.append(UpdateOne({"_id": book["_id"]}, {"$set": drifted}))
+            repaired.append(book["_id"])
+
+    if operations:
+        books.bulk_write(operations, ordered=False)
+        for book_id in repaired:
+            update_leaderboard(book_id)
+        invalidate(CATALOGUE, *[book_scope(book_id) for book_id in repaired])
+    print(f"Review counters: repaired {len(operations)} books")
+    return len(operations)
+
+
+def reconcile_follow_counters():
+    """ Recount followers_count / following_count from the follows collection """
+    counted = {
+        field: {result["_id"]: result["count"] for result in follow_count_aggregation(field)}
+        for field in ("followers_count", "following_count")
+    }
+
+    operations = []
+    for user in users.find({}, {"followers_count": 1, "following_count": 1}):
+        drifted = {
+            field: counts.get(user["_id"], 0)
+            for field, counts in counted.items() if user.get(field) != counts.get(user["_id"], 0)
+        }
+        if drifted:
+            operations.append(UpdateOne({"_id": user["_id"]}, {"$set": drifted}))
+
+    if operations:
+        users.bulk_write(operations, ordered=False)
+    print(f"Follow counters: repaired {len(operations)} users")
+    return len(operations)
+
+
+def reconcile_unread_counters():
+    """ Recount unread_messages from the messages collection """
+    counted = {
+        result["_id"]: result["count"]
+        for result in messages.aggregate([
+            {"$match": {"is_read": {"$ne": True}}},
+            {"$group": {"_id": "$recipient_name", "count": {"$sum": 1}}}
+        ])
+    }
+
+    operations = [
+        UpdateOne({"_id": user["_id"]}, {"$set": {"unread_messages": counted.get(user["username"], 0)}})
+        for user in users.find({}, {"username": 1, "unread_messages": 1})
+        if user.get("unread_messages") != counted.get(user["username"], 0)
+    ]
+    if operations:
+        users.bulk_write(operations, ordered=False)
+    print(f"Unread counters: repaired {len(operations)} users")
+    return len(operations)
+
+
+def reconcile_have_read_counters():
+    """ Recount have_read_count from the shelves collection """
+    counted = {
+        result["_id"]: result["count"]
+        for result in shelves.aggregate([
+            {"$match": {"shelf": "have_read"}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+        ])
+    }
+
+    operations = [
+        UpdateOne({"_id": user["_id"]}, {"$set": {"have_read_count": counted.get(user["_id"], 0)}})
+        for user in users.find({}, {"have_read_count": 1})
+        if user.get("have_read_count") != counted.get(user["_id"], 0)
+    ]
+    if operations:
+        users.bulk_write(operations, ordered=False)
+    print(f"Have read counters: repaired {len(operations)} users")
+    return len(operations)
+
+
+def reconcile_all():
+    reconcile_review_counters()
+    reconcile_follow_counters()
+    reconcile_unread_counters()
+    reconcile_have_read_counters()
+    rebuild_facets()
+    rebuild_leaderboard()
+    rebuild_new_releases()
+
+
+if __name__ == "__main__":
+    reconcile_all()
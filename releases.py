@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne
+from pagination import paginate
+import sys
+import globals
+
+books = globals.db.books
+new_releases = globals.db.new_releases
+
+NEW_RELEASE_DAYS = 365 # How far back the precomputed new releases list reaches
+MAX_RELEASE_DAYS = 10 * 365 # Longest window the new releases listing accepts
+DATE_FORMATS = ((10, "%Y-%m-%d"), (7, "%Y-%m"), (4, "%Y"))
+DATE_FIELDS = ("publishDate", "firstPublishDate")
+
+# NEW RELEASES
+#------------------------------------------------------------------------------------------------------------------
+# publishDate / firstPublishDate stay integer years for the clients that read them. The dates as submitted are kept
+# in releaseDates {publishDate: date, firstPublishDate: date}, and publishedAt is the later of the two (the old
+# "released this year" listing matched either), or an explicit publishedAt given when the book is edited. Dates
+# only known to the year (books stored before releaseDates existed) count from 1 January.
+# new_releases holds {_id: book_id, publishedAt} for every book published in the last NEW_RELEASE_DAYS, so
+# "released in the last N days, newest first" is one range read on (publishedAt, _id) with cursor paging and the
+# cards are joined with one $in. refresh_release(book_id) keeps the list current when books are added, approved,
+# edited or deleted. Run the rebuild daily so books age out of it:
+#   0 4 * * * cd /path/to/Comnibus_BE && python releases.py
+# python releases.py --backfill first sets publishedAt on the books stored before it existed.
+def parse_date(value):
+    """ A datetime from a year, "YYYY-MM" or "YYYY-MM-DD" (longer ISO strings are cut to the day) """
+    if isinstance(value, datetime):
+        return value
+    text = str(value).strip() if value is not None else ""
+    for length, date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text[:length], date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def release_dates(values):
+    """ {field: datetime} of the publish dates in values that parse, e.g. a submitted form or a stored book """
+    dates = {field: parse_date(values.get(field)) for field in DATE_FIELDS if values.get(field) is not None}
+    return {field: date for field, date in dates.items() if date}
+
+
+def published_at(book):
+    """ The later of a book's release dates, read from its year fields when it has no releaseDates """
+    dates = book.get("releaseDates") or release_dates(book)
+    return max(dates.values()) if dates else None
+
+
+def _is_new(date, now):
+    return date is not None and now - timedelta(days=NEW_RELEASE_DAYS) <= date <= now
+
+
+def refresh_release(book_id):
+    """ Add a book to the new releases list, or take it off, after it was added, edited or deleted """
+    book = books.find_one({"_id": ObjectId(book_id)}, {"publishedAt": 1})
+    if book and _is_new(book.get("publishedAt"), datetime.utcnow()):
+        new_releases.replace_one({"_id": book["_id"]}, {"publishedAt": book["publishedAt"]}, upsert=True)
+    else:
+        new_releases.delete_one({"_id": ObjectId(book_id)})
+
+
+def recent_releases(days, query=None):
+    """ (documents, next_cursor) of the books published in the last days, newest first, for the current request.
+        Read from the precomputed list when it reaches that far back and there is no other filter """
+    now = datetime.utcnow()
+    window = {"publishedAt": {"$gte": now - timedelta(days=days), "$lte": now}}
+    if query or days > NEW_RELEASE_DAYS:
+        return paginate(books, {**window, **(query or {})}, sort=[("publishedAt", -1)], projection={"publishedAt": 1})
+    return paginate(new_releases, window, sort=[("publishedAt", -1)])
+
+
+def rebuild_new_releases():
+    now = datetime.utcnow()
+    since = now - timedelta(days=NEW_RELEASE_DAYS)
+    operations = [
+        ReplaceOne({"_id": book["_id"]}, {"publishedAt": book["publishedAt"]}, upsert=True)
+        for book in books.find({"publishedAt": {"$gte": since, "$lte": now}}, {"publishedAt": 1})
+    ]
+    if operations:
+        new_releases.bulk_write(operations, ordered=False)
+    new_releases.delete_many({"$or": [{"publishedAt": {"$lt": since}}, {"publishedAt": {"$gt": now}}]})
+    print(f"New releases: {len(operations)} books published in the last {NEW_RELEASE_DAYS} days")
+
+
+def backfill_published_at():
+    operations = [
+        UpdateOne({"_id": book["_id"]}, {"$set": {"releaseDates": release_dates(book), "publishedAt": published_at(book)}})
+        for book in books.find({"publishedAt": {"$exists": False}}, {"publishDate": 1, "firstPublishDate": 1})
+    ]
+    if operations:
+        books.bulk_write(operations, ordered=False)
+    print(f"Set publishedAt on {len(operations)} books")
+
+
+if __name__ == "__main__":
+    if "--backfill" in sys.argv:
+        backfill_published_at()
+    rebuild_new_releases()
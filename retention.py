@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+from bson import json_util
+import gzip
+import sys
+import os
+import globals
+
+db = globals.db
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+ARCHIVE_BATCH = 1000
+
+# collection -> (default days kept, filter for the documents that may be archived once older than that)
+RETENTION_POLICIES = {
+    # Only read messages, an unread one stays in the inbox however old it is
+    "messages": (90, lambda cutoff: {"is_read": True, "timestamp": {"$lt": cutoff}}),
+    "reports": (180, lambda cutoff: {"status": {"$in": ["approved", "rejected"]}, "resolved_at": {"$lt": cutoff}}),
+    "deleted_accounts": (365, lambda cutoff: {"timestamp": {"$lt": cutoff}}),
+    # Feed entries, older activities stay in `activities`
+    "timelines": (90, lambda cutoff: {"timestamp": {"$lt": cutoff}}),
+}
+# Fanned-out copies of documents kept elsewhere, deleted without being archived
+NOT_ARCHIVED = {"timelines"}
+
+# RETENTION / ARCHIVAL
+#------------------------------------------------------------------------------------------------------------------
+# Read messages, resolved reports and deleted-account feedback are moved out of the hot collections once they are
+# older than their policy allows. Each run appends them to a gzipped JSON-lines file per collection and day,
+#   archive/<collection>/<YYYY-MM-DD>.jsonl.gz
+# and only deletes a batch after it has been written to the archive. Timeline entries are copies of activities, one
+# per follower, so they are deleted without an archive: a feed reaches back 90 days and timelines don't grow with
+# posts x followers forever. Schedule it with cron:
+#   15 2 * * * cd /path/to/Comnibus_BE && python retention.py
+# python retention.py --dry-run only reports what would be archived.
+# Each window can be changed from the environment, RETENTION_MESSAGES_DAYS=30, or for one run with a flag,
+# --messages-days=30 (--reports-days=, --deleted-accounts-days=, --timelines-days=). The flag wins over the environment.
+def retention_days(argv=()):
+    """ {collection: days kept} from the defaults, the environment and the command line """
+    days = {}
+    for collection_name, (default, _) in RETENTION_POLICIES.items():
+        value = os.environ.get(f"RETENTION_{collection_name.upper()}_DAYS", default)
+        flag = f"--{collection_name.replace('_', '-')}-days="
+        for arg in argv:
+            if arg.startswith(flag):
+                value = arg[len(flag):]
+        try:
+            days[collection_name] = int(value)
+        except ValueError:
+            raise ValueError(f"Retention of {collection_name} must be a number of days, got {value!r}")
+        if days[collection_name] <= 0:
+            raise ValueError(f"Retention of {collection_name} must be at least one day, got {value!r}")
+    return days
+
+
+def _archive_path(collection_name, now):
+    directory = os.path.join(ARCHIVE_DIR, collection_name)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{now:%Y-%m-%d}.jsonl.gz")
+
+
+def archive_collection(collection_name, query, dry_run=False, now=None):
+    """ Archive and remove the documents matching query. Returns how many were (or would be) archived """
+    now = now or datetime.utcnow()
+    collection = db[collection_name]
+    if dry_run:
+        return collection.count_documents(query)
+    if collection_name in NOT_ARCHIVED:
+        return collection.delete_many(query).deleted_count
+
+    archived = 0
+    path = _archive_path(collection_name, now)
+    while True:
+        batch = list(collection.find(query).sort("_id", 1).limit(ARCHIVE_BATCH))
+        if not batch:
+            break
+
+        # Appending starts a new gzip member, which gzip readers handle as one continuous stream
+        with gzip.open(path, "at", encoding="utf-8") as archive:
+            for document in batch:
+                archive.write(json_util.dumps(document) + "\n")
+            archive.flush()
+            os.fsync(archive.fileno())
+
+        collection.delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+        archived += len(batch)
+    return archived
+
+
+def enforce_retention(dry_run=False, days_kept=None):
+    now = datetime.utcnow()
+    days_kept = days_kept or retention_days()
+    for collection_name, (_, policy) in RETENTION_POLICIES.items():
+        days = days_kept[collection_name]
+        cutoff = now - timedelta(days=days)
+        count = archive_collection(collection_name, policy(cutoff), dry_run, now)
+        verb = "remove" if collection_name in NOT_ARCHIVED else "archive"
+        verb = f"Would {verb}" if dry_run else f"{verb.capitalize()}d"
+        print(f"{verb} {count} {collection_name} older than {days} days")
+
+
+def read_archive(path):
+    """ Iterate the documents of an archive file """
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            yield json_util.loads(line)
+
+
+if __name__ == "__main__":
+    try:
+        days_kept = retention_days(sys.argv[1:])
+    except ValueError as e:
+        sys.exit(str(e))
+    enforce_retention(dry_run="--dry-run" in sys.argv, days_kept=days_kept)
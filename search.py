@@ -0,0 +1,130 @@
+from pymongo import UpdateOne, DESCENDING
+import unicodedata
+import time
+import re
+import globals
+
+books = globals.db.books
+
+SEARCH_FIELDS = {"title": 5, "series": 3, "author": 4, "characters": 2, "genres": 1} # field -> ranking weight
+FILTER_FIELDS = ("title", "author", "genres", "characters") # query string filters of the book listings
+SEARCH_CANDIDATES = 500 # Most matching books ranked for a single search
+SEARCH_LATENCY_TARGET_MS = 100
+
+# BOOK SEARCH
+#------------------------------------------------------------------------------------------------------------------
+# Every book carries a multikey `search_keys` array, a small inverted index built from its searchable fields:
+#   "harry", "potter", ...                   every token, for free text search
+#   "title:harry", "author:rowling", ...      the same tokens scoped to the field they came from, for the filters
+# Queries only ever match whole tokens, or an anchored prefix of the last token for type-ahead ("^title:pot"), so
+# they are served by the search_keys index and user input is never run as a regex.
+def tokenize(text):
+    """ Lower-cased, accent-free alphanumeric tokens, e.g. "Brontë, C." -> ["bronte", "c"] """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _field_values(book, field):
+    value = book.get(field)
+    return value if isinstance(value, list) else [value]
+
+
+def search_keys(book):
+    """ The search_keys array for a book document """
+    keys = set()
+    for field in SEARCH_FIELDS:
+        for value in _field_values(book, field):
+            for token in tokenize(value):
+                keys.add(token)
+                keys.add(f"{field}:{token}")
+    return sorted(keys)
+
+
+def _token_conditions(tokens, scope=""):
+    """ All tokens must match, the last one as a prefix so partially typed words still find results """
+    if not tokens:
+        return []
+    conditions = [{"search_keys": {"$regex": f"^{scope}{tokens[-1]}"}}]
+    if tokens[:-1]:
+        conditions.append({"search_keys": {"$all": [f"{scope}{token}" for token in tokens[:-1]]}})
+    return conditions
+
+
+def apply_filters(query, args):
+    """ Add the ?title=&author=&genres=&characters= filters of a listing to its query """
+    conditions = []
+    for field in FILTER_FIELDS:
+        conditions.extend(_token_conditions(tokenize(args.get(field)), f"{field}:"))
+    if conditions:
+        query.setdefault("$and", []).extend(conditions)
+    return query
+
+
+def _score(keys, tokens):
+    score = 0
+    for i, token in enumerate(tokens):
+        is_prefix = i == len(tokens) - 1
+        best = 0
+        for field, weight in SEARCH_FIELDS.items():
+            scoped = f"{field}:{token}"
+            if scoped in keys:
+                best = max(best, weight)
+            elif is_prefix and any(key.startswith(scoped) for key in keys):
+                best = max(best, weight / 2)
+        score += best
+    return score
+
+
+def search_books(text, args, projection, limit):
+    """ (ranked books, number of matches, milliseconds taken) for a free text search plus listing filters """
+    started = time.perf_counter()
+    tokens = tokenize(text)
+
+    query = {"$and": _token_conditions(tokens)} if tokens else {}
+    apply_filters(query, args)
+
+    # Ties on relevance go to the better rated book, which is also the order candidates are fetched in
+    candidates = list(
+        books.find(query, {**projection, "search_keys": 1, "user_score": 1})
+        .sort("user_score", DESCENDING)
+        .limit(SEARCH_CANDIDATES)
+    )
+    for book in candidates:
+        book["score"] = _score(set(book.pop("search_keys", [])), tokens)
+    candidates.sort(key=lambda book: (book["score"], book.get("user_score") or 0), reverse=True)
+    # Only the first SEARCH_CANDIDATES are ranked, count the rest so the total stays honest
+    total = len(candidates) if len(candidates) < SEARCH_CANDIDATES else books.count_documents(query)
+
+    took_ms = round((time.perf_counter() - started) * 1000, 1)
+    if took_ms > SEARCH_LATENCY_TARGET_MS:
+        print(f"Slow search ({took_ms}ms > {SEARCH_LATENCY_TARGET_MS}ms): {text!r} {dict(args)}")
+    return candidates[:limit], total, took_ms
+
+
+def rebuild_search_keys(query=None):
+    """ (Re)build search_keys for every book matching query, all of them by default. Returns how many """
+    fields = {field: 1 for field in SEARCH_FIELDS}
+    operations = [
+        UpdateOne({"_id": book["_id"]}, {"$set": {"search_keys": search_keys(book)}})
+        for book in books.find(query or {}, fields)
+    ]
+    if operations:
+        books.bulk_write(operations, ordered=False)
+    print(f"Indexed {len(operations)} books for search")
+    return len(operations)
+
+
+def backfill_search_keys():
+    """ Run at startup: index the books that have no search_keys yet, the whole catalogue on the first deploy of
+        search and bulk-imported books after that. Looked up through the search_keys index, so it costs nothing
+        once every book is indexed """
+    if books.find_one({"search_keys": None}, {"_id": 1}):
+        rebuild_search_keys({"search_keys": None})
+
+
+if __name__ == "__main__":
+    # python search.py -> rebuild search_keys for the whole catalogue, e.g. after changing SEARCH_FIELDS
+    rebuild_search_keys()
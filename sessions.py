@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from bson import ObjectId
+import threading
+import uuid
+import time
+import globals
+
+users = globals.db.users
+
+SESSION_CACHE_TTL = 30  # seconds
+SESSION_CACHE_SIZE = 10000
+PROFILE_FIELDS = {"name": 1, "username": 1, "admin": 1, "user_type": 1, "followers_count": 1, "following_count": 1,
+                  "created_at": 1}
+
+_sessions = OrderedDict()  # session id -> (profile, fresh until)
+_session_lock = threading.Lock()
+
+# SESSION PROFILE CACHE
+#------------------------------------------------------------------------------------------------------------------
+# Tokens only carry a fixed claim set (uid, username, admin, user_type, sid, exp). Anything else a handler needs
+# about the caller, such as their display name, is read from the user document once per session and kept here for
+# SESSION_CACHE_TTL seconds, so it is never more than that out of date and no token grows with the account.
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def session_profile(token_data):
+    """ The caller's profile fields for a verified token """
+    # Tokens issued before the slim claims have no sid/uid, they are cached by username instead
+    key = token_data.get("sid") or token_data["username"]
+    now = time.time()
+
+    with _session_lock:
+        cached = _sessions.get(key)
+        if cached is not None and now < cached[1]:
+            _sessions.move_to_end(key)
+            return cached[0]
+
+    query = {"_id": ObjectId(token_data["uid"])} if "uid" in token_data else {"username": token_data["username"]}
+    profile = users.find_one(query, PROFILE_FIELDS) or {}
+
+    with _session_lock:
+        _sessions[key] = (profile, now + SESSION_CACHE_TTL)
+        _sessions.move_to_end(key)
+        while len(_sessions) > SESSION_CACHE_SIZE:
+            _sessions.popitem(last=False)
+    return profile
+
+
+def end_session(token_data):
+    """ Drop a session's cached profile, on logout or after the user edits their profile """
+    with _session_lock:
+        _sessions.pop(token_data.get("sid") or token_data["username"], None)
@@ -0,0 +1,134 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import InsertOne, DeleteOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pagination import paginate
+import globals
+
+shelves = globals.db.shelves
+books = globals.db.books
+
+SHELVES = ("have_read", "want_to_read", "currently_reading", "favourite_books")
+SHELF_PAGE_SIZE = 50
+BOOK_FIELDS = {"title": 1, "coverImg": 1, "author": 1, "genres": 1, "pages": 1} # Joined onto entries when read
+ENTRY_KEYS = ("_id", "user_id", "shelf", "book_id")
+
+# BOOKSHELVES
+#------------------------------------------------------------------------------------------------------------------
+# One {user_id, shelf, book_id} entry per shelved book instead of have_read / want_to_read / currently_reading /
+# favourite_books arrays on the user document. Entries are unique on (user_id, shelf, book_id), so adding, removing
+# and "is it on my shelf" are single index operations, and a shelf pages on (user_id, shelf, added_at, _id).
+# An entry only keeps what belongs to the shelf (stars and date_read, reading progress...):
+#   {user_id, shelf, book_id, added_at, stars?, date_read?, reading_time?, total_pages?, current_page?, progress?}
+# The title, cover, author, genres and pages are joined from books with one $in per page when a shelf is read, so
+# they can't go stale when a book is edited. Responses keep the old array entry shape, with the book id as _id.
+# The unique index makes every mutation a single conditional write, so concurrent requests can't double-shelve.
+def _book_id(book_id):
+    return ObjectId(book_id) if ObjectId.is_valid(book_id) else book_id
+
+
+def _key(user_id, shelf, book_id):
+    return {"user_id": user_id, "shelf": shelf, "book_id": _book_id(book_id)}
+
+
+def add_to_shelf(user_id, shelf, book_id, **fields):
+    """ Put a book on a shelf. False if it was already there """
+    try:
+        shelves.insert_one({**_key(user_id, shelf, book_id), "added_at": datetime.utcnow(), **fields})
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def remove_from_shelf(user_id, shelf, book_id):
+    """ Take a book off a shelf. False if it wasn't on it """
+    return shelves.delete_one(_key(user_id, shelf, book_id)).deleted_count == 1
+
+
+def move_to_shelf(user_id, from_shelf, shelf, book_id, **fields):
+    """ Put a book on a shelf and take it off from_shelf in one ordered bulk write. False if it was already there """
+    try:
+        shelves.bulk_write([
+            InsertOne({**_key(user_id, shelf, book_id), "added_at": datetime.utcnow(), **fields}),
+            DeleteOne(_key(user_id, from_shelf, book_id))
+        ], ordered=True)
+    except BulkWriteError as e:
+        if any(error["code"] == 11000 for error in e.details.get("writeErrors", [])):
+            return False # The insert failed, so the ordered write stopped before the delete
+        raise
+    return True
+
+
+def update_shelf_entry(user_id, shelf, book_id, fields, condition=None):
+    """ Set fields on a shelf entry that also matches condition. Returns the updated entry, None if none matched """
+    return shelves.find_one_and_update({**_key(user_id, shelf, book_id), **(condition or {})}, {"$set": fields},
+                                       return_document=ReturnDocument.AFTER)
+
+
+def has_entry(user_id, shelf, book_id):
+    return shelves.find_one(_key(user_id, shelf, book_id), {"_id": 1}) is not None
+
+
+def clear_shelf(user_id, shelf):
+    return shelves.delete_many({"user_id": user_id, "shelf": shelf}).deleted_count
+
+
+def join_books(entries):
+    """ Entries in the API shape: the book's fields plus the entry's own. Entries of deleted books are dropped """
+    cards = {book["_id"]: book for book in books.find({"_id": {"$in": [entry["book_id"] for entry in entries]}}, BOOK_FIELDS)}
+    joined = []
+    for entry in entries:
+        book = cards.get(entry["book_id"])
+        if book is None:
+            continue
+        item = {field: book.get(field) for field in BOOK_FIELDS}
+        item.update({field: value for field, value in entry.items() if field not in ENTRY_KEYS})
+        item["_id"] = str(entry["book_id"])
+        joined.append(item)
+    return joined
+
+
+def shelf_entry(user_id, shelf, book_id):
+    """ One joined entry, or None if the book isn't on the shelf """
+    entry = shelves.find_one(_key(user_id, shelf, book_id))
+    joined = join_books([entry]) if entry else []
+    return joined[0] if joined else None
+
+
+def shelf_page(user_id, shelf):
+    """ (joined entries, next_cursor) for the page of a shelf the current request asks for, newest first """
+    page, next_cursor = paginate(shelves, {"user_id": user_id, "shelf": shelf}, sort=[("added_at", -1)],
+                                 default_page_size=SHELF_PAGE_SIZE)
+    return join_books(page), next_cursor
+
+
+def recent_entries(user_id, shelf, limit=SHELF_PAGE_SIZE):
+    entries = shelves.find({"user_id": user_id, "shelf": shelf}).sort([("added_at", -1), ("_id", -1)]).limit(limit)
+    return join_books(list(entries))
+
+
+def shelf_counts(user_id):
+    """ {shelf: number of books} for every shelf """
+    counts = dict.fromkeys(SHELVES, 0)
+    for result in shelves.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$shelf", "count": {"$sum": 1}}}
+    ]):
+        counts[result["_id"]] = result["count"]
+    return counts
+
+
+def shelved_book_ids(user_id, shelf_names=SHELVES):
+    """ ObjectIds of the books on any of the given shelves """
+    return {
+        entry["book_id"]
+        for entry in shelves.find({"user_id": user_id, "shelf": {"$in": list(shelf_names)}}, {"_id": 0, "book_id": 1})
+    }
+
+
+def remove_user_shelves(user_id):
+    shelves.delete_many({"user_id": user_id})
+
+
+def remove_book_from_shelves(book_id):
+    shelves.delete_many({"book_id": _book_id(book_id)})
@@ -0,0 +1,106 @@
+from datetime import datetime
+from pymongo import ReplaceOne
+from scipy import sparse
+import numpy as np
+from cache import invalidate, NEIGHBOURS
+import globals
+
+books = globals.db.books
+shelves = globals.db.shelves
+book_neighbours = globals.db.book_neighbours
+
+SHELF_WEIGHTS = {"have_read": 1.0, "favourite_books": 1.5, "want_to_read": 0.5}
+NEIGHBOURS_KEPT = 10 # Top-K similar books stored per book
+MIN_CO_READERS = 2 # Pairs shelved together by fewer readers than this are treated as noise
+
+# "READERS ALSO READ"
+#------------------------------------------------------------------------------------------------------------------
+# Nightly batch job: builds a sparse readers x books matrix from every shelf entry (weighted per shelf), turns it
+# into a book x book co-occurrence matrix with one sparse product, cosine-normalises it and keeps the top
+# NEIGHBOURS_KEPT neighbours of each book. They are stored with the fields a book card needs, one document per book
+# keyed by the book's _id, so the book page reads them with a single _id lookup:
+#   {_id: book_id, neighbours: [{_id, title, author, coverImg, score}], computed_at}
+# Run it from cron:  0 3 * * * cd /path/to/Comnibus_BE && python similarity.py
+def shelf_matrix():
+    """ (readers x books CSR matrix of shelf weights, ObjectId of each column) """
+    book_ids = [book["_id"] for book in books.find({}, {"_id": 1})]
+    column = {str(book_id): i for i, book_id in enumerate(book_ids)}
+
+    reader_rows = {} # user_id -> row
+    rows, cols, weights = [], [], []
+    entries = shelves.find({"shelf": {"$in": list(SHELF_WEIGHTS)}}, {"_id": 0, "user_id": 1, "shelf": 1, "book_id": 1})
+    for entry in entries:
+        book_id = str(entry["book_id"])
+        if book_id in column:
+            rows.append(reader_rows.setdefault(entry["user_id"], len(reader_rows)))
+            cols.append(column[book_id])
+            weights.append(SHELF_WEIGHTS[entry["shelf"]])
+
+    readers = len(reader_rows)
+    # Duplicate (reader, book) entries, e.g. read and favourited, are summed
+    matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(readers, len(book_ids)), dtype=np.float32)
+    return matrix, book_ids
+
+
+def neighbour_matrix(matrix):
+    """ Book x book cosine similarity of the shelf matrix, keeping only pairs with MIN_CO_READERS """
+    co_occurrence = (matrix.T @ matrix).tocsr()
+    co_readers = ((matrix > 0).astype(np.float32).T @ (matrix > 0).astype(np.float32)).tocsr()
+
+    norms = np.sqrt(co_occurrence.diagonal())
+    norms[norms == 0] = 1
+    inverse = sparse.diags(1 / norms)
+    similarity = (inverse @ co_occurrence @ inverse).tocsr()
+
+    similarity = similarity.multiply(co_readers >= MIN_CO_READERS).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+    return similarity
+
+
+def top_neighbours(similarity, k=NEIGHBOURS_KEPT):
+    """ {column: [(neighbour column, score)]} best first """
+    top = {}
+    for i in range(similarity.shape[0]):
+        start, end = similarity.indptr[i], similarity.indptr[i + 1]
+        if start == end:
+            continue
+        scores = similarity.data[start:end]
+        columns = similarity.indices[start:end]
+        best = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        best = best[np.argsort(-scores[best])]
+        top[i] = [(int(columns[j]), round(float(scores[j]), 4)) for j in best]
+    return top
+
+
+def build_neighbours():
+    matrix, book_ids = shelf_matrix()
+    top = top_neighbours(neighbour_matrix(matrix))
+
+    neighbour_ids = list({book_ids[column] for neighbours in top.values() for column, _ in neighbours})
+    cards = {book["_id"]: book for book in books.find({"_id": {"$in": neighbour_ids}}, {"title": 1, "author": 1, "coverImg": 1})}
+
+    computed_at = datetime.utcnow()
+    operations = []
+    for column, neighbours in top.items():
+        entries = []
+        for neighbour, score in neighbours:
+            card = cards.get(book_ids[neighbour])
+            if card:
+                entries.append({**card, "score": score})
+        operations.append(ReplaceOne(
+            {"_id": book_ids[column]},
+            {"neighbours": entries, "computed_at": computed_at},
+            upsert=True
+        ))
+
+    if operations:
+        book_neighbours.bulk_write(operations, ordered=False)
+    # Books that lost all their neighbours (or were deleted) since the last run
+    book_neighbours.delete_many({"computed_at": {"$lt": computed_at}})
+    invalidate(NEIGHBOURS)
+    print(f"Stored neighbours for {len(operations)} of {len(book_ids)} books from {matrix.shape[0]} readers")
+
+
+if __name__ == "__main__":
+    build_neighbours()
@@ -0,0 +1,123 @@
+from datetime import datetime
+from pymongo import UpdateOne, DESCENDING
+import threading
+import atexit
+import math
+import time
+import os
+import globals
+
+trending = globals.db.trending
+
+EVENT_WEIGHTS = {"review": 3.0, "have_read": 2.0, "currently_reading": 2.0, "want_to_read": 1.0}
+WINDOWS = {"24h": 24 * 3600, "7d": 7 * 24 * 3600, "30d": 30 * 24 * 3600} # Decay time constant of each window
+EPOCH = datetime(2025, 1, 1) # Fixed reference time of the stored log scores
+FLUSH_INTERVAL = 10 # Seconds between writes of a worker's pending counters
+MIN_SCORE = 0.05 # Books whose decayed score fell below this are no longer trending
+TRENDING_SIZE = 10
+MAX_TRENDING_SIZE = 50
+
+_pending = {} # book ObjectId -> {window: log of the score added since the last flush}
+_pending_lock = threading.Lock()
+_started_pid = None
+_start_lock = threading.Lock()
+
+# TRENDING BOOKS
+#------------------------------------------------------------------------------------------------------------------
+# Reviews and shelf adds are events with a weight. A book's score in a window is the sum of its event weights, each
+# decayed by exp(-age / window), so a window forgets at its own pace. Decaying every stored score as time passes
+# would mean rewriting them all. Instead each event is counted as weight * exp((t - EPOCH) / window): every score
+# then decays by the same factor, so their order never changes and only new events are written. The numbers grow
+# without bound, so they are kept as logs and added with log-sum-exp:
+#   {_id: book_id, scores: {"24h": ln(score), "7d": ..., "30d": ...}, updated_at}
+# With an index per window the trending list is one index read of the top entries, whatever the catalogue size.
+# Events are summed in memory per worker and flushed every FLUSH_INTERVAL seconds by a background thread.
+def _log_add(a, b):
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def _now_offset(now=None):
+    return ((now or datetime.utcnow()) - EPOCH).total_seconds()
+
+
+def record_event(book_id, event, now=None):
+    """ Count a review or shelf add towards the book's trending scores """
+    _ensure_started()
+    offset = _now_offset(now)
+    weight = math.log(EVENT_WEIGHTS[event])
+    with _pending_lock:
+        scores = _pending.setdefault(book_id, {})
+        for window, seconds in WINDOWS.items():
+            scores[window] = _log_add(scores.get(window), weight + offset / seconds)
+
+
+def _log_add_expression(field, value):
+    """ ln(exp(field) + exp(value)) for a pipeline update, or value when the field is not set yet """
+    return {"$let": {
+        "vars": {"old": {"$ifNull": [f"${field}", None]}},
+        "in": {"$cond": [
+            {"$eq": ["$$old", None]},
+            value,
+            {"$let": {
+                "vars": {"high": {"$max": ["$$old", value]}, "low": {"$min": ["$$old", value]}},
+                "in": {"$add": ["$$high", {"$ln": {"$add": [1, {"$exp": {"$subtract": ["$$low", "$$high"]}}]}}]}
+            }}
+        ]}
+    }}
+
+
+def flush():
+    """ Merge this worker's pending counters into the stored scores """
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+
+    updated_at = datetime.utcnow()
+    try:
+        trending.bulk_write([
+            UpdateOne({"_id": book_id}, [{"$set": {
+                **{f"scores.{window}": _log_add_expression(f"scores.{window}", value) for window, value in scores.items()},
+                "updated_at": updated_at
+            }}], upsert=True)
+            for book_id, scores in pending.items()
+        ], ordered=False)
+    except Exception as e:
+        print(f"Trending flush of {len(pending)} books failed: {e}")
+
+
+def _flusher():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def _ensure_started():
+    global _pending, _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _pending = {} # Counters copied from the parent by a fork are the parent's to flush
+        threading.Thread(target=_flusher, name="trending-flusher", daemon=True).start()
+        _started_pid = os.getpid()
+
+
+def trending_books(window, limit=TRENDING_SIZE, now=None):
+    """ [(book_id, current score)] best first """
+    seconds = WINDOWS[window]
+    # A stored log score minus the current offset is the log of the score decayed to now
+    offset = _now_offset(now) / seconds
+    cursor = trending.find(
+        {f"scores.{window}": {"$gt": offset + math.log(MIN_SCORE)}},
+        {f"scores.{window}": 1}
+    ).sort(f"scores.{window}", DESCENDING).limit(min(limit, MAX_TRENDING_SIZE))
+    return [(entry["_id"], round(math.exp(entry["scores"][window] - offset), 3)) for entry in cursor]
+
+
+atexit.register(flush)